@@ -0,0 +1,67 @@
+"""Benchmark of the rendering of SingleBars charts.
+
+Run with ``python -m benchmarks.bench_bars`` from the root of the repository.
+The throughput, in charts per second, of creating and exporting a SingleBars
+per poll is compared with mapache.vis.render_bars in one and several
+processes.
+"""
+
+import datetime
+import os
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pylab as plt
+import numpy as np
+
+import mapache
+from mapache.synthetic import SyntheticParty
+
+colors = {'PP': (0, 90, 160), 'PSOE': (220, 20, 30),
+          'Podemos': (100, 40, 100), 'Cs': (240, 120, 40),
+          'IU': (160, 0, 0), 'ERC': (250, 200, 0)}
+
+
+def create_data(n_polls=200, seed=0):
+    """Parties and random polls."""
+    parties = mapache.PartySet()
+    for name in colors:
+        parties.add(SyntheticParty(name, colors[name]))
+
+    random_state = np.random.RandomState(seed)
+    polls = mapache.PollsList('benchmark')
+    start = datetime.datetime(2016, 1, 1)
+    for i in range(n_polls):
+        votes = random_state.dirichlet(np.ones(len(colors)) * 5) * 100
+        polls.add(mapache.Poll(dict(zip(colors, np.round(votes, 1))),
+                               start + datetime.timedelta(i), 'Pollster'))
+    return polls, parties
+
+
+def single_bars(polls, parties, directory):
+    for i, poll in enumerate(polls.polls):
+        bars = mapache.vis.SingleBars(poll, parties)
+        bars.export(os.path.join(directory, 'poll-{0:04d}.png'.format(i)))
+        plt.close(bars._fig)
+
+
+def main(n_polls=200):
+    polls, parties = create_data(n_polls)
+    runs = [('SingleBars', single_bars),
+            ('render_bars, 1 process',
+             lambda *args: mapache.vis.render_bars(*args, processes=1)),
+            ('render_bars, {0} processes'.format(os.cpu_count()),
+             lambda *args: mapache.vis.render_bars(*args))]
+
+    for name, run in runs:
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            run(polls, parties, directory)
+            seconds = time.perf_counter() - start
+        print('{0:28} {1:8.1f} charts/s'.format(name, n_polls / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Benchmark of the color extraction methods of mapache.Party.
+
+Run with ``python -m benchmarks.bench_color`` from the root of the repository.
+The time of each method and the distance (RGB, 0 to 1) between its color and
+the color of the 'kmeans' method are reported for each logo.
+"""
+
+import os
+import timeit
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import mapache
+
+doc_dir = os.path.join(os.path.dirname(__file__), '..', 'doc', 'source')
+
+methods = ['kmeans', 'histogram']
+
+
+def resize(img):
+    """Resize an image as mapache.Party._get_image does."""
+    w, h = img.size
+    return img.resize((240, int(h / w * 240)), Image.ANTIALIAS)
+
+
+def logos():
+    """Logos to extract the colors from, local files and synthetic ones."""
+    images = {'mapache.png': resize(Image.open(os.path.join(doc_dir,
+                                                            'mapache.png')))}
+
+    img = Image.new('RGB', (480, 240), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((120, 20, 320, 220), fill=(0, 85, 165))
+    draw.rectangle((20, 100, 460, 140), fill=(220, 30, 40))
+    images['circle_and_band'] = resize(img)
+
+    img = Image.new('RGBA', (400, 400), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.polygon([(200, 10), (390, 390), (10, 390)], fill=(100, 40, 130, 255))
+    draw.rectangle((150, 250, 250, 350), fill=(255, 255, 255, 255))
+    images['transparent_triangle'] = resize(img)
+
+    gradient = np.zeros((200, 400, 3), dtype=np.uint8)
+    gradient[..., 1] = np.linspace(90, 200, 400)[np.newaxis, :]
+    gradient[..., 2] = 40
+    images['green_gradient'] = resize(Image.fromarray(gradient))
+    return images
+
+
+def main(repeat=5):
+    party = mapache.Party.__new__(mapache.Party)
+    print('{0:22} {1:>10} {2:>12} {3:>9}'.format('logo', 'method',
+                                                  'time (ms)', 'distance'))
+    for name, img in sorted(logos().items()):
+        reference = party._get_color(img, method='kmeans')
+        for method in methods:
+            seconds = min(timeit.repeat(
+                lambda: party._get_color(img, method=method),
+                number=1, repeat=repeat))
+            color = party._get_color(img, method=method)
+            distance = np.linalg.norm(np.array(color) - reference)
+            print('{0:22} {1:>10} {2:12.2f} {3:9.3f}'.format(
+                name, method, seconds * 1000, distance))
+
+
+if __name__ == '__main__':
+    main()
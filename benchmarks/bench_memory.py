@@ -0,0 +1,57 @@
+"""Memory benchmark of mapache.Poll and mapache.CompactPoll.
+
+Run with ``python -m benchmarks.bench_memory`` from the root of the
+repository. The memory (measured with tracemalloc) of a PollsList with many
+polls is reported in bytes per poll, storing the polls as mapache.Poll and
+as mapache.CompactPoll (``PollsList(compact=True)``).
+"""
+
+import datetime
+import gc
+import tracemalloc
+
+import numpy as np
+
+import mapache
+
+parties = ['Partido Popular', 'PSOE', 'Podemos', 'Ciudadanos',
+           'Izquierda Unida', 'ERC', 'CDC', 'PNV', 'EH Bildu', 'CC']
+
+
+def create_polls(n_polls, n_parties, seed=0):
+    """Random polls, as they would come from a parser (new dicts and
+    strings for each poll)."""
+    random_state = np.random.RandomState(seed)
+    start = datetime.datetime(1980, 1, 1)
+    for i in range(n_polls):
+        votes = random_state.dirichlet(np.ones(n_parties)) * 100
+        names = [''.join(name) for name in parties[:n_parties]]
+        yield mapache.Poll(dict(zip(names, np.round(votes, 1).tolist())),
+                           start + datetime.timedelta(days=i),
+                           'Pollster {0}'.format(i % 20))
+
+
+def bytes_per_poll(n_polls, n_parties, compact):
+    gc.collect()
+    tracemalloc.start()
+    polls = mapache.PollsList('benchmark', compact=compact)
+    for poll in create_polls(n_polls, n_parties):
+        polls.add(poll)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / n_polls
+
+
+def main(n_polls=20000):
+    print('{0:>8} {1:>10} {2:>12} {3:>9}'.format('parties', 'Poll',
+                                                 'CompactPoll', 'ratio'))
+    for n_parties in [4, 10]:
+        before = bytes_per_poll(n_polls, n_parties, compact=False)
+        after = bytes_per_poll(n_polls, n_parties, compact=True)
+        print('{0:8} {1:10.0f} {2:12.0f} {3:9.2f}'.format(
+            n_parties, before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
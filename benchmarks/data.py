@@ -0,0 +1,92 @@
+"""Offline data for the benchmarks.
+
+The parties are mapache.synthetic.SyntheticParty, with solid logos instead of
+downloaded ones, ``fixtures/logos`` has their real logos (for the color
+benchmarks) and ``fixtures/opinion_polls.html`` is a recorded Wikipedia table
+of polls (120 rows) that can be replicated to build tables of any size.
+"""
+
+import datetime
+import os
+
+import numpy as np
+from bs4 import BeautifulSoup
+from PIL import Image
+
+import mapache
+from mapache.synthetic import SyntheticParty
+
+fixtures_dir = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# Name, short name and logo (in fixtures/logos) of the parties of the table
+parties = [('Partido Popular', 'PP', 'PP.png'),
+           ('Partido Socialista Obrero Español', 'PSOE', 'PSOE.png'),
+           ('Unidos Podemos', 'UP', 'UP.png'),
+           ('Ciudadanos', 'Cs', 'Cs.png'),
+           ('Esquerra Republicana de Catalunya', 'ERC', 'ERC.png'),
+           ('Democràcia i Llibertat', 'CDC', 'CDC.png')]
+
+# Arguments of mapache.parseutils.poll_from_table for the table
+table_spec = dict(date_column=1, party_columns=(2, 8), error_column=8,
+                  pollster_column=0)
+
+
+# Color of the solid logo of each party (by short name)
+colors = {'PP': (0, 90, 160), 'PSOE': (220, 20, 30), 'UP': (100, 40, 100),
+          'Cs': (240, 120, 40), 'ERC': (250, 200, 0), 'CDC': (0, 40, 100)}
+
+
+def logo(filename):
+    """Logo of the fixtures, resized as mapache.Party._get_image does."""
+    img = Image.open(os.path.join(fixtures_dir, 'logos', filename))
+    w, h = img.size
+    return img.resize((240, int(h / w * 240)), Image.ANTIALIAS)
+
+
+def party_set():
+    """PartySet with the parties of the table."""
+    party_set = mapache.PartySet('benchmark')
+    for name, short_name, _ in parties:
+        party_set.add(SyntheticParty(name, colors[short_name],
+                                     short_name=short_name))
+    return party_set
+
+
+def create_polls(n_polls, seed=0, compact=False):
+    """PollsList with random polls of the parties, one per day.
+
+    Names alternate between the name and the short name of the parties, as
+    in polls parsed from different sources.
+    """
+    random_state = np.random.RandomState(seed)
+    polls = mapache.PollsList('benchmark', compact=compact)
+    start = datetime.datetime(2000, 1, 1)
+    for i in range(n_polls):
+        votes = random_state.dirichlet(np.ones(len(parties)) * 5) * 100
+        names = [p[i % 2] for p in parties]
+        polls.add(mapache.Poll(dict(zip(names, np.round(votes, 1).tolist())),
+                               start + datetime.timedelta(days=i),
+                               'Pollster {0}'.format(i % 10), error=2.5))
+    return polls
+
+
+def wiki_page(rows=None):
+    """Html of the recorded table, its rows replicated up to ``rows``."""
+    with open(os.path.join(fixtures_dir, 'opinion_polls.html'),
+              encoding='utf8') as f:
+        page = f.read()
+    if rows is None:
+        return page
+
+    table = page.index('<table class="wikitable')
+    start = page.index('<tr><td>', table)
+    end = page.index('</table>', start)
+    poll_rows = page[start:end].strip().split('\n')
+    poll_rows = (poll_rows * (rows // len(poll_rows) + 1))[:rows]
+    return page[:start] + '\n'.join(poll_rows) + '\n' + page[end:]
+
+
+def wiki_table(rows=None):
+    """BeautifulSoup table of ``wiki_page(rows)``."""
+    soup = BeautifulSoup(wiki_page(rows), 'html.parser')
+    return soup.find_all('table', class_='wikitable')[0]
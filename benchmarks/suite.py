@@ -0,0 +1,358 @@
+"""Benchmark suite of the hot paths of mapache.
+
+Run with ``python -m benchmarks.suite`` from the root of the repository. No
+network access is needed: the parties, logos and tables come from
+benchmarks/fixtures (see benchmarks.data).
+
+Each benchmark is timed for each of its parameters (eg. the number of polls)
+and the results are saved as JSON in ``.benchmarks/``, named after the date
+and the git commit, so that versions can be compared::
+
+    python -m benchmarks.suite                    # run and save
+    python -m benchmarks.suite -k get_party       # only some benchmarks
+    python -m benchmarks.suite --compare .benchmarks/OLD.json
+    python -m benchmarks.suite --plot scaling.png # scaling curves
+
+With ``--compare`` the ratio (new time / old time) of each benchmark is
+shown and the ones slower than ``--threshold`` are reported as regressions
+(the exit status is 1 if there are any).
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pylab as plt
+from bs4 import BeautifulSoup
+
+import mapache
+from mapache import parseutils
+from mapache.vis import SingleBars, TimeSeries
+
+from benchmarks import data
+
+results_dir = '.benchmarks'
+
+benchmarks = []
+
+
+def benchmark(**params):
+    """Register a benchmark.
+
+    The decorated function receives a value of the parameter (if any), does
+    the setup and returns the function to be timed, without arguments::
+
+        @benchmark(n_polls=[100, 1000])
+        def get_party(n_polls):
+            polls = data.create_polls(n_polls)
+            return lambda: polls.get_party(party)
+    """
+    def register(function):
+        (name, values), = params.items() if params else [(None, [None])]
+        benchmarks.append((function.__name__, name, values, function))
+        return function
+    return register
+
+
+# Party matching
+
+names = ['Partido Popular', 'P.P.', 'PSOE', 'Partido Socialista',
+         'Unidos Podemos', 'Podemos', 'Ciudadanos', "C's", 'ERC-CATSÍ',
+         'Democràcia i Llibertat', 'DiL', 'PACMA', 'EH Bildu', 'PNV']
+
+
+@benchmark()
+def levenshtein_distance():
+    party = mapache.Party.__new__(mapache.Party)
+    pairs = [(a, b) for a in names for b in names]
+
+    def run():
+        for a, b in pairs:
+            party._levenshtein_distance(a, b)
+    return run
+
+
+@benchmark(n_names=[10, 100, 1000])
+def party_set_match(n_names):
+    party_set = data.party_set()
+    queries = [names[i % len(names)] + ' ' * (i // len(names))
+               for i in range(n_names)]
+    memo = party_set._name_index()._memo
+
+    def run():
+        memo.clear()
+        for name in queries:
+            party_set.match(name)
+    return run
+
+
+# Votes of a party
+
+def _party(party_set):
+    return party_set.parties['UP']
+
+
+@benchmark(n_polls=[100, 1000, 10000])
+def poll_get_party(n_polls):
+    party_set = data.party_set()
+    polls = data.create_polls(n_polls).polls
+    party = _party(party_set)
+
+    def run():
+        for poll in polls:
+            poll.get_party(party)
+    return run
+
+
+@benchmark(n_polls=[100, 1000, 10000, 100000])
+def polls_list_get_party(n_polls):
+    polls = data.create_polls(n_polls)
+    party = _party(data.party_set())
+    return lambda: polls.get_party(party)
+
+
+@benchmark(n_polls=[100, 1000, 10000, 100000])
+def polls_list_get_party_array(n_polls):
+    polls = data.create_polls(n_polls)
+    party = _party(data.party_set())
+    return lambda: polls.get_party_array(party)
+
+
+# Parsing
+#
+# poll_from_table only walks an already built tree, while
+# iter_polls_from_html also parses the html: on the same 1000 rows it is
+# about 1.5 times slower than poll_from_table. poll_from_html, which builds
+# the tree as well, is the fair comparison (about 2.5 times slower than
+# iter_polls_from_html).
+
+@benchmark(rows=[120, 1000, 5000])
+def poll_from_table(rows):
+    table = data.wiki_table(rows)
+    return lambda: parseutils.poll_from_table(table, **data.table_spec)
+
+
+@benchmark(rows=[120, 1000, 5000])
+def poll_from_html(rows):
+    page = data.wiki_page(rows)
+
+    def run():
+        soup = BeautifulSoup(page, 'html.parser')
+        table = soup.find_all('table', class_='wikitable')[0]
+        parseutils.poll_from_table(table, **data.table_spec)
+    return run
+
+
+@benchmark(rows=[120, 1000, 5000])
+def iter_polls_from_html(rows):
+    page = data.wiki_page(rows)
+    return lambda: list(parseutils.iter_polls_from_html(page, html=True,
+                                                        **data.table_spec))
+
+
+# Colors
+
+@benchmark(method=['kmeans', 'histogram'])
+def get_color(method):
+    party = mapache.Party.__new__(mapache.Party)
+    logos = [data.logo(filename) for _, _, filename in data.parties]
+
+    def run():
+        for img in logos:
+            party._get_color(img, method=method)
+    return run
+
+
+# Charts
+
+@benchmark(n_polls=[100, 1000])
+def time_series(n_polls):
+    party_set = data.party_set()
+    polls = data.create_polls(n_polls)
+
+    def run():
+        series = TimeSeries(party_set)
+        series.add_column(polls, main=True)
+        series.export()
+    return run
+
+
+@benchmark()
+def single_bars():
+    party_set = data.party_set()
+    poll = data.create_polls(1).polls[0]
+
+    def run():
+        bars = SingleBars(poll, party_set)
+        bars.export(os.devnull)
+        plt.close(bars._fig)
+    return run
+
+
+def measure(function, repeat=5, min_time=0.2):
+    """Seconds per call of a function (minimum and median of ``repeat``).
+
+    The function is called as many times as needed for each repetition to
+    last at least ``min_time`` seconds.
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        seconds = timer.timeit(number)
+        if seconds >= min_time or number >= 10 ** 6:
+            break
+        number = max(number * 2, int(number * min_time / max(seconds, 1e-9)))
+    times = sorted(t / number for t in timer.repeat(repeat, number))
+    return {'min': times[0], 'median': times[len(times) // 2],
+            'number': number}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(pattern=None, repeat=5, min_time=0.2):
+    """Run the benchmarks whose names contain ``pattern``.
+
+    Returns:
+        dict: the results, with the version of mapache, the commit and the
+              date, as saved in the JSON files
+    """
+    results = {}
+    for name, param, values, function in benchmarks:
+        if pattern and pattern not in name:
+            continue
+        times = []
+        for value in values:
+            timing = measure(function(value) if param else function(),
+                             repeat, min_time)
+            times.append(timing)
+            print('{0:30} {1:>18} {2:12.3f} ms'.format(
+                name, '' if param is None else '{0}={1}'.format(param, value),
+                timing['min'] * 1000))
+            sys.stdout.flush()
+        results[name] = {'param': param, 'values': values, 'times': times}
+
+    return {'version': mapache.__version__, 'commit': git_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.node(), 'results': results}
+
+
+def save(report, directory=results_dir):
+    """Save the results of ``run`` in ``directory``, returns the path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, '{0}-{1}.json'.format(
+        report['date'].replace(':', ''), report['commit']))
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+    return path
+
+
+def compare(report, previous, threshold=1.2):
+    """Print the ratio of the times of two reports.
+
+    Returns:
+        List[str]: benchmarks (and parameters) at least ``threshold`` times
+                   slower than in ``previous``
+    """
+    print('\n{0:30} {1:>18} {2:>10}   (vs {3}, {4})'.format(
+        'benchmark', '', 'ratio', previous['commit'], previous['date']))
+    regressions = []
+    for name, result in report['results'].items():
+        old = previous['results'].get(name)
+        if old is None:
+            continue
+        old_times = dict(zip(map(str, old['values']), old['times']))
+        for value, timing in zip(result['values'], result['times']):
+            if str(value) not in old_times:
+                continue
+            ratio = timing['min'] / old_times[str(value)]['min']
+            label = ('' if result['param'] is None
+                     else '{0}={1}'.format(result['param'], value))
+            flag = ''
+            if ratio >= threshold:
+                flag = '  REGRESSION'
+                regressions.append('{0} {1}'.format(name, label).strip())
+            print('{0:30} {1:>18} {2:10.2f}{3}'.format(name, label, ratio,
+                                                        flag))
+    return regressions
+
+
+def plot(reports, filename):
+    """Scaling curves (time vs parameter) of the numeric benchmarks.
+
+    Args:
+        reports (List[dict]): results of ``run``, one line per report
+        filename (str): name of the image
+    """
+    names = [name for name, result in reports[0]['results'].items()
+             if result['param'] and
+             all(isinstance(v, (int, float)) for v in result['values'])]
+    if not names:
+        return
+    fig, axes = plt.subplots(1, len(names), figsize=(4 * len(names), 4),
+                             squeeze=False)
+    for ax, name in zip(axes[0], names):
+        for report in reports:
+            result = report['results'].get(name)
+            if result is None:
+                continue
+            ax.loglog(result['values'], [t['min'] for t in result['times']],
+                      'o-', label=report['commit'])
+        ax.set_title(name)
+        ax.set_xlabel(reports[0]['results'][name]['param'])
+        ax.set_ylabel('seconds')
+        ax.legend()
+    fig.tight_layout()
+    fig.savefig(filename)
+    plt.close(fig)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-k', dest='pattern',
+                        help='only run benchmarks containing PATTERN')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum seconds of each repetition')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='results of a previous run')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='ratio of the time considered a regression')
+    parser.add_argument('--plot', metavar='PNG',
+                        help='save the scaling curves (with --compare, '
+                             'both runs)')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args(argv)
+
+    report = run(args.pattern, args.repeat, args.min_time)
+    if not args.no_save:
+        print('Results saved to', save(report))
+
+    reports = [report]
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        reports.insert(0, previous)
+        regressions = compare(report, previous, args.threshold)
+    if args.plot:
+        plot(reports, args.plot)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,13 @@
 from mapache.core import *
 import mapache.vis
 import mapache.parseutils
+import mapache.cache
+import mapache.storage
+import mapache.trends
+import mapache.aggregate
+import mapache.seats
+import mapache.synthetic
+import mapache.profiling
 
 __all__ = ["core", "vis", "polls"]
 
@@ -0,0 +1,181 @@
+"""Poll of polls: rolling weighted averages of the polls."""
+
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from mapache.frame import _to_error
+from mapache.trends import to_days, from_days
+
+
+class PollAverage:
+    """Rolling weighted average of the polls of each party on a daily grid.
+
+    The average of a day uses the polls of the previous ``window`` days
+    (including that day). Each poll is weighted by:
+
+    - recency: the weight halves every ``half_life`` days
+    - precision: ``(default_error / error) ** 2``, so a poll with half the
+      error (about four times the sample size) weighs four times more.
+      Polls with unknown error (or an error of 0, which would weigh
+      infinitely) use ``default_error``.
+    - pollster: ``pollster_weights[pollster]``, 1 by default
+
+    The weighted votes of the polls are added per day and then convolved
+    with the recency weights, all parties and days at once. Appending a poll
+    (``add``) only recomputes the days within its window.
+    """
+
+    def __init__(self, polls, parties, half_life=14., window=60,
+                 pollster_weights=None, default_error=3.,
+                 join_coalitions=True, min_ratio=0.8):
+        """Average the polls of a list.
+
+        Args:
+            polls (mapache.PollsList): polls to average
+            parties (mapache.PartySet or List[mapache.Party]): parties
+            half_life (Optional[float]): days for the weight of a poll to
+                        halve
+            window (Optional[int]): number of days a poll is used for
+            pollster_weights (Optional[dict]): weight of each pollster
+            default_error (Optional[float]): error of the polls without one
+            join_coalitions (Optional[bool]): see mapache.Poll.get_party
+            min_ratio (Optional[float]): see mapache.Poll.get_party
+        """
+        if hasattr(parties, 'parties'):
+            parties = list(parties.parties.values())
+        self.polls = polls
+        self.parties = list(parties)
+        self.half_life = half_life
+        self.window = int(window)
+        self.pollster_weights = pollster_weights or {}
+        self.default_error = default_error
+        self.join_coalitions = join_coalitions
+        self.min_ratio = min_ratio
+
+        # Weight of a poll made k days before, k = window - 1 ... 0
+        lags = np.arange(self.window)[::-1]
+        self._kernel = 0.5 ** (lags / float(half_life))
+        self._compute()
+
+    @property
+    def dates(self):
+        """Days of the grid (datetime64)."""
+        return from_days(self._start + np.arange(self._n))
+
+    @property
+    def average(self):
+        """Average of each party, days x parties. NaN without polls."""
+        return self._average[:self._n]
+
+    def get_party(self, party):
+        """Average of a party.
+
+        Args:
+            party (mapache.Party): one of the parties of the average
+
+        Returns:
+            Tuple[numpy.ndarray]: days (datetime64) and average of the party
+        """
+        return self.dates, self.average[:, self.parties.index(party)]
+
+    def _poll_weights(self, pollsters, errors):
+        # Unknown (NaN) and 0 errors, which would weigh infinitely
+        errors = np.where(errors > 0, errors, self.default_error)
+        weights = (self.default_error / errors) ** 2
+        if self.pollster_weights:
+            weights *= [self.pollster_weights.get(p, 1.) for p in pollsters]
+        return weights
+
+    def _compute(self):
+        """Average of all the polls."""
+        frame = self.polls.frame()
+        votes = frame.party_matrix(self.parties,
+                                   self.polls._resolver(self.min_ratio),
+                                   self.join_coalitions)
+        # As in PollsList.get_party, 0 is not a valid poll result
+        votes[votes == 0] = np.nan
+        days = np.floor(to_days(frame.dates)).astype(np.int64)
+
+        self._start = days.min() if len(days) else 0
+        self._n = days.max() - self._start + 1 if len(days) else 0
+        shape = (self._n, len(self.parties))
+        self._votes = np.zeros(shape)
+        self._weights = np.zeros(shape)
+        self._average = np.full(shape, np.nan)
+
+        weights = self._poll_weights(frame.pollsters, frame.errors)
+        self._add(days - self._start, votes, weights)
+        self._smooth(0, self._n)
+
+    def _add(self, days, votes, weights):
+        """Add weighted polls to the daily sums."""
+        found = ~np.isnan(votes)
+        weights = weights[:, np.newaxis] * found
+        np.add.at(self._votes, days, np.where(found, votes, 0) * weights)
+        np.add.at(self._weights, days, weights)
+
+    def _smooth(self, first, last):
+        """Compute the average of the days from ``first`` to ``last - 1``."""
+        if last <= first:
+            return
+        lo = first - self.window + 1
+        pad = max(0, -lo)
+        averages = []
+        for sums in [self._votes, self._weights]:
+            sums = sums[max(lo, 0):last]
+            if pad:
+                sums = np.concatenate([np.zeros((pad, sums.shape[1])), sums])
+            # days x parties x window view, no copy
+            windows = sliding_window_view(sums, self.window, axis=0)
+            averages.append(np.einsum('dpk,k->dp', windows, self._kernel))
+        votes, weights = averages
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self._average[first:last] = np.where(weights > 0,
+                                                 votes / weights, np.nan)
+
+    def _grow(self, n):
+        """Extend the grid to ``n`` days."""
+        capacity = len(self._votes)
+        if n > capacity:
+            capacity = max(n, 2 * capacity)
+            for name, fill in [('_votes', 0.), ('_weights', 0.),
+                               ('_average', np.nan)]:
+                old = getattr(self, name)
+                new = np.full((capacity, len(self.parties)), fill)
+                new[:self._n] = old[:self._n]
+                setattr(self, name, new)
+        self._n = n
+
+    def add(self, poll):
+        """Add a poll (or a PollsList) to the polls and update the average.
+
+        Only the days within the window of the new polls are recomputed,
+        unless they are older than the first day of the grid.
+        """
+        polls = poll.polls if hasattr(poll, 'polls') else [poll]
+        self.polls.add(poll)
+
+        days = np.floor(to_days([p.date for p in polls])).astype(np.int64)
+        if not len(days):
+            return
+        if not self._n or days.min() < self._start:
+            self._compute()
+            return
+        days -= self._start
+
+        resolver = self.polls._resolver(self.min_ratio)
+        votes = np.array([[p._get_party(party, resolver,
+                                        self.join_coalitions) or np.nan
+                           for party in self.parties] for p in polls],
+                         dtype=float)
+        # Unknown errors as in PollsFrame
+        errors = np.array([_to_error(p.error) for p in polls], dtype=float)
+        weights = self._poll_weights([p.pollster for p in polls], errors)
+
+        old_n = self._n
+        self._grow(max(old_n, days.max() + 1))
+        self._add(days, votes, weights)
+        self._smooth(days.min(), min(days.max() + self.window, old_n))
+        self._smooth(old_n, self._n)
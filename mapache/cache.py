@@ -0,0 +1,226 @@
+"""Persistent cache for party logos and colors."""
+
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import urllib.parse
+
+from PIL import Image
+
+from mapache import profiling
+from mapache.fetch import fetch
+
+
+_image_cache = None
+
+
+def set_image_cache(cache):
+    """Set the cache used by mapache.Party for logos, thumbnails and colors.
+
+    Args:
+        cache (Optional[mapache.cache.ImageCache]): cache to be used, None to
+                        disable caching
+    """
+    global _image_cache
+    _image_cache = cache
+
+
+def get_image_cache():
+    """Cache used by mapache.Party, None if caching is disabled."""
+    return _image_cache
+
+
+def default_cache_dir():
+    """Default directory for the cache (``~/.cache/mapache/images``)."""
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'mapache', 'images')
+
+
+class ImageCache:
+    """On-disk cache of logos, thumbnails and colors.
+
+    Each downloaded url is mapped to the hash of its content, and everything
+    derived from the image (resized logo, thumbnail, color) is stored under
+    that hash, so urls pointing to the same image share the entries.
+
+    When the total size goes beyond ``max_size`` the least recently used
+    images are removed.
+
+    If ``local_dir`` is indicated, images are read from the file in that
+    directory with the same name as the last part of the url (eg.
+    ``logo.png`` for ``http://example.com/images/logo.png``) instead of being
+    downloaded, so parties can be created without network access.
+    """
+
+    def __init__(self, path=None, max_size=200 * 2 ** 20, local_dir=None):
+        """Create or open a cache.
+
+        Args:
+            path (Optional[str]): directory of the cache,
+                        ``default_cache_dir()`` if not indicated
+            max_size (Optional[int]): maximum size in bytes
+            local_dir (Optional[str]): directory with local copies of the
+                        images
+        """
+        if path is None:
+            path = default_cache_dir()
+        self.path = path
+        self.max_size = max_size
+        self.local_dir = local_dir
+        self._lock = threading.RLock()
+        os.makedirs(os.path.join(path, 'urls'), exist_ok=True)
+        os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+
+    def _url_file(self, url):
+        key = hashlib.sha1(url.encode('utf8')).hexdigest()
+        return os.path.join(self.path, 'urls', key + '.json')
+
+    def _object_dir(self, content_hash):
+        return os.path.join(self.path, 'objects', content_hash)
+
+    def _content_hash(self, url):
+        """Hash of the content of ``url``, KeyError if not in the cache."""
+        try:
+            with open(self._url_file(url)) as f:
+                content_hash = json.load(f)['hash']
+        except (OSError, ValueError):
+            raise KeyError(url)
+        if not os.path.isdir(self._object_dir(content_hash)):
+            raise KeyError(url)
+        return content_hash
+
+    def _local_file(self, url):
+        """Path to the local copy of ``url`` in ``local_dir``, if any."""
+        if not self.local_dir:
+            return None
+        name = os.path.basename(urllib.parse.urlparse(url).path)
+        path = os.path.join(self.local_dir, urllib.parse.unquote(name))
+        if name and os.path.isfile(path):
+            return path
+        return None
+
+    def download(self, url):
+        """Content of ``url``.
+
+        The file in ``local_dir`` is used if there is one. The hash of the
+        content is recorded so that images derived from it can be cached.
+
+        Returns:
+            bytes: content of the url
+        """
+        local_file = self._local_file(url)
+        if local_file:
+            with open(local_file, 'rb') as f:
+                data = f.read()
+        else:
+            data = fetch(url)
+
+        content_hash = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            os.makedirs(self._object_dir(content_hash), exist_ok=True)
+            with open(self._url_file(url), 'w') as f:
+                json.dump({'url': url, 'hash': content_hash}, f)
+        return data
+
+    def _get(self, url, item):
+        stage = 'cache.color' if item.endswith('.json') else 'cache.image'
+        with self._lock:
+            content_hash = self._content_hash(url)
+            path = os.path.join(self._object_dir(content_hash), item)
+            if not os.path.exists(path):
+                profiling.miss(stage)
+                raise KeyError(url)
+            profiling.hit(stage)
+            # The access time of the directory is used for the LRU eviction
+            os.utime(self._object_dir(content_hash))
+            return path
+
+    def _set(self, url, item, write):
+        with self._lock:
+            content_hash = self._content_hash(url)
+            path = os.path.join(self._object_dir(content_hash), item)
+            write(path)
+            os.utime(self._object_dir(content_hash))
+            self._evict()
+
+    def get_image(self, url, item='logo'):
+        """Cached image derived from ``url``.
+
+        Args:
+            url (str): url of the original image
+            item (Optional[str]): name of the image (eg. 'logo', 'thumbnail')
+
+        Returns:
+            PIL.Image: cached image. KeyError if not found.
+        """
+        path = self._get(url, item + '.png')
+        img = Image.open(path)
+        img.load()
+        return img
+
+    def set_image(self, url, item, img):
+        """Store an image derived from ``url``.
+
+        ``url`` must have been downloaded with ``download()`` first.
+        """
+        self._set(url, item + '.png', lambda path: img.save(path, 'png'))
+
+    def get_color(self, url, item='color'):
+        """Cached color of the image of ``url``.
+
+        Returns:
+            (List[float]): RGB color, or None if the color could not be
+                           extracted. KeyError if not found.
+        """
+        with open(self._get(url, item + '.json')) as f:
+            return json.load(f)['color']
+
+    def set_color(self, url, color, item='color'):
+        """Store the color of the image of ``url``."""
+        if color is not None:
+            color = [float(c) for c in color]
+
+        def write(path):
+            with open(path, 'w') as f:
+                json.dump({'color': color}, f)
+
+        self._set(url, item + '.json', write)
+
+    def size(self):
+        """Total size in bytes of the cached images."""
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        """(last access, size, directory) of each cached image."""
+        objects = os.path.join(self.path, 'objects')
+        entries = []
+        for name in os.listdir(objects):
+            directory = os.path.join(objects, name)
+            size = sum(os.path.getsize(os.path.join(directory, f))
+                       for f in os.listdir(directory))
+            entries.append((os.path.getmtime(directory), size, directory))
+        return entries
+
+    def _evict(self):
+        """Remove the least recently used images until under max_size."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        # The most recently used image is never removed
+        for _, size, directory in entries[:-1]:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(directory, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove all the cached images."""
+        with self._lock:
+            for directory in ['urls', 'objects']:
+                shutil.rmtree(os.path.join(self.path, directory),
+                              ignore_errors=True)
+                os.makedirs(os.path.join(self.path, directory))
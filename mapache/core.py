@@ -13,16 +13,41 @@ from sklearn.utils import shuffle
 from PIL import Image
 import base64
 from io import BytesIO
-import urllib.request
-
+import threading
 import warnings
+import sys
+import datetime
+import json
+import os
+import zipfile
+from array import array
+from collections.abc import Mapping
+
+from mapache import profiling
+from mapache.matching import NameIndex
+from mapache.frame import PollsFrame, DateIndex
+from mapache.storage import save_frame, load_frame, StoredImage
+from mapache.cache import get_image_cache
+from mapache.fetch import fetch
+
+
+# Marks the images and color of a lazy party that have not been loaded yet
+_NOT_LOADED = object()
+
+
+def _is_loaded(value):
+    """False for images not downloaded yet or not read yet from a file."""
+    return value is not _NOT_LOADED and not isinstance(value, StoredImage)
 
 
 class Party:
     """Implements a political party."""
 
+    # Method used to extract the color of the logo, see Party._get_color
+    color_method = 'kmeans'
+
     def __init__(self, name, logo_url, short_name=None, full_name=None,
-                 extra_names=None, thumbnail_url=None):
+                 extra_names=None, thumbnail_url=None, lazy=False):
         """Create political party.
 
         Args:
@@ -39,8 +64,14 @@ class Party:
             extra_names (Optional[List[str]]): Any number of extra names of the
                         party to help matching the party to polls (eg. names
                         in different languages).
+            lazy (Optional[bool]): if True the logo and thumbnail are not
+                        downloaded, and the color is not computed, until they
+                        are used for the first time.
         """
         self.name = name
+        self.lazy = lazy
+        self._lock = threading.RLock()
+        self._logo_url = None
         self.set_logo(logo_url)
         self.set_thumbnail(thumbnail_url)
 
@@ -74,17 +105,33 @@ class Party:
         toprint += '\n'
         return(toprint)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
     def set_logo(self, url):
         """Set the logo and updates the party color.
 
         The image is download from ``url`` and the color of the party
-        ``self.color`` is updated to the principal color of the image
+        ``self.color`` is updated to the principal color of the image. If the
+        party is lazy only the url is recorded; the image is downloaded the
+        first time the logo or the color are used.
 
         Args:
             url (str): url to a image with the logo of the party
         """
-        self._logo = self._get_image(url)
-        self.color = self._get_color(self._logo)
+        with self._lock:
+            self._logo_url = url
+            self._logo_value = _NOT_LOADED
+            self._color_value = _NOT_LOADED
+        if not self.lazy:
+            self._load_logo()
+            self._load_color()
 
     def get_logo(self, url):
         """Current logo of the party.
@@ -94,26 +141,120 @@ class Party:
         """
         return self._logo
 
+    @property
+    def _logo(self):
+        if not _is_loaded(self._logo_value):
+            self._load_logo()
+        return self._logo_value
+
+    @_logo.setter
+    def _logo(self, img):
+        self._logo_value = img
+
+    @property
+    def color(self):
+        """Main color of the logo of the party (RGB, 0 to 1)."""
+        if self._color_value is _NOT_LOADED:
+            self._load_color()
+        return self._color_value
+
+    @color.setter
+    def color(self, color):
+        self._color_value = color
+
+    def _load_logo(self):
+        """Download the logo, only once even if called from many threads."""
+        with self._lock:
+            if isinstance(self._logo_value, StoredImage):
+                self._logo_value = self._logo_value.load()
+            elif self._logo_value is _NOT_LOADED:
+                self._logo_value = self._get_image(self._logo_url)
+
+    def _load_color(self):
+        """Compute (or read from the image cache) the color of the logo."""
+        with self._lock:
+            if self._color_value is not _NOT_LOADED:
+                return
+            url = self._logo_url
+            item = 'color'
+            if self.color_method != 'kmeans':
+                item += '-' + self.color_method
+            cache = get_image_cache() if url else None
+            if cache is not None:
+                try:
+                    self._color_value = cache.get_color(url, item)
+                    return
+                except KeyError:
+                    pass
+            self._color_value = self._get_color(self._logo,
+                                                method=self.color_method)
+            if cache is not None:
+                cache.set_color(url, self._color_value, item)
+
     def set_thumbnail(self, url=None):
         """Set the thumbnail of the party.
 
         The size of the thumbnail will be 80x80 and squared images are
         preferred. If no url is provided the logo of the party will be used
-        as the thumbnail.
+        as the thumbnail. If the party is lazy the thumbnail is created the
+        first time it is used.
 
         Args:
             url (Optional[str]): url to a image with the small logo
                                  of the party
         """
-        if not url:
-            if self._logo:
-                self._thumbnail = self._logo.copy()
-        else:
-            self._thumbnail = self._get_image(url)
+        with self._lock:
+            self._thumbnail_url = url
+            self._thumbnail_value = _NOT_LOADED
+        if not self.lazy:
+            self._load_thumbnail()
+
+    @property
+    def _thumbnail(self):
+        if not _is_loaded(self._thumbnail_value):
+            self._load_thumbnail()
+        return self._thumbnail_value
+
+    @_thumbnail.setter
+    def _thumbnail(self, img):
+        self._thumbnail_value = img
+
+    def _load_thumbnail(self):
+        """Create the thumbnail, only once even if called from many threads."""
+        with self._lock:
+            if isinstance(self._thumbnail_value, StoredImage):
+                self._thumbnail_value = self._thumbnail_value.load()
+            if self._thumbnail_value is not _NOT_LOADED:
+                return
+            url = self._thumbnail_url
+
+            # The thumbnail of a url does not depend on it being a logo or not
+            source_url = url or self._logo_url
+            cache = get_image_cache() if source_url else None
+            if cache is not None:
+                try:
+                    self._thumbnail_value = cache.get_image(source_url,
+                                                            'thumbnail')
+                    return
+                except KeyError:
+                    pass
+
+            if url:
+                thumbnail = self._get_image(url)
+            elif self._logo:
+                thumbnail = self._logo.copy()
+            else:
+                # No thumbnail url and no logo
+                self._thumbnail_value = None
+                return
 
-        w, h = self._thumbnail.size
+            w, h = thumbnail.size
 
-        self._thumbnail.thumbnail((80, 80), Image.ANTIALIAS)
+            thumbnail.thumbnail((80, 80), Image.ANTIALIAS)
+            self._thumbnail_value = thumbnail
+
+            if cache is not None:
+                cache.set_image(source_url, 'thumbnail', thumbnail)
 
     def get_thumbnail(self, url):
         """Current thumbnail of the party.
@@ -151,21 +292,102 @@ class Party:
         return set((self.extra_names + [self.full_name] +
                    [self.name] + [self.short_name]))
 
+    @profiling.timed('match')
     def match(self, party_name):
         """Evaluate how well a name matches this party.
 
-        mapache.core._levenshtein_distance is used for the comparison.
-        All names of the party are used in the comparison.
+        The ratio of mapache.core._levenshtein_distance is used for the
+        comparison. All names of the party are used in the comparison.
 
         Args:
             party_name (str): name to be evaluated
         """
-        max_ratio = 0
-        for name in self.get_all_names():
-            max_ratio = max(max_ratio,
-                            self._levenshtein_distance(name,
-                                                       party_name)['ratio'])
-        return(max_ratio)
+        return self._name_index().scores(party_name)[0]
+
+    def _names_key(self):
+        """All the names of the party, to detect changes."""
+        return (self.name, self.full_name, self.short_name,
+                tuple(self.extra_names))
+
+    def _name_index(self):
+        """Matching index of the names of the party.
+
+        The index is rebuilt only if the names of the party have changed.
+
+        Returns:
+            mapache.matching.NameIndex: index with all the names of the party
+        """
+        names = self._names_key()
+        cached = getattr(self, '_names_cache', None)
+        if cached is None or cached[0] != names:
+            all_names = self.get_all_names()
+            cached = (names, NameIndex(all_names, [self] * len(all_names)))
+            self._names_cache = cached
+        return cached[1]
+
+    def _snapshot(self, archive, prefix):
+        """Write the images of the party to a zip file (see PartySet.save).
+
+        Args:
+            archive (zipfile.ZipFile): file to write to
+            prefix (str): name of the images in the file, without extension
+
+        Returns:
+            dict: names, urls, color and images of the party
+        """
+        images = {}
+        for item, value in [('logo', self._logo_value),
+                            ('thumbnail', self._thumbnail_value)]:
+            if value is _NOT_LOADED:
+                value = getattr(self, '_' + item)
+            if value is None:
+                images[item] = None
+                continue
+            if isinstance(value, StoredImage):
+                # Copied without decoding it
+                data = value.read()
+            else:
+                buf = BytesIO()
+                value.save(buf, format='png')
+                data = buf.getvalue()
+            images[item] = '{0}-{1}.png'.format(prefix, item)
+            archive.writestr(images[item], data)
+
+        color = self.color
+        if color is not None:
+            color = [float(c) for c in color]
+
+        return {'name': self.name, 'short_name': self.short_name,
+                'full_name': self.full_name, 'extra_names': self.extra_names,
+                'logo_url': self._logo_url,
+                'thumbnail_url': self._thumbnail_url,
+                'color': color, 'logo': images['logo'],
+                'thumbnail': images['thumbnail']}
+
+    @classmethod
+    def _from_snapshot(cls, snapshot, path):
+        """Party written by ``_snapshot`` to the zip file ``path``.
+
+        Nothing is downloaded or computed; the images are read from the file
+        the first time they are used.
+        """
+        party = cls.__new__(cls)
+        party.name = snapshot['name']
+        party.lazy = True
+        party._lock = threading.RLock()
+        party._logo_url = snapshot['logo_url']
+        party._thumbnail_url = snapshot['thumbnail_url']
+        party._color_value = snapshot['color']
+        for item in ['logo', 'thumbnail']:
+            value = None
+            if snapshot[item]:
+                value = StoredImage(path, snapshot[item])
+            setattr(party, '_{0}_value'.format(item), value)
+        party.full_name = snapshot['full_name']
+        party.short_name = snapshot['short_name']
+        party.extra_names = snapshot['extra_names']
+        party.coalition = None
+        return party
 
     def show(self):
         """Show the information of the party.
@@ -200,12 +422,16 @@ class Party:
 
         ax.axis('off')
 
-    def _get_color(self, img, pixels_to_sample=1000, nclusters=5):
+    @profiling.timed('color')
+    def _get_color(self, img, pixels_to_sample=1000, nclusters=5,
+                   method='kmeans'):
         """Select the principal color of an image.
 
-        A number of pixels is randomly sampled and used to cluster the colors
-        in the image. Then each pixel of the image is assigned to a cluster to
-        find the main color of the image.
+        With ``method='kmeans'`` a number of pixels is randomly sampled and
+        used to cluster the colors in the image. Then each pixel of the image
+        is assigned to a cluster to find the main color of the image.
+        ``method='histogram'`` is a much faster alternative, see
+        ``_get_color_histogram``.
         The most frequent color is preferred and whites (all RGB values > 0.9)
         are discarded.
 
@@ -213,11 +439,17 @@ class Party:
             img (PIL.image): logo of the party
             pixels_to_sample (Optional[int[)): number of pixels to sample
             nclusters (Optional[int]): number of colors(clusters) to consider
+            method (Optional[str]): 'kmeans' or 'histogram'
         Returns:
             (List[float]): RGB (0 to 1) list with the main color of the party
                            or None if the selection fails (eg. because it is
                            white)
         """
+        if method == 'histogram':
+            return self._get_color_histogram(img)
+        if method != 'kmeans':
+            raise ValueError('Unknown color method: {0}'.format(method))
+
         img = np.array(img, dtype=np.uint8) / 255.
         w, h, d = tuple(img.shape)
         image_array = np.reshape(img, (w * h, d))
@@ -245,10 +477,70 @@ class Party:
 
         return None
 
+    def _get_opaque_pixels(self, img, max_size=64):
+        """Pixels of a downsampled copy of the image, transparent ones removed.
+
+        The image is reduced (nearest neighbour, so that no new colors are
+        created) to at most ``max_size`` pixels per side.
+
+        Returns:
+            numpy.ndarray: N x 3 uint8 array with the RGB values of the pixels
+        """
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA')
+        if max(img.size) > max_size:
+            img = img.copy()
+            img.thumbnail((max_size, max_size), Image.NEAREST)
+        pixels = np.asarray(img, dtype=np.uint8)
+        pixels = pixels.reshape(-1, pixels.shape[-1])
+        if pixels.shape[1] == 4:
+            pixels = pixels[pixels[:, 3] == 255]
+        return pixels[:, :3]
+
+    def _get_color_histogram(self, img, bits=3):
+        """Select the principal color of an image from a color histogram.
+
+        The colors of a downsampled copy of the image are quantized to
+        ``bits`` bits per channel and counted. The most frequent bin which is
+        not white is selected, and the average color of its pixels returned.
+
+        Args:
+            img (PIL.image): logo of the party
+            bits (Optional[int]): bits per channel of the histogram
+        Returns:
+            (List[float]): RGB (0 to 1) list with the main color of the party
+                           or None if the selection fails
+        """
+        pixels = self._get_opaque_pixels(img)
+        if not len(pixels):
+            return None
+
+        quantized = (pixels >> (8 - bits)).astype(np.intp)
+        bins = ((quantized[:, 0] << (2 * bits)) | (quantized[:, 1] << bits) |
+                quantized[:, 2])
+        nbins = 2 ** (3 * bits)
+        counts = np.bincount(bins, minlength=nbins)
+        colors = np.empty((nbins, 3))
+        for channel in range(3):
+            colors[:, channel] = np.bincount(bins, weights=pixels[:, channel],
+                                             minlength=nbins)
+        colors /= 255. * np.maximum(counts, 1)[:, np.newaxis]
+
+        for idx in np.argsort(counts)[::-1]:
+            if not counts[idx]:
+                break
+            if any(colors[idx] < 0.9):
+                return colors[idx]
+
+        return None
+
+    @profiling.timed('image')
     def _get_image(self, url):
         """Download an image.
 
-        The image is downloaded and resized to a width of 240
+        The image is downloaded and resized to a width of 240. If an image
+        cache is set (see mapache.cache.set_image_cache) the resized image is
+        read from or stored in the cache.
 
         TODO: set maximum height as well
 
@@ -258,9 +550,20 @@ class Party:
         Returns:
             PIL.Image: image
         """
-        img = Image.open(urllib.request.urlopen(url))
+        cache = get_image_cache()
+        if cache is None:
+            img = Image.open(BytesIO(fetch(url)))
+        else:
+            try:
+                return cache.get_image(url, 'logo')
+            except KeyError:
+                img = Image.open(BytesIO(cache.download(url)))
+
         w, h = img.size
         img = img.resize((240, int(h / w * 240)), Image.ANTIALIAS)
+
+        if cache is not None:
+            cache.set_image(url, 'logo', img)
         return img
 
     def _create_abbreviation(self, name, max_characters=7):
@@ -340,6 +643,9 @@ class PartySet:
     with the closest name if similar enough) and some visualization tools.
     """
 
+    # Version of the format of the files written by save()
+    snapshot_version = 1
+
     def __init__(self, context_name=''):
         """Create a PartySet.
 
@@ -349,6 +655,7 @@ class PartySet:
         """
         self.context_name = context_name
         self.parties = {}
+        self._index = None
 
     def __iter__(self):
         self.__current = -1
@@ -368,6 +675,8 @@ class PartySet:
         new_list.__dict__.update(self.__dict__)
 
         new_list.parties = {}
+        # The index of this set has other parties
+        new_list._index = None
         for party in parties:
             p = self.match(party)
             if not p:
@@ -389,10 +698,12 @@ class PartySet:
     def __delitem__(self, key):
         """TODO: add name matching."""
         del self.parties[key.upper()]
+        self._index = None
 
     def __setitem__(self, key, value):
         """TODO: add name matching."""
         self.parties[key] = value
+        self._index = None
 
     def __next__(self):
         """``__next__``."""
@@ -406,7 +717,9 @@ class PartySet:
         return self.parties.keys()
 
     def add(self, party):
+        """Add a party, or update the names of a party already added."""
         self.parties[party.short_name.upper()] = party
+        self._index = None
 
     def _get_html_img(self, img, height=80, inline=False):
         buf = BytesIO()
@@ -455,40 +768,168 @@ class PartySet:
         html += "</div>"
         return html
 
+    @profiling.timed('match')
     def match(self, party_name, min_ratio=0.8):
-        max_party = None
-        max_ratio = 0
+        """Party with the name closest to ``party_name``.
 
-        for party in self.parties.values():
-            ratio = party.match(party_name)
-            if ratio > max_ratio:
-                max_ratio = ratio
-                max_party = party
-        if max_ratio < min_ratio:
-            max_party = None
-        return max_party
+        All the names of all the parties are scored in a single pass by a
+        mapache.matching.NameIndex, built the first time it is needed after
+        adding or removing parties. Results are memoized by name.
 
+        The index is not rebuilt if the names of a party of the set change
+        (eg. ``party.extra_names.append(...)``): add the party again to
+        take the new names into account.
 
-class Poll:
+        Args:
+            party_name (str): name to be matched
+            min_ratio (Optional[float]): minimum ratio (as returned by
+                        mapache.Party.match) to consider it a match
 
-    def __init__(self,  parties, date, pollster='', error=None):
+        Returns:
+            mapache.Party: closest party or None if no party is close enough
+        """
+        key, max_ratio = self._name_index().best(party_name)
+        if key is None or max_ratio < min_ratio:
+            return None
+        return self.parties[key]
 
-        self.pollster = pollster
-        self.date = date
-        self.parties = parties
-        self.error = error
-        # TODO check types
+    def save(self, path):
+        """Save the parties to a single file.
+
+        The file (a zip file) holds the names, coalitions and colors of the
+        parties, their logos and thumbnails (PNG) and the index used by
+        ``match()``, so that the set can be loaded with ``PartySet.load()``
+        without downloading images or extracting colors. ``path`` can be the
+        file the set was loaded from.
+
+        Args:
+            path (str): name of the file
+        """
+        # Parties in coalitions are saved even if they are not in the set
+        parties = []
+        ids = {}
+
+        def add(party):
+            if id(party) not in ids:
+                ids[id(party)] = len(parties)
+                parties.append(party)
+                for member in party.coalition or []:
+                    add(member)
+            return ids[id(party)]
+
+        keys = {key: add(party) for key, party in self.parties.items()}
+
+        # Written to a temporary file and renamed: the images not loaded yet
+        # may be read from ``path`` itself (a set saved where it was loaded)
+        tmp_path = '{0}.{1}-{2}.tmp'.format(path, os.getpid(),
+                                             threading.get_ident())
+        try:
+            snapshots = self._write_snapshot(tmp_path, parties, ids, keys)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # The images still in the old file are now in the new one
+        for party, snapshot in zip(parties, snapshots):
+            for item in ['logo', 'thumbnail']:
+                attr = '_{0}_value'.format(item)
+                value = getattr(party, attr)
+                if (isinstance(value, StoredImage) and
+                        os.path.abspath(value.path) == os.path.abspath(path)):
+                    setattr(party, attr, StoredImage(path, snapshot[item]))
+
+    def _write_snapshot(self, path, parties, ids, keys):
+        """Write the zip file of ``save``, return the snapshots."""
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+            snapshots = []
+            for i, party in enumerate(parties):
+                snapshot = party._snapshot(archive, 'images/{0}'.format(i))
+                if party.coalition:
+                    snapshot['coalition'] = [ids[id(member)]
+                                             for member in party.coalition]
+                snapshots.append(snapshot)
+
+            manifest = {'version': self.snapshot_version,
+                        'context_name': self.context_name,
+                        'keys': keys, 'parties': snapshots,
+                        'index': self._name_index().state()}
+            archive.writestr('manifest.json', json.dumps(manifest),
+                             zipfile.ZIP_DEFLATED)
+        return snapshots
+
+    @classmethod
+    def load(cls, path):
+        """Open a file written by ``save()``.
+
+        The logos and thumbnails are decoded the first time they are used.
+
+        Args:
+            path (str): name of the file
+
+        Returns:
+            mapache.PartySet: the saved parties
+        """
+        with zipfile.ZipFile(path) as archive:
+            manifest = json.loads(archive.read('manifest.json').decode('utf8'))
+        if manifest['version'] > cls.snapshot_version:
+            raise ValueError('{0} was saved with a newer version of '
+                             'mapache'.format(path))
+
+        parties = [Party._from_snapshot(snapshot, path)
+                   for snapshot in manifest['parties']]
+        for party, snapshot in zip(parties, manifest['parties']):
+            for member in snapshot.get('coalition', []):
+                party.add_to_coalition(parties[member])
+
+        party_set = cls(manifest['context_name'])
+        for key, i in manifest['keys'].items():
+            party_set.parties[key] = parties[i]
+        party_set._index = NameIndex.from_state(manifest['index'])
+        return party_set
+
+    def _name_index(self):
+        """Matching index with the names of all the parties."""
+        if self._index is None:
+            names, keys = [], []
+            for key, party in self.parties.items():
+                party_names = party.get_all_names()
+                names.extend(party_names)
+                keys.extend([key] * len(party_names))
+            self._index = NameIndex(names, keys)
+        return self._index
+
+
+class _PollBase:
+    """Methods of Poll and CompactPoll (which only differ in the storage)."""
+
+    __slots__ = ()
 
     def get_party(self, party, min_ratio=0.8, join_coalitions=True,
                   return_partial=False):
         # If return_partial return coalition votes even if not all parties
         # are in the poll
+        def matches(party, name):
+            return party.match(name) > min_ratio
+
+        return self._get_party(party, matches, join_coalitions,
+                               return_partial)
+
+    def _get_party(self, party, matches, join_coalitions=True,
+                   return_partial=False):
+        """Votes of a party, deciding which names match with ``matches``.
+
+        Args:
+            party (mapache.Party): party to look for
+            matches (callable): ``matches(party, name)`` is True if the
+                        column ``name`` of the poll corresponds to ``party``
+        """
         if party.name in self.parties:
             return self.parties[party.name]
 
         for p in self.parties:
-            ratio = party.match(p)
-            if ratio > min_ratio:
+            if matches(party, p):
                 return self.parties[p]
 
         # This should be tested... unit tests are my friends?
@@ -499,8 +940,7 @@ class Poll:
                     votes += self.parties[party_coal.name]
                 else:
                     for p in self.parties:
-                        ratio = party_coal.match(p)
-                        if ratio > min_ratio:
+                        if matches(party_coal, p):
                             votes += self.parties[p]
                             break
                 if not votes and not return_partial:
@@ -522,26 +962,421 @@ class Poll:
         return toprint
 
 
+class Poll(_PollBase):
+
+    def __init__(self,  parties, date, pollster='', error=None):
+
+        self.pollster = pollster
+        self.date = date
+        self.parties = parties
+        self.error = error
+        # TODO check types
+
+
+class _PollSchema:
+    """Column names shared by a group of polls.
+
+    Each name gets an index the first time it is added, and names are
+    interned so that all the polls share the same string objects.
+    """
+
+    __slots__ = ('names', 'index')
+
+    def __init__(self):
+        self.names = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        """Index of the column ``name``, added if it is new."""
+        i = self.index.get(name)
+        if i is None:
+            if isinstance(name, str):
+                name = sys.intern(name)
+            i = self.index[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+
+class _PollParties(Mapping):
+    """Read-only ``{party name: votes}`` view of a CompactPoll."""
+
+    __slots__ = ('_schema', '_votes')
+
+    def __init__(self, schema, votes):
+        self._schema = schema
+        self._votes = votes
+
+    def __getitem__(self, name):
+        i = self._schema.index.get(name)
+        if i is None or i >= len(self._votes):
+            raise KeyError(name)
+        votes = self._votes[i]
+        if votes != votes:
+            raise KeyError(name)
+        return votes
+
+    def __iter__(self):
+        names = self._schema.names
+        for i, votes in enumerate(self._votes):
+            # NaN marks the columns not in the poll
+            if votes == votes:
+                yield names[i]
+
+    def __len__(self):
+        return sum(1 for votes in self._votes if votes == votes)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class CompactPoll(_PollBase):
+    """Poll with a small memory footprint, for large collections of polls.
+
+    Instead of a dict per poll, the votes are stored in a typed array indexed
+    by a column schema shared by many polls (eg. all the polls of a
+    PollsList created with ``compact=True``), and the object has no
+    ``__dict__``. ``parties`` is a read-only mapping with the same interface
+    as the dict of mapache.Poll.
+    """
+
+    __slots__ = ('pollster', 'date', 'error', '_schema', '_votes')
+
+    def __init__(self, parties, date, pollster='', error=None, schema=None):
+        """Create a compact poll.
+
+        Args:
+            parties (dict): votes of each party
+            date (datetime.datetime): date of the poll
+            pollster (Optional[str]): name of the pollster
+            error (Optional[float]): error of the poll
+            schema (Optional[mapache.core._PollSchema]): schema shared with
+                        other polls, a new one if not indicated
+        """
+        if schema is None:
+            schema = _PollSchema()
+        if isinstance(pollster, str):
+            pollster = sys.intern(pollster)
+
+        indices = [schema.add(name) for name in parties]
+        votes = array('d', [float('nan')]) * (max(indices) + 1 if indices
+                                              else 0)
+        for i, value in zip(indices, parties.values()):
+            votes[i] = value
+
+        self.pollster = pollster
+        self.date = date
+        self.error = error
+        self._schema = schema
+        self._votes = votes
+
+    @classmethod
+    def from_poll(cls, poll, schema=None):
+        """CompactPoll with the same data as ``poll``."""
+        return cls(dict(poll.parties), poll.date, poll.pollster, poll.error,
+                   schema)
+
+    @property
+    def parties(self):
+        """Votes of each party in the poll (read-only mapping)."""
+        return _PollParties(self._schema, self._votes)
+
+
+class _ColumnResolver:
+    """Resolution table between the column names of polls and parties.
+
+    Whether a column name corresponds to a party is computed only once per
+    (party, column name) and then kept, so polls sharing their column names
+    only pay for the matching of the first one. New column names are resolved
+    the first time they are seen.
+
+    Parties are identified by their id and their names, so the table does
+    not keep them alive and a party whose names change is resolved again.
+    """
+
+    def __init__(self, min_ratio=0.8):
+        self.min_ratio = min_ratio
+        self._table = {}
+
+    def __call__(self, party, name):
+        key = (id(party), party._names_key())
+        columns = self._table.get(key)
+        if columns is None:
+            columns = self._table[key] = {}
+        matched = columns.get(name)
+        if matched is None:
+            matched = columns[name] = party.match(name) > self.min_ratio
+        return matched
+
+
 class PollsList:
 
-    def __init__(self, name=''):
+    def __init__(self, name='', compact=False):
+        """Create a list of polls.
+
+        Args:
+            name (Optional[str]): name of the list
+            compact (Optional[bool]): if True the polls are stored as
+                        mapache.CompactPoll sharing the column schema of the
+                        list, which takes much less memory
+        """
         self._name = name
-        self.polls = []
+        self._polls = []
+        self.compact = compact
+        self._columns = _PollSchema()
+        self._resolvers = {}
+        self._frame = None
+        # Type of the dates of the polls of a loaded file ('datetime' or
+        # 'date'), see load()
+        self._date_type = None
+        self._date_index = None
+
+    @property
+    def polls(self):
+        """List of the polls.
+
+        Lists loaded with ``load()`` only create the Poll objects the first
+        time they are requested.
+        """
+        if self._polls is None:
+            self._polls = self._polls_from_frame()
+        return self._polls
+
+    @polls.setter
+    def polls(self, polls):
+        self._polls = polls
 
     def add(self, poll):
         if isinstance(poll, PollsList):
-            for p in poll.polls:
-                self.polls.append(p)
+            polls = poll.polls
         else:
-            self.polls.append(poll)
+            polls = [poll]
         # TODO check types
 
-    def get_party(self, party, join_coalitions=True):
+        if self.compact:
+            polls = [p if isinstance(p, CompactPoll) and
+                     p._schema is self._columns
+                     else CompactPoll.from_poll(p, self._columns)
+                     for p in polls]
+
+        for p in polls:
+            self.polls.append(p)
+            for name in p.parties:
+                self._columns.add(name)
+
+        if self._frame is not None:
+            self._frame.extend(polls)
+        if self._date_index is not None:
+            self._date_index.extend(p.date for p in polls)
+
+    def columns(self):
+        """Names of the columns (parties) found in the polls.
+
+        Returns:
+            List[str]: column names, in the order they were first seen
+        """
+        return list(self._columns.names)
+
+    def _resolver(self, min_ratio=0.8):
+        """Column name resolution table for a given ``min_ratio``."""
+        resolver = self._resolvers.get(min_ratio)
+        if resolver is None:
+            resolver = self._resolvers[min_ratio] = _ColumnResolver(min_ratio)
+        return resolver
+
+    def get_party(self, party, join_coalitions=True, min_ratio=0.8):
         party_polls = []
+        resolver = self._resolver(min_ratio)
 
         for poll in self.polls:
-            poll_party = poll.get_party(party, join_coalitions=join_coalitions)
+            poll_party = poll._get_party(party, resolver,
+                                         join_coalitions=join_coalitions)
             if poll_party:
                 party_polls.append((poll.date, poll_party))
 
         return party_polls
+
+    def frame(self):
+        """Columnar (numpy) representation of the polls.
+
+        It is built the first time it is requested and then kept up to date
+        by ``add()``.
+
+        Returns:
+            mapache.frame.PollsFrame: dates, votes, pollsters and errors of
+                                      the polls as arrays
+        """
+        if self._frame is None:
+            self._frame = PollsFrame(self.polls)
+        return self._frame
+
+    def _dates(self):
+        """Index of the polls sorted by date, built the first time it is
+        needed and then kept up to date by ``add()``."""
+        if self._date_index is None:
+            if self._frame is not None:
+                self._date_index = DateIndex(self._frame.dates)
+            else:
+                self._date_index = DateIndex(p.date for p in self.polls)
+        return self._date_index
+
+    def dates(self):
+        """Dates of the polls, sorted.
+
+        Returns:
+            numpy.ndarray: dates (datetime64)
+        """
+        return self._dates().dates
+
+    def first(self):
+        """Earliest poll, None if there are no polls."""
+        order = self._dates().order
+        return self.polls[order[0]] if len(order) else None
+
+    def last(self):
+        """Latest poll (the last added of the latest date), None if there are
+        no polls."""
+        order = self._dates().order
+        return self.polls[order[-1]] if len(order) else None
+
+    def date_slice(self, start=None, end=None):
+        """Indices in ``polls`` of the polls between two dates, by date.
+
+        The dates are searched in a sorted index (O(log n)) and the result is
+        a view of it, so rolling windows over large lists are cheap. The
+        indices can also be used to select rows of ``frame()``.
+
+        Args:
+            start (Optional[datetime]): first date included, if any
+            end (Optional[datetime]): last date included, if any
+
+        Returns:
+            numpy.ndarray: indices of the polls
+        """
+        return self._dates().slice(start, end)
+
+    def between(self, start=None, end=None):
+        """New PollsList with the polls between two dates, sorted by date.
+
+        Args:
+            start (Optional[datetime]): first date included, if any
+            end (Optional[datetime]): last date included, if any
+        """
+        polls = PollsList(self._name, self.compact)
+        for i in self.date_slice(start, end):
+            polls.add(self.polls[i])
+        return polls
+
+    def save(self, path):
+        """Save the polls to a binary file.
+
+        The file stores the polls as arrays (see mapache.storage), and can be
+        opened with ``PollsList.load()``. The polls are loaded with their
+        dates, pollsters and parties (in the same order), but the errors are
+        floats, and None if unknown (eg. '').
+
+        Args:
+            path (str): name of the file, it can be the file the list was
+                        loaded from
+        """
+        date_type = self._date_type
+        if self._polls is not None:
+            date_type = 'datetime'
+            if self._polls and not any(isinstance(p.date, datetime.datetime)
+                                       for p in self._polls):
+                date_type = 'date'
+
+        save_frame(path, self.frame(), {'name': self._name,
+                                        'compact': self.compact,
+                                        'date_type': date_type})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Open a file written by ``save()``.
+
+        The arrays of the file are memory-mapped, so opening it takes the
+        same time whatever its size. The Poll objects are only created when
+        ``polls`` is first used, methods that work on ``frame()`` (eg.
+        ``get_party_array``) do not need them.
+
+        Args:
+            path (str): name of the file
+            mmap (Optional[bool]): if False the file is read in memory
+
+        Returns:
+            mapache.PollsList: the saved polls
+        """
+        frame, metadata = load_frame(path, mmap)
+        return cls.from_frame(frame, metadata.get('name', ''),
+                              metadata.get('compact', False),
+                              metadata.get('date_type', 'datetime'))
+
+    @classmethod
+    def from_frame(cls, frame, name='', compact=False, date_type='datetime'):
+        """PollsList with the polls of a PollsFrame.
+
+        As with ``load()``, the Poll objects are only created when ``polls``
+        is first used.
+
+        Args:
+            frame (mapache.frame.PollsFrame): the polls
+            name (Optional[str]): name of the list
+            compact (Optional[bool]): see ``PollsList()``
+            date_type (Optional[str]): type of the dates of the Poll objects,
+                        'datetime' or 'date'
+
+        Returns:
+            mapache.PollsList: list using ``frame`` (not copied)
+        """
+        polls = cls(name, compact)
+        polls._polls = None
+        polls._frame = frame
+        polls._date_type = date_type
+        for column in frame.columns:
+            polls._columns.add(column)
+        return polls
+
+    def _polls_from_frame(self):
+        """Poll objects of a loaded file."""
+        frame = self._frame
+        if self._date_type == 'date':
+            dates = frame.dates.astype('datetime64[D]').astype(object)
+        else:
+            dates = frame.dates.astype(datetime.datetime)
+        columns = frame.columns
+        values = frame.values
+        orders = frame.orders
+        order_codes = frame.order_codes
+
+        polls = []
+        for i in range(len(frame)):
+            row = values[i]
+            code = order_codes[i]
+            order = (orders[code] if code >= 0
+                     else np.flatnonzero(~np.isnan(row)))
+            parties = {columns[j]: float(row[j]) for j in order}
+            # Unknown errors (None, '', NaN) are None, the others floats
+            error = frame.errors[i]
+            error = None if np.isnan(error) else float(error)
+            if self.compact:
+                poll = CompactPoll(parties, dates[i], frame.pollsters[i],
+                                   error, self._columns)
+            else:
+                poll = Poll(parties, dates[i], frame.pollsters[i], error)
+            polls.append(poll)
+        return polls
+
+    def get_party_array(self, party, join_coalitions=True, min_ratio=0.8):
+        """Vectorized ``get_party``.
+
+        Returns:
+            Tuple[numpy.ndarray]: dates (datetime64) and votes of the polls
+                                  in which the party was found
+        """
+        frame = self.frame()
+        votes = frame.get_party(party, self._resolver(min_ratio),
+                                join_coalitions=join_coalitions)
+        found = ~np.isnan(votes) & (votes != 0)
+        return frame.dates[found], votes[found]
@@ -0,0 +1,354 @@
+"""Downloading of web pages and images.
+
+Everything mapache downloads (wiki pages, logos) goes through ``fetch``,
+which uses the current fetcher, a ``Fetcher`` by default. The fetcher can be
+replaced with ``set_fetcher`` by any object with a ``fetch(url)`` method, eg.
+a ``DirectoryFetcher`` reading the pages from local files in tests.
+"""
+
+# -*- coding: utf-8 -*-
+
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from mapache import profiling
+
+
+USER_AGENT = 'mapache (https://github.com/cesans/mapache)'
+
+
+def default_cache_dir():
+    """Default directory for the HTTP cache (``~/.cache/mapache/http``)."""
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'mapache', 'http')
+
+
+class HTTPCache:
+    """On-disk cache of responses, revalidated with conditional requests.
+
+    The responses with an ``ETag`` or ``Last-Modified`` header are stored.
+    When the url is requested again they are sent back to the server
+    (``If-None-Match`` and ``If-Modified-Since``), which answers 304 Not
+    Modified, without the content, if it has not changed.
+    """
+
+    def __init__(self, path=None):
+        """Create or open a cache.
+
+        Args:
+            path (Optional[str]): directory of the cache,
+                        ``default_cache_dir()`` if not indicated
+        """
+        if path is None:
+            path = default_cache_dir()
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, url):
+        return os.path.join(self.path,
+                            hashlib.sha1(url.encode('utf8')).hexdigest())
+
+    def validators(self, url):
+        """Headers to revalidate the cached response of ``url``.
+
+        Returns:
+            dict: conditional request headers, empty if ``url`` is not cached
+        """
+        try:
+            with open(self._file(url) + '.json') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def get(self, url):
+        """Cached content of ``url``, KeyError if not in the cache."""
+        try:
+            with open(self._file(url), 'rb') as f:
+                return f.read()
+        except OSError:
+            raise KeyError(url)
+
+    def set(self, url, data, etag=None, last_modified=None):
+        """Store the content of ``url`` if it has validators."""
+        if not (etag or last_modified):
+            return
+        path = self._file(url)
+        # Written to temporary files and renamed so that other threads and
+        # processes never read half-written entries
+        suffix = '.{0}-{1}.tmp'.format(os.getpid(), threading.get_ident())
+        with open(path + suffix, 'wb') as f:
+            f.write(data)
+        with open(path + '.json' + suffix, 'w') as f:
+            json.dump({'url': url, 'etag': etag,
+                       'last_modified': last_modified}, f)
+        os.replace(path + suffix, path)
+        os.replace(path + '.json' + suffix, path + '.json')
+
+
+class Fetcher:
+    """Download urls reusing connections.
+
+    Each thread keeps one persistent (keep-alive) connection per host, so
+    downloading several pages or images from the same server, even from a
+    pool of threads, does not pay for a new connection every time. The
+    connections of all the threads are closed by ``close``.
+
+    Failed requests (connection errors, timeouts, 429 and 5xx responses) are
+    retried ``retries`` times, waiting ``backoff``, ``2 * backoff``, ``4 *
+    backoff``... seconds (or what the server asks with ``Retry-After``).
+
+    With an ``HTTPCache`` the pages that have not changed since they were
+    last downloaded are not downloaded again (see HTTPCache).
+    """
+
+    max_redirects = 5
+
+    # Statuses of the responses that are retried
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, timeout=30, retries=3, backoff=0.5, cache=None):
+        """Create a Fetcher.
+
+        Args:
+            timeout (Optional[float]): timeout in seconds of the connections
+            retries (Optional[int]): number of retries of failed requests
+            backoff (Optional[float]): seconds before the first retry
+            cache (Optional[HTTPCache]): cache of the responses
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+        # Connections of every thread, by (thread id, scheme, host), so that
+        # close() can reach those of other threads (eg. of a pool)
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, scheme, host):
+        """Connection of the current thread to ``host``."""
+        key = (threading.get_ident(), scheme, host)
+        connection = self._connections.get(key)
+        if connection is None:
+            if scheme == 'https':
+                connection = http.client.HTTPSConnection(
+                    host, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(
+                    host, timeout=self.timeout)
+            # A good time to release the connections of finished threads
+            self.close(finished_only=True)
+            with self._lock:
+                self._connections[key] = connection
+        return connection
+
+    def _request(self, url, headers=None):
+        """GET ``url``, retrying once if the kept-alive connection died."""
+        parsed = urllib.parse.urlsplit(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        headers = dict(headers or {})
+        headers.update({'User-Agent': USER_AGENT, 'Connection': 'keep-alive'})
+
+        connection = self._connection(parsed.scheme, parsed.netloc)
+        for attempt in range(2):
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                return response, response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError, http.client.CannotSendRequest):
+                connection.close()
+                if attempt:
+                    raise
+            except Exception:
+                # The connection may be in any state (eg. after a timeout)
+                connection.close()
+                raise
+
+    def _delay(self, attempt, response=None):
+        """Seconds to wait before retrying (``attempt`` from 0)."""
+        retry_after = (response.getheader('Retry-After')
+                       if response is not None else None)
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * 2 ** attempt
+
+    def _get(self, url, headers):
+        """GET ``url``, retrying failed requests."""
+        for attempt in range(self.retries + 1):
+            try:
+                response, data = self._request(url, headers)
+            except (OSError, http.client.HTTPException):
+                if attempt == self.retries:
+                    raise
+                delay = self._delay(attempt)
+            else:
+                if (response.status not in self.retry_statuses or
+                        attempt == self.retries):
+                    return response, data
+                delay = self._delay(attempt, response)
+            time.sleep(delay)
+
+    @profiling.timed('fetch')
+    def fetch(self, url):
+        """Content of ``url``.
+
+        Redirections are followed. Urls other than http(s) (eg. ``file://``)
+        are opened with urllib.
+
+        Args:
+            url (str): url to be downloaded
+
+        Returns:
+            bytes: content of the url
+        """
+        for _ in range(self.max_redirects + 1):
+            scheme = urllib.parse.urlsplit(url).scheme
+            if scheme not in ('http', 'https'):
+                return urllib.request.urlopen(url, timeout=self.timeout).read()
+
+            headers = self.cache.validators(url) if self.cache else {}
+            response, data = self._get(url, headers)
+            if response.status == 304 and headers:
+                try:
+                    data = self.cache.get(url)
+                except KeyError:
+                    # Removed from the cache meanwhile, download it again
+                    response, data = self._get(url, {})
+                else:
+                    profiling.hit('cache.http')
+                    return data
+            elif self.cache:
+                profiling.miss('cache.http')
+
+            if response.status in (301, 302, 303, 307, 308):
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                continue
+            if response.status >= 400:
+                raise urllib.error.HTTPError(url, response.status,
+                                             response.reason,
+                                             response.msg, None)
+            if self.cache:
+                self.cache.set(url, data, response.getheader('ETag'),
+                               response.getheader('Last-Modified'))
+            return data
+
+        raise urllib.error.URLError('Too many redirections: ' + url)
+
+    def close(self, finished_only=False):
+        """Close the connections of all the threads.
+
+        The connections of threads still downloading are closed too, so
+        by default it must not be called during downloads.
+
+        Args:
+            finished_only (Optional[bool]): only close the connections of
+                        the threads that have finished (eg. the workers of a
+                        pool that has been shut down)
+        """
+        with self._lock:
+            if finished_only:
+                alive = set(t.ident for t in threading.enumerate())
+                keys = [k for k in self._connections if k[0] not in alive]
+            else:
+                keys = list(self._connections)
+            connections = [self._connections.pop(k) for k in keys]
+        for connection in connections:
+            connection.close()
+
+
+class DirectoryFetcher:
+    """Fetcher reading the urls from the files of a directory.
+
+    The file of a url is the url quoted as a single file name (eg.
+    ``https%3A%2F%2Fen.wikipedia.org%2Fwiki%2FPodemos``) or, if there is no
+    such file, the last part of its path (``Podemos``), so recorded pages
+    and images can be used in tests or without network access.
+
+    Urls without a file are downloaded with ``fallback``, if given, and
+    saved in the directory if ``record`` is True. Otherwise they raise
+    urllib.error.URLError.
+    """
+
+    def __init__(self, directory, fallback=None, record=False):
+        """
+        Args:
+            directory (str): directory with the files
+            fallback (Optional): fetcher of the urls without a file, eg. a
+                        Fetcher
+            record (Optional[bool]): save the urls downloaded by
+                        ``fallback``
+        """
+        self.directory = directory
+        self.fallback = fallback
+        self.record = record
+
+    def path(self, url):
+        """Name of the file of ``url`` when it is recorded."""
+        return os.path.join(self.directory, urllib.parse.quote(url, safe=''))
+
+    def _find(self, url):
+        name = os.path.basename(urllib.parse.urlsplit(url).path)
+        for path in [self.path(url),
+                     os.path.join(self.directory,
+                                  urllib.parse.unquote(name))]:
+            if os.path.isfile(path):
+                return path
+        return None
+
+    @profiling.timed('fetch')
+    def fetch(self, url):
+        """Content of the file of ``url``."""
+        path = self._find(url)
+        if path is not None:
+            with open(path, 'rb') as f:
+                return f.read()
+        if self.fallback is None:
+            raise urllib.error.URLError('No file for ' + url)
+
+        data = self.fallback.fetch(url)
+        if self.record:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path(url), 'wb') as f:
+                f.write(data)
+        return data
+
+
+_fetcher = Fetcher()
+
+
+def set_fetcher(fetcher):
+    """Set the fetcher used by mapache for every download.
+
+    Args:
+        fetcher: Fetcher, DirectoryFetcher or any object with a
+                 ``fetch(url)`` method returning bytes. None to go back to
+                 a default Fetcher.
+    """
+    global _fetcher
+    _fetcher = fetcher if fetcher is not None else Fetcher()
+
+
+def get_fetcher():
+    """Fetcher used by mapache."""
+    return _fetcher
+
+
+def fetch(url):
+    """Content of ``url``, downloaded with the current mapache fetcher."""
+    return _fetcher.fetch(url)
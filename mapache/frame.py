@@ -0,0 +1,487 @@
+"""Columnar storage for polls."""
+
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+DATE_DTYPE = 'datetime64[us]'
+
+
+def _to_datetime64(date):
+    """Convert a date (datetime, str, datetime64) to numpy's datetime64."""
+    return np.datetime64(date, 'us')
+
+
+def _to_error(error):
+    """Error of a poll as a float, NaN if unknown (eg. None or '')."""
+    try:
+        return float(error)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class PollsFrame:
+    """Columnar representation of a group of polls.
+
+    The polls are stored as numpy arrays: ``dates`` (datetime64), ``values``
+    (a polls x columns matrix with the votes, NaN if the party is not in the
+    poll), ``pollsters`` and ``errors`` (NaN if unknown). ``columns`` holds
+    the names of the columns of ``values``, in the order they were first seen.
+
+    The order of the parties of each poll is kept too, as ``order_codes``,
+    an index in ``orders`` (tuples of columns, shared by the polls with the
+    same parties in the same order). -1 stands for the order of ``columns``.
+
+    Rows can be appended; the arrays are over-allocated so that appending
+    polls one by one is amortized O(1).
+    """
+
+    def __init__(self, polls=()):
+        """Create a PollsFrame.
+
+        Args:
+            polls (Optional[iterable of mapache.Poll]): initial polls
+        """
+        self.columns = []
+        self._column_idx = {}
+        self._n = 0
+        self._dates = np.empty(0, dtype=DATE_DTYPE)
+        self._values = np.empty((0, 0))
+        self._pollsters = np.empty(0, dtype=object)
+        # Pollsters not decoded yet (see from_arrays): codes and names
+        self._pollster_codes = None
+        self._pollster_names = None
+        self._errors = np.empty(0)
+        self.orders = []
+        self._order_idx = {}
+        self._order_codes = np.empty(0, dtype=np.int32)
+        self.extend(polls)
+
+    @classmethod
+    def from_arrays(cls, columns, dates, values, pollsters, errors,
+                    pollster_names=None, orders=None, order_codes=None):
+        """PollsFrame using existing arrays (eg. memory-mapped), not copied.
+
+        The arrays are only copied if polls are appended to the frame.
+
+        Args:
+            columns (List[str]): names of the columns of ``values``
+            dates (numpy.ndarray): dates of the polls (datetime64)
+            values (numpy.ndarray): votes, polls x columns
+            pollsters (numpy.ndarray): pollster of each poll or, with
+                        ``pollster_names``, its index in ``pollster_names``.
+                        The names are then only looked up when
+                        ``pollsters`` is used.
+            errors (numpy.ndarray): error of each poll, NaN if unknown
+            pollster_names (Optional[numpy.ndarray]): names of the pollsters
+            orders (Optional[List[tuple]]): see ``orders``
+            order_codes (Optional[numpy.ndarray]): see ``order_codes``, by
+                        default the parties are in the order of ``columns``
+        """
+        frame = cls()
+        frame.columns = list(columns)
+        frame._column_idx = {name: i for i, name in enumerate(frame.columns)}
+        frame._n = len(dates)
+        frame._dates = dates
+        frame._values = values.reshape(len(dates), len(frame.columns))
+        if pollster_names is None:
+            frame._pollsters = pollsters
+        else:
+            frame._pollsters = None
+            frame._pollster_codes = pollsters
+            frame._pollster_names = np.asarray(pollster_names, dtype=object)
+        frame._errors = errors
+        if order_codes is None:
+            order_codes = np.full(len(dates), -1, dtype=np.int32)
+        frame.orders = [tuple(order) for order in orders or []]
+        frame._order_idx = {order: i for i, order in enumerate(frame.orders)}
+        frame._order_codes = order_codes
+        return frame
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def dates(self):
+        """Dates of the polls (datetime64)."""
+        return self._dates[:self._n]
+
+    @property
+    def values(self):
+        """Votes, polls x columns. NaN if the column is not in the poll."""
+        return self._values[:self._n, :len(self.columns)]
+
+    @property
+    def pollsters(self):
+        """Pollster of each poll."""
+        if self._pollsters is None:
+            self._pollsters = self._pollster_names[self._pollster_codes]
+            self._pollster_codes = self._pollster_names = None
+        return self._pollsters[:self._n]
+
+    def pollster_codes(self):
+        """Pollsters as an index in a list of names, without decoding them.
+
+        Returns:
+            Tuple[numpy.ndarray]: names of the pollsters and index of the
+                                  pollster of each poll in the names
+        """
+        if self._pollsters is None:
+            return self._pollster_names, self._pollster_codes[:self._n]
+        names = []
+        index = {}
+        codes = np.empty(self._n, dtype=np.int32)
+        for i, pollster in enumerate(self.pollsters):
+            code = index.get(pollster)
+            if code is None:
+                code = index[pollster] = len(names)
+                names.append(pollster)
+            codes[i] = code
+        result = np.empty(len(names), dtype=object)
+        result[:] = names
+        return result, codes
+
+    @property
+    def errors(self):
+        """Error of each poll, NaN if unknown."""
+        return self._errors[:self._n]
+
+    @property
+    def order_codes(self):
+        """Order of the parties of each poll, index in ``orders``."""
+        return self._order_codes[:self._n]
+
+    def append(self, poll):
+        """Add a poll at the end of the frame.
+
+        Args:
+            poll (mapache.Poll): poll to be added
+        """
+        self.extend([poll])
+
+    def extend(self, polls):
+        """Add several polls at the end of the frame.
+
+        Args:
+            polls (iterable of mapache.Poll): polls to be added
+        """
+        polls = list(polls)
+        if not polls:
+            return
+
+        for poll in polls:
+            for name in poll.parties:
+                if name not in self._column_idx:
+                    self._column_idx[name] = len(self.columns)
+                    self.columns.append(name)
+        self._reserve(self._n + len(polls))
+
+        column_idx = self._column_idx
+        order_idx = self._order_idx
+        for i, poll in enumerate(polls, self._n):
+            self._dates[i] = _to_datetime64(poll.date)
+            self._pollsters[i] = poll.pollster
+            self._errors[i] = _to_error(poll.error)
+            row = self._values[i]
+            order = []
+            for name, votes in poll.parties.items():
+                j = column_idx[name]
+                row[j] = votes
+                order.append(j)
+            order = tuple(order)
+            code = order_idx.get(order)
+            if code is None:
+                code = order_idx[order] = len(self.orders)
+                self.orders.append(order)
+            self._order_codes[i] = code
+        self._n += len(polls)
+
+    def _reserve(self, rows):
+        """Make room for ``rows`` rows and all the current columns."""
+        capacity, width = self._values.shape
+        ncolumns = len(self.columns)
+        if rows <= capacity and ncolumns <= width:
+            return
+        if rows > capacity:
+            capacity = max(rows, 2 * capacity)
+        if ncolumns > width:
+            width = max(ncolumns, 2 * width)
+
+        n = self._n
+        values = np.full((capacity, width), np.nan)
+        values[:n, :self._values.shape[1]] = self._values[:n]
+        self._values = values
+
+        if capacity > len(self._dates):
+            dates = np.empty(capacity, dtype=DATE_DTYPE)
+            dates[:n] = self._dates[:n]
+            self._dates = dates
+            pollsters = np.empty(capacity, dtype=object)
+            pollsters[:n] = self.pollsters
+            self._pollsters = pollsters
+            errors = np.full(capacity, np.nan)
+            errors[:n] = self._errors[:n]
+            self._errors = errors
+            order_codes = np.empty(capacity, dtype=np.int32)
+            order_codes[:n] = self._order_codes[:n]
+            self._order_codes = order_codes
+
+    def column(self, name):
+        """Votes of the column ``name`` (NaN where missing).
+
+        Args:
+            name (str): name of the column, as it appears in the polls
+        """
+        if name not in self._column_idx:
+            return np.full(self._n, np.nan)
+        return self.values[:, self._column_idx[name]]
+
+    def _first_of(self, names):
+        """For each poll, votes of the first of ``names`` in the poll."""
+        result = np.full(self._n, np.nan)
+        for name in names:
+            missing = np.isnan(result)
+            if not missing.any():
+                break
+            result[missing] = self.column(name)[missing]
+        return result
+
+    def _party_votes(self, party, matches):
+        """Votes of a party, without considering coalitions.
+
+        As in Poll.get_party, the column named as the party or, if the poll
+        does not have it, the first matching column in the order of the
+        parties of the poll.
+        """
+        matching = np.array([matches(party, name) for name in self.columns],
+                            dtype=bool)
+        result = np.full(self._n, np.nan)
+        if matching.any():
+            # First matching column of each order, the last one for -1
+            first = np.full(len(self.orders) + 1, -1)
+            for code, order in enumerate(self.orders):
+                for j in order:
+                    if matching[j]:
+                        first[code] = j
+                        break
+            codes = self.order_codes
+            columns = first[codes]
+            rows = np.flatnonzero((codes >= 0) & (columns >= 0))
+            result[rows] = self.values[rows, columns[rows]]
+
+            in_columns_order = codes < 0
+            if in_columns_order.any():
+                names = [self.columns[j] for j in np.flatnonzero(matching)]
+                result[in_columns_order] = self._first_of(
+                    names)[in_columns_order]
+
+        if party.name in self._column_idx:
+            exact = self.column(party.name)
+            found = ~np.isnan(exact)
+            result[found] = exact[found]
+        return result
+
+    def get_party(self, party, matches, join_coalitions=True,
+                  return_partial=False):
+        """Votes of a party in every poll (vectorized Poll._get_party).
+
+        Args:
+            party (mapache.Party): party to look for
+            matches (callable): ``matches(party, name)`` is True if the
+                        column ``name`` corresponds to ``party``
+            join_coalitions (Optional[bool]): if the party is not found sum
+                        the votes of the parties of its coalition
+            return_partial (Optional[bool]): return the coalition votes even
+                        if some parties are not in the poll
+
+        Returns:
+            numpy.ndarray: votes of the party in each poll, NaN if not found
+        """
+        votes = self._party_votes(party, matches)
+
+        if join_coalitions and party.coalition:
+            missing = np.isnan(votes)
+            members = [self._party_votes(p, matches)[missing]
+                       for p in party.coalition]
+            coalition = np.nansum(members, axis=0)
+            if not return_partial:
+                # As in Poll.get_party, the coalition is not found if the
+                # first of its parties is not in the poll
+                first = members[0]
+                coalition[np.isnan(first) | (first == 0)] = np.nan
+            votes[missing] = coalition
+
+        return votes
+
+    def party_matrix(self, parties, matches, join_coalitions=True):
+        """Votes of several parties, polls x parties.
+
+        Args:
+            parties (iterable of mapache.Party): parties, one per column
+            matches (callable): see ``get_party``
+
+        Returns:
+            numpy.ndarray: polls x parties matrix, NaN if not found
+        """
+        parties = list(parties)
+        matrix = np.full((self._n, len(parties)), np.nan)
+        for i, party in enumerate(parties):
+            matrix[:, i] = self.get_party(party, matches, join_coalitions)
+        return matrix
+
+    def pollster_mask(self, pollster):
+        """Boolean mask of the polls made by ``pollster``."""
+        if self._pollsters is None:
+            names, codes = self.pollster_codes()
+            return np.isin(codes, np.flatnonzero(names == pollster))
+        return self.pollsters == pollster
+
+    def date_mask(self, start=None, end=None):
+        """Boolean mask of the polls between ``start`` and ``end``.
+
+        Args:
+            start (Optional[datetime]): first date included, if any
+            end (Optional[datetime]): last date included, if any
+        """
+        mask = np.ones(self._n, dtype=bool)
+        if start is not None:
+            mask &= self.dates >= _to_datetime64(start)
+        if end is not None:
+            mask &= self.dates <= _to_datetime64(end)
+        return mask
+
+    def between(self, start=None, end=None):
+        """New frame with the polls between ``start`` and ``end``."""
+        return self.select(self.date_mask(start, end))
+
+    def select(self, rows):
+        """New frame with a subset of the polls.
+
+        Args:
+            rows (numpy.ndarray): boolean mask or indices of the polls
+        """
+        frame = type(self)()
+        frame.columns = list(self.columns)
+        frame._column_idx = dict(self._column_idx)
+        frame._dates = self.dates[rows]
+        frame._values = self.values[rows]
+        if self._pollsters is None:
+            frame._pollsters = None
+            frame._pollster_names, codes = self.pollster_codes()
+            frame._pollster_codes = codes[rows]
+        else:
+            frame._pollsters = self.pollsters[rows]
+        frame._errors = self.errors[rows]
+        frame.orders = list(self.orders)
+        frame._order_idx = dict(self._order_idx)
+        frame._order_codes = self.order_codes[rows]
+        frame._n = len(frame._dates)
+        return frame
+
+
+class DateIndex:
+    """Positions of a group of polls sorted by their dates.
+
+    Polls are identified by their position (the order in which they were
+    added). Dates added in order, the usual case, are appended in amortized
+    O(1); the others are kept aside and merged, all at once, before the next
+    query. Queries on a range of dates are O(log n) and return views.
+    """
+
+    def __init__(self, dates=()):
+        """Create a DateIndex.
+
+        Args:
+            dates (Optional[iterable]): dates of the initial polls
+        """
+        self._n = 0
+        self._dates = np.empty(0, dtype=DATE_DTYPE)
+        self._order = np.empty(0, dtype=np.intp)
+        self._pending = []
+        self._count = 0
+        self.extend(dates)
+
+    def __len__(self):
+        return self._count
+
+    def extend(self, dates):
+        """Add the dates of new polls (their positions follow the last one).
+
+        Args:
+            dates (iterable): dates (datetime, datetime64...) of the polls
+        """
+        if isinstance(dates, np.ndarray) and dates.dtype.kind == 'M':
+            dates = dates.astype(DATE_DTYPE)
+        else:
+            dates = np.array([_to_datetime64(date) for date in dates],
+                             dtype=DATE_DTYPE)
+        if not len(dates):
+            return
+        positions = np.arange(self._count, self._count + len(dates))
+        self._count += len(dates)
+
+        in_order = (not self._pending and
+                    (self._n == 0 or dates[0] >= self._dates[self._n - 1]) and
+                    not (dates[1:] < dates[:-1]).any())
+        if not in_order:
+            self._pending.append((dates, positions))
+            return
+
+        n = self._n + len(dates)
+        if n > len(self._dates):
+            capacity = max(n, 2 * len(self._dates))
+            for name in ['_dates', '_order']:
+                old = getattr(self, name)
+                new = np.empty(capacity, dtype=old.dtype)
+                new[:self._n] = old[:self._n]
+                setattr(self, name, new)
+        self._dates[self._n:n] = dates
+        self._order[self._n:n] = positions
+        self._n = n
+
+    def _merge(self):
+        """Insert the dates that were not added in order."""
+        if not self._pending:
+            return
+        dates = np.concatenate([d for d, _ in self._pending])
+        positions = np.concatenate([p for _, p in self._pending])
+        self._pending = []
+
+        order = np.argsort(dates, kind='stable')
+        dates, positions = dates[order], positions[order]
+        # After the polls with the same date, which were added before
+        where = np.searchsorted(self.dates, dates, side='right')
+        self._dates = np.insert(self._dates[:self._n], where, dates)
+        self._order = np.insert(self._order[:self._n], where, positions)
+        self._n = len(self._dates)
+
+    @property
+    def dates(self):
+        """Dates of the polls, sorted (datetime64)."""
+        self._merge()
+        return self._dates[:self._n]
+
+    @property
+    def order(self):
+        """Positions of the polls sorted by date."""
+        self._merge()
+        return self._order[:self._n]
+
+    def slice(self, start=None, end=None):
+        """Positions, sorted by date, of the polls between two dates.
+
+        Args:
+            start (Optional[datetime]): first date included, if any
+            end (Optional[datetime]): last date included, if any
+
+        Returns:
+            numpy.ndarray: positions of the polls (a view, not a copy)
+        """
+        dates = self.dates
+        lo, hi = 0, len(dates)
+        if start is not None:
+            lo = np.searchsorted(dates, _to_datetime64(start), side='left')
+        if end is not None:
+            hi = np.searchsorted(dates, _to_datetime64(end), side='right')
+        return self.order[lo:max(lo, hi)]
@@ -0,0 +1,167 @@
+"""Fast fuzzy matching of party names.
+
+The similarity used across mapache is the ratio returned by
+``mapache.Party._levenshtein_distance``, a Levenshtein distance where a
+substitution costs two edits. With that cost the distance between two strings
+of lengths ``m`` and ``n`` is ``m + n - 2 * LCS`` (``LCS`` being the length of
+their longest common subsequence), so the ratio can be obtained from the LCS
+alone, which has a fast bit-parallel formulation.
+"""
+
+# -*- coding: utf-8 -*-
+
+from mapache import profiling
+
+
+def normalize(name):
+    """Normalize a name before comparing it (upper-case)."""
+    if not name:
+        return ''
+    return name.upper()
+
+
+def _ratio_from_lcs(m, n, lcs):
+    """Same ratio as ``Party._levenshtein_distance``, from the LCS length."""
+    if not (m and n):
+        return 0
+    lensum = float(m + n)
+    ldist = m + n - 2 * lcs
+    return (lensum - ldist) / lensum
+
+
+class NameIndex:
+    """Score a name against many names in a single pass.
+
+    All the names are normalized once and packed, one after the other, in the
+    bits of a single integer, each of them followed by a guard bit. The
+    bit-parallel LCS algorithm (Allison-Dix, Hyyro) is then run over all of
+    them at the same time: each character of the query costs a handful of
+    operations on that integer, whatever the number of names. The guard bits
+    absorb the carries so that the names do not interfere with each other.
+
+    Results are memoized by (normalized) query.
+    """
+
+    max_memo = 10000
+
+    def __init__(self, names, owners=None):
+        """Create the index.
+
+        Args:
+            names (List[str]): names to be matched against
+            owners (Optional[list]): owner of each name (eg. the key of a
+                        party). The score of an owner is the best score of
+                        its names. If not indicated each name is its own
+                        owner.
+        """
+        if owners is None:
+            owners = list(names)
+
+        self.owners = []
+        owner_idx = {}
+        self._fields = []   # (offset, length, owner index) of each name
+        self._masks = {}
+        self.names = []
+
+        offset = 0
+        for name, owner in zip(names, owners):
+            if owner not in owner_idx:
+                owner_idx[owner] = len(self.owners)
+                self.owners.append(owner)
+            name = normalize(name)
+            if not name:
+                continue
+            self.names.append(name)
+            for i, char in enumerate(name):
+                self._masks[char] = (self._masks.get(char, 0) |
+                                     (1 << (offset + i)))
+            self._fields.append((offset, len(name), owner_idx[owner]))
+            # One guard bit after each name
+            offset += len(name) + 1
+
+        self._value_mask = 0
+        for field_offset, length, _ in self._fields:
+            self._value_mask |= ((1 << length) - 1) << field_offset
+
+        self._memo = {}
+
+    def state(self):
+        """The index as a JSON serializable dict, see ``from_state``."""
+        return {'owners': self.owners, 'names': self.names,
+                'fields': self._fields, 'masks': self._masks,
+                'value_mask': self._value_mask}
+
+    @classmethod
+    def from_state(cls, state):
+        """Index saved with ``state()``, without building it again."""
+        index = cls.__new__(cls)
+        index.owners = list(state['owners'])
+        index.names = list(state['names'])
+        index._fields = [tuple(field) for field in state['fields']]
+        index._masks = dict(state['masks'])
+        index._value_mask = state['value_mask']
+        index._memo = {}
+        return index
+
+    def scores(self, query):
+        """Ratio between ``query`` and each owner.
+
+        Args:
+            query (str): name to be evaluated
+
+        Returns:
+            Tuple[float]: best ratio of each owner, in the order of
+                          ``self.owners``
+        """
+        query = normalize(query)
+        if query in self._memo:
+            profiling.hit('match')
+            return self._memo[query]
+        profiling.miss('match')
+
+        result = [0] * len(self.owners)
+        n = len(query)
+        if n and self._fields:
+            v = self._value_mask
+            masks = self._masks
+            value_mask = self._value_mask
+            for char in query:
+                u = v & masks.get(char, 0)
+                v = ((v + u) | (v - u)) & value_mask
+
+            for field_offset, length, owner in self._fields:
+                field = (v >> field_offset) & ((1 << length) - 1)
+                lcs = length - bin(field).count('1')
+                ratio = _ratio_from_lcs(length, n, lcs)
+                if ratio > result[owner]:
+                    result[owner] = ratio
+
+        # A tuple, so that callers can not change the memo
+        result = tuple(result)
+        if len(self._memo) >= self.max_memo:
+            self._memo.clear()
+        self._memo[query] = result
+        return result
+
+    def best(self, query):
+        """Owner that best matches ``query``.
+
+        Ties are resolved in favour of the first owner.
+
+        Returns:
+            Tuple: (owner, ratio), owner is None if no name shares a single
+                   character with the query
+        """
+        best_owner, best_ratio = None, 0
+        for owner, ratio in zip(self.owners, self.scores(query)):
+            if ratio > best_ratio:
+                best_owner, best_ratio = owner, ratio
+        return best_owner, best_ratio
+
+
+def ratio(str1, str2):
+    """Similarity ratio between two names.
+
+    Equivalent to ``Party._levenshtein_distance(str1, str2)['ratio']``.
+    """
+    return NameIndex([str1]).scores(str2)[0]
@@ -1,9 +1,18 @@
 import mapache
+from mapache import profiling
+from mapache.fetch import fetch, get_fetcher, Fetcher
 
 from bs4 import BeautifulSoup
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from html.parser import HTMLParser
+import codecs
+import collections
+import io
+import os
 
 from dateutil.parser import parse
+import datetime
+import re
 
 try:
     from tqdm import tqdm
@@ -14,6 +23,162 @@ except:
         return kwargs.get('iterable', None)
 
 
+class DateParser:
+    """Parse the dates of the rows of a table.
+
+    Tables repeat the same date strings and formats over and over, so:
+        - parsed strings are memoized (up to ``maxsize`` of them)
+        - the format of the dates is learnt from the first rows, and then
+          ``datetime.strptime`` is used with it. dateutil is only used for
+          the dates that do not match the format.
+
+    Ranges of dates (eg. "12-15 Jun 2016", "28 May - 3 Jun 2016") are
+    understood: ``parse_range`` returns the first and last day, and
+    ``parse`` the last one.
+    """
+
+    # Numeric dates are month first, as dateutil reads them
+    formats = ['%d %b %Y', '%d %B %Y', '%b %d, %Y', '%B %d, %Y', '%Y-%m-%d',
+               '%m/%d/%Y', '%m.%d.%Y', '%d %b', '%d %B', '%b %d', '%B %d']
+
+    _range = re.compile(r'^(.*?\S)\s*(?:\s-\s|[\u2013\u2014])\s*(\S.*)$')
+    # eg. 12-15 Jun 2016, but not 12-06-2016
+    _day_range = re.compile(r'^(\d{1,2})\s*-\s*(\d{1,2}\s*[^\W\d].*)$')
+    _month_day_range = re.compile(
+        r'^([^\W\d]+\.?)\s+(\d{1,2})\s*[-\u2013\u2014]\s*(\d{1,2})(,?\s*\d{4})?$')
+    _notes = re.compile(r'\[[^\]]*\]')
+
+    def __init__(self, maxsize=4096, learn_rows=5, default=None):
+        """Create a DateParser.
+
+        Args:
+            maxsize (Optional[int]): maximum number of memoized strings
+            learn_rows (Optional[int]): number of dates used to learn the
+                        format
+            default (Optional[datetime]): date from which missing parts
+                        (eg. the year) are taken, today by default
+        """
+        self.maxsize = maxsize
+        self.learn_rows = learn_rows
+        if default is None:
+            default = datetime.datetime.combine(datetime.date.today(),
+                                                datetime.time())
+        self.default = default
+        self.format = None
+        self._learnt = 0
+        self._memo = collections.OrderedDict()
+
+    def parse(self, text):
+        """Parse a date (the last day if it is a range).
+
+        Returns:
+            datetime.datetime: the date
+        """
+        return self.parse_range(text)[1]
+
+    def parse_range(self, text):
+        """Parse a date or a range of dates.
+
+        Returns:
+            Tuple[datetime.datetime]: first and last day, the same for a
+                                      single date
+        """
+        if text in self._memo:
+            self._memo.move_to_end(text)
+            return self._memo[text]
+
+        clean = self._notes.sub('', text).strip()
+        month_day = self._month_day_range.match(clean)
+        match = (self._day_range.match(clean) or self._range.match(clean))
+        if month_day:
+            # eg. Jun 3-5, 2016
+            month, first, last, year = month_day.groups()
+            year = year or ''
+            if int(last) < int(first):
+                # eg. Jun 30-2, 2016, the month is the one of the first day
+                start = self._parse_single(month + ' ' + first + year,
+                                           self.default)
+                end = self._day_after(start, int(last))
+            else:
+                end = self._parse_single(month + ' ' + last + year,
+                                         self.default)
+                start = self._parse_single(month + ' ' + first + year, end)
+            result = (start, end)
+        elif match:
+            first, last = match.groups()
+            end = self._parse_single(last, self.default)
+            if first.isdigit():
+                start = self._day_before(end, int(first))
+            else:
+                start = self._parse_single(first, end)
+                if start > end:
+                    # eg. 28 Dec - 3 Jan 2017
+                    start = start.replace(year=start.year - 1)
+            result = (start, end)
+        else:
+            date = self._parse_single(clean, self.default)
+            result = (date, date)
+
+        self._memo[text] = result
+        if len(self._memo) > self.maxsize:
+            self._memo.popitem(last=False)
+        return result
+
+    @staticmethod
+    def _day_before(end, day):
+        """Last date with day of the month ``day`` not after ``end``.
+
+        eg. the 30th before 2 Jul is 30 Jun. Days that the previous month
+        does not have are moved to its last day.
+        """
+        if day <= end.day:
+            return end.replace(day=day)
+        previous = end.replace(day=1) - datetime.timedelta(days=1)
+        return previous.replace(day=min(day, previous.day))
+
+    @staticmethod
+    def _day_after(start, day):
+        """First date with day of the month ``day`` not before ``start``.
+
+        eg. the 2nd after 30 Jun is 2 Jul. Days that the next month does not
+        have are moved to its last day.
+        """
+        if day >= start.day:
+            return start.replace(day=day)
+        # Any day after the 28th is in the next month
+        following = (start.replace(day=28) +
+                     datetime.timedelta(days=4)).replace(day=1)
+        after = (following.replace(day=28) +
+                 datetime.timedelta(days=4)).replace(day=1)
+        last = (after - datetime.timedelta(days=1)).day
+        return following.replace(day=min(day, last))
+
+    def _parse_single(self, text, default):
+        """Parse a single date, the missing year is taken from ``default``."""
+        if self.format is None and self._learnt < self.learn_rows:
+            self._learnt += 1
+            for fmt in self.formats:
+                try:
+                    datetime.datetime.strptime(text, fmt)
+                except ValueError:
+                    continue
+                self.format = fmt
+                break
+
+        if self.format is not None:
+            try:
+                date = datetime.datetime.strptime(text, self.format)
+            except ValueError:
+                pass
+            else:
+                if '%Y' not in self.format:
+                    date = date.replace(year=default.year)
+                return date
+
+        return parse(text, default=default)
+
+
+@profiling.timed('parse.table')
 def poll_from_table(table, date_column, party_columns, name=None,
                     party_names=None, error_column=None, pollster_column=None,
                     poll_rows=None):
@@ -24,63 +189,340 @@ def poll_from_table(table, date_column, party_columns, name=None,
         # TODO, is it a good guess?
         poll_rows = (2, -0)
 
-    row = wikitable_get_rows(table)[0]
-    cells = wikitable_get_cells(row)
-
     # TODO if wrong columns in args?
 
-    if error_column is not None:
-        polls = mapache.PollsList(name)
-    
-    if not party_names:  # Try to extract the names from the first row...
-        party_names = []
-        row = wikitable_get_rows(table)[0]
-        cells = wikitable_get_cells(row)
+    polls = mapache.PollsList(name)
+
+    rows = wikitable_get_rows(table)
 
-        for c in cells[party_columns[0]:party_columns[1]]:
-            _, party_name = wikitable_get_url(c)
-            if name is None:
-                # TODO
-                return None
-            party_names.append(party_name)
+    if not party_names:  # Try to extract the names from the first row...
+        party_names = _party_names_from_header(
+            wikitable_get_cells(rows[0]), party_columns, wikitable_get_url)
+        if party_names is None:
+            return None
 
-    rows = wikitable_get_rows(table)[poll_rows[0]: poll_rows[1]]
+    # An end of 0 (or -0) means up to the last row
+    rows = rows[poll_rows[0]: poll_rows[1] or None]
 
+    date_parser = DateParser()
     for row in tqdm(rows):
-        cells = wikitable_get_cells(row)
+        poll = _poll_from_cells(wikitable_get_cells(row), date_column,
+                                party_columns, party_names, error_column,
+                                pollster_column, date_parser)
+        if poll is not None:
+            polls.add(poll)
 
-        if len(cells) <= 3:
-            # TODO ??
-            continue
+    return polls
 
-        pollster = None
-        if pollster_column is not None:
-            pollster = cells[pollster_column].text
 
-        err = None
-        if error_column is not None:
-            err = cells[-3].text
-            if err:
-                err = float(err[1:].split(' ')[0])
+def _party_names_from_header(cells, party_columns, get_url):
+    """Party names from the links in the header of a table.
 
-        date = cells[date_column].text
-        date = parse(date)
+    Returns:
+        List[str]: names of the parties, None if a column has no link
+    """
+    party_names = []
+    for c in cells[party_columns[0]:party_columns[1]]:
+        _, party_name = get_url(c)
+        if party_name is None:
+            # TODO
+            return None
+        party_names.append(party_name)
+    return party_names
 
-        votes = {}
-        for i, p in enumerate(cells[party_columns[0]: party_columns[1]]):
-            v = p.text
-            if v:
-                try:
-                    v = float(v)
-                except:
-                    # Multiple parties in the cell, fix?
-                    continue
-                votes[party_names[i]] = v
 
-        poll = mapache.Poll(votes, date, pollster, err)
+def _poll_from_cells(cells, date_column, party_columns, party_names,
+                     error_column=None, pollster_column=None,
+                     date_parser=None):
+    """Create a poll from the cells of a row of a table.
 
-        polls.add(poll)
+    The cells can be of any type with a ``text`` attribute. If the date is a
+    range the last day is used.
+
+    Returns:
+        mapache.Poll: the poll, None if the row is not a poll
+    """
+    if len(cells) <= 3:
+        # TODO ??
+        return None
+
+    pollster = None
+    if pollster_column is not None:
+        pollster = cells[pollster_column].text
 
+    err = None
+    if error_column is not None:
+        err = cells[-3].text
+        # Blank error cells are polls without error
+        err = float(err[1:].split(' ')[0]) if err else None
+
+    if date_parser is None:
+        date_parser = DateParser()
+    date = cells[date_column].text
+    date = date_parser.parse(date)
+
+    votes = {}
+    for i, p in enumerate(cells[party_columns[0]: party_columns[1]]):
+        v = p.text
+        if v:
+            try:
+                v = float(v)
+            except:
+                # Multiple parties in the cell, fix?
+                continue
+            votes[party_names[i]] = v
+
+    return mapache.Poll(votes, date, pollster, err)
+
+
+class _Cell:
+    """Cell of a table found by _WikitableParser."""
+
+    def __init__(self):
+        self.parts = []
+        self.href = None
+        self.title = None
+        self.imgsrc = None
+
+    @property
+    def text(self):
+        return ''.join(self.parts)
+
+
+class _WikitableParser(HTMLParser):
+    """Event-driven parser collecting the rows of a wikitable.
+
+    The html is fed in chunks and the rows of the ``table_index``-th table
+    with class ``wikitable`` are collected, as lists of _Cell (th cells
+    first, then td cells, as ``wikitable_get_cells``), in ``self.rows`` as
+    soon as they are closed. Nothing else of the document is kept.
+    """
+
+    def __init__(self, table_index=0):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.table_index = table_index
+        self.rows = collections.deque()
+        self.done = False
+        self._wikitables = 0
+        # True for the target table, False for any other, one per open table
+        self._tables = []
+        self._row = None
+        self._cell = None
+
+    def _in_target(self):
+        return bool(self._tables) and self._tables[-1]
+
+    def _close_cell(self):
+        if self._cell is not None:
+            self._cell = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self._row is not None:
+            th, td = self._row
+            self.rows.append(th + td)
+            self._row = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        attrs = dict(attrs)
+        if tag == 'table':
+            target = False
+            if 'wikitable' in (attrs.get('class') or '').split():
+                target = self._wikitables == self.table_index
+                self._wikitables += 1
+            self._tables.append(target)
+        elif not self._in_target():
+            # Links and images in nested tables still belong to the cell
+            if self._cell is not None:
+                self._cell_tag(tag, attrs)
+        elif tag == 'tr':
+            self._close_row()
+            self._row = ([], [])
+        elif tag in ('th', 'td'):
+            self._close_cell()
+            if self._row is None:
+                self._row = ([], [])
+            self._cell = _Cell()
+            self._row[tag == 'td'].append(self._cell)
+        elif self._cell is not None:
+            self._cell_tag(tag, attrs)
+
+    def _cell_tag(self, tag, attrs):
+        if tag == 'a' and self._cell.href is None and 'href' in attrs:
+            self._cell.href = attrs['href']
+            self._cell.title = attrs.get('title')
+        elif tag == 'img' and self._cell.imgsrc is None:
+            self._cell.imgsrc = attrs.get('src')
+
+    def handle_endtag(self, tag):
+        if self.done or not self._tables:
+            return
+        if tag == 'table':
+            if self._tables[-1]:
+                self._close_row()
+                self.done = True
+            self._tables.pop()
+        elif not self._in_target():
+            return
+        elif tag == 'tr':
+            self._close_row()
+        elif tag in ('th', 'td'):
+            self._close_cell()
+
+    def handle_data(self, data):
+        if self._cell is not None and not self.done:
+            self._cell.parts.append(data)
+
+
+def _cell_get_url(c):
+    """``wikitable_get_url`` for cells found by _WikitableParser."""
+    if c.href is None:
+        return None, None
+    return "http://wikipedia.org" + c.href, c.title
+
+
+def _iter_chunks(source, chunk_size, html=False):
+    """Text chunks of a html file name or file object, or of the html."""
+    if html:
+        if isinstance(source, str):
+            yield source
+            return
+        source = io.BytesIO(source)
+    elif isinstance(source, (str, bytes, os.PathLike)):
+        source = open(source, 'rb')
+
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    with source:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            if isinstance(chunk, bytes):
+                chunk = decoder.decode(chunk)
+            yield chunk
+    yield decoder.decode(b'', final=True)
+
+
+def iter_polls_from_html(source, date_column, party_columns, party_names=None,
+                         error_column=None, pollster_column=None,
+                         poll_rows=None, table_index=0, chunk_size=2 ** 16,
+                         html=False):
+    """Parse the polls of a wikitable incrementally.
+
+    Streaming version of ``poll_from_table``: the html is read in chunks and
+    parsed with an event-driven parser, and each poll is yielded as soon as
+    its row has been read. No document tree is built, so it uses little
+    memory even with very large tables. It is faster than building the tree
+    with BeautifulSoup and then calling ``poll_from_table``, but slower than
+    ``poll_from_table`` alone on a tree already built.
+
+    Tables nested in the cells of the table are part of their cell (their
+    text, links and images) and their rows are not rows of the table,
+    unlike in ``poll_from_table``, which also finds the nested rows.
+
+    Args:
+        source: file name or binary or text file object, or the html itself
+                    (str or bytes) if ``html`` is True
+        table_index (Optional[int]): which table with class wikitable of the
+                    page to parse (0 for the first one)
+        chunk_size (Optional[int]): size of the chunks read from ``source``
+        html (Optional[bool]): ``source`` is the html, not a file name
+
+        The rest of the arguments are the same as in ``poll_from_table``.
+
+    Yields:
+        mapache.Poll: polls in the order of the table
+    """
+    if not poll_rows:
+        poll_rows = (2, -0)
+    start, end = poll_rows[0], poll_rows[1] or None
+
+    # Rows are kept until it is known they are not in the last -end rows
+    pending = collections.deque()
+    parser = _WikitableParser(table_index)
+    date_parser = DateParser()
+    row_index = 0
+
+    for chunk in _iter_chunks(source, chunk_size, html):
+        parser.feed(chunk)
+        while parser.rows:
+            cells = parser.rows.popleft()
+            if row_index == 0 and not party_names:
+                party_names = _party_names_from_header(cells, party_columns,
+                                                       _cell_get_url)
+                if party_names is None:
+                    return
+            if row_index >= start:
+                if end is not None and end > 0 and row_index >= end:
+                    parser.done = True
+                    break
+                pending.append(cells)
+            row_index += 1
+
+            keep = -end if end is not None and end < 0 else 0
+            while len(pending) > keep:
+                poll = _poll_from_cells(pending.popleft(), date_column,
+                                        party_columns, party_names,
+                                        error_column, pollster_column,
+                                        date_parser)
+                if poll is not None:
+                    yield poll
+        if parser.done:
+            break
+
+
+def _polls_from_source(source, spec, html):
+    """Polls of a table (worker of ``polls_from_tables``)."""
+    return list(iter_polls_from_html(source, html=html, **spec))
+
+
+def polls_from_tables(tables, specs, name='', processes=None, html=False):
+    """Parse many tables in parallel and merge them in a single PollsList.
+
+    Each table is parsed (with ``iter_polls_from_html``) in a pool of
+    processes, and all the polls are merged in date order.
+
+    Args:
+        tables (list): tables as returned by ``tables_from_wiki``, or names
+                    of saved html files (the html of the tables if ``html``
+                    is True)
+        specs (dict or List[dict]): arguments of ``iter_polls_from_html``
+                    (date_column, party_columns...) for all the tables, or
+                    one dict per table
+        name (Optional[str]): name of the PollsList
+        processes (Optional[int]): number of processes, by default the
+                    number of cores. With 1 the tables are parsed in this
+                    process.
+        html (Optional[bool]): the strings of ``tables`` are html, not file
+                    names
+
+    Returns:
+        mapache.PollsList: polls of all the tables sorted by date
+    """
+    if isinstance(specs, dict):
+        specs = [specs] * len(tables)
+    # BeautifulSoup tables are sent to the workers as html
+    sources, htmls = [], []
+    for table in tables:
+        is_tree = not isinstance(table, (str, bytes, os.PathLike))
+        sources.append(str(table) if is_tree else table)
+        htmls.append(html or is_tree)
+
+    if processes == 1:
+        results = list(map(_polls_from_source, sources, specs, htmls))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_polls_from_source, sources, specs,
+                                        htmls))
+
+    all_polls = [poll for polls in results for poll in polls]
+    all_polls.sort(key=lambda poll: poll.date)
+
+    polls = mapache.PollsList(name)
+    for poll in all_polls:
+        polls.add(poll)
     return polls
 
 
@@ -115,20 +557,22 @@ def wikitable_get_imgurl(c):
 
 def tables_from_wiki(url):
     # TODO Add title of the section to identify the table?
-    page = urllib.request.urlopen(url)
-    soup = BeautifulSoup(page, "html.parser")
+    page = fetch(url)
+    with profiling.timer('parse.html'):
+        soup = BeautifulSoup(page, "html.parser")
     tables = soup.findAll("table", class_="wikitable")
     return tables
 
 
-def party_from_wiki(url, name=None):
+def party_from_wiki(url, name=None, lazy=False):
 
     # The party wiki page is fetched to get the full name and full logo
-    page = urllib.request.urlopen(url)
-    party_soup = BeautifulSoup(page, "html.parser")
+    page = fetch(url)
+    with profiling.timer('parse.html'):
+        party_soup = BeautifulSoup(page, "html.parser")
     infobox = party_soup.find("table", {"class": "infobox vcard"})
-    logo = "http:" + infobox.find("td", {"class": "logo"})
-    logo = logo.find("img").attrs["src"]
+    logo = infobox.find("td", {"class": "logo"})
+    logo = "http:" + logo.find("img").attrs["src"]
 
     # If both the English and Spanish name are present the Spanish one
     # has class "nickname", otherway it has "fn org"
@@ -151,5 +595,43 @@ def party_from_wiki(url, name=None):
     party = mapache.Party(name, logo_url=logo, short_name=short_name,
                    # The abbreviation/short name will be created automatically
                    # if the name provided is too long and short_name=None
-                          full_name=full_name)
+                          full_name=full_name, lazy=lazy)
     return party
+
+
+def parties_from_wiki(urls, names=None, context_name='', max_workers=8,
+                      lazy=False):
+    """Create a PartySet from several party wiki pages.
+
+    The pages are fetched and the parties (including the download of their
+    logos and the extraction of their colors) are created concurrently by a
+    pool of threads. Connections to the same host are reused by each thread,
+    and closed when the pool finishes.
+
+    Args:
+        urls (List[str]): urls of the wiki pages of the parties
+        names (Optional[List[str]]): name of each party, see
+                    ``party_from_wiki``
+        context_name (Optional[str]): name of the PartySet
+        max_workers (Optional[int]): maximum number of concurrent downloads
+        lazy (Optional[bool]): create lazy parties (see mapache.Party), only
+                    the wiki pages are downloaded
+
+    Returns:
+        mapache.PartySet: parties, added in the same order as ``urls``
+    """
+    if names is None:
+        names = [None] * len(urls)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        parties = list(executor.map(party_from_wiki, urls, names,
+                                    [lazy] * len(urls)))
+    # The workers have finished, their connections are not used any more
+    fetcher = get_fetcher()
+    if isinstance(fetcher, Fetcher):
+        fetcher.close(finished_only=True)
+
+    party_set = mapache.PartySet(context_name)
+    for party in parties:
+        party_set.add(party)
+    return party_set
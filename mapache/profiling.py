@@ -0,0 +1,281 @@
+"""Opt-in timing of the stages of mapache (fetch, parse, match, render...).
+
+Profiling is disabled by default and then costs a single check of a global
+flag per instrumented call. When enabled, the calls of each stage are
+counted and timed, and the hits and misses of the caches are counted::
+
+    with mapache.profiling.profile() as stats:
+        parties = mapache.parseutils.parties_from_wiki(urls)
+        ...
+    print(stats.snapshot()['fetch']['p90'])
+
+The stages are:
+
+- ``fetch``: downloads (pages and images), mapache.fetch.Fetcher.fetch
+- ``parse.html``: building the BeautifulSoup tree of a page
+- ``parse.table``: mapache.parseutils.poll_from_table
+- ``image``: mapache.Party._get_image (download or cache, and resizing)
+- ``color``: mapache.Party._get_color (KMeans or histogram)
+- ``match``: mapache.Party.match and mapache.PartySet.match. Its cache is
+  the memo of names of mapache.matching.NameIndex
+- ``trend``: fits of mapache.trends (``smooth``, ``fit``, ``update``). Its
+  cache is the cache of fits of mapache.trends
+- ``render``: drawing and exporting mapache.vis.TimeSeries and
+  mapache.vis.SingleBars
+- ``cache.image`` and ``cache.color``: only hits and misses of the
+  mapache.cache.ImageCache
+- ``cache.http``: only hits (304 Not Modified) and misses of the
+  mapache.fetch.HTTPCache
+
+Hooks (see ``add_hook``) receive every measure as it is recorded, to export
+them to another metrics system (statsd, prometheus...).
+"""
+
+# -*- coding: utf-8 -*-
+
+import contextlib
+import functools
+import random
+import threading
+import time
+from array import array
+
+import numpy as np
+
+
+# Checked by every instrumented call, see enable()
+_enabled = False
+_lock = threading.Lock()
+_stages = {}
+_hooks = []
+
+# Latencies kept per stage to compute the percentiles (a uniform sample if
+# there are more calls)
+max_samples = 10000
+
+percentiles = (50, 90, 99)
+
+
+class _Stage:
+    """Counters of a stage."""
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.
+        self.max = 0.
+        self.samples = array('d')
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, seconds):
+        self.calls += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.samples) < max_samples:
+            self.samples.append(seconds)
+        else:
+            # Reservoir sampling
+            i = random.randrange(self.calls)
+            if i < max_samples:
+                self.samples[i] = seconds
+
+    def snapshot(self):
+        result = {'calls': self.calls, 'total': self.total,
+                  'mean': self.total / self.calls if self.calls else 0.,
+                  'max': self.max}
+        values = (np.percentile(self.samples, percentiles) if self.samples
+                  else [0.] * len(percentiles))
+        for p, value in zip(percentiles, values):
+            result['p{0}'.format(p)] = float(value)
+        lookups = self.hits + self.misses
+        result.update({'hits': self.hits, 'misses': self.misses,
+                       'hit_rate': self.hits / lookups if lookups else None})
+        return result
+
+
+def enable():
+    """Start recording (the counters are kept, see ``reset``)."""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stop recording."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Clear the counters of all the stages."""
+    with _lock:
+        _stages.clear()
+
+
+def _stage(name):
+    stage = _stages.get(name)
+    if stage is None:
+        stage = _stages[name] = _Stage()
+    return stage
+
+
+def record(stage, seconds):
+    """Record a call of ``stage`` that lasted ``seconds``."""
+    if not _enabled:
+        return
+    with _lock:
+        _stage(stage).record(seconds)
+    for hook in _hooks:
+        hook(stage, 'time', seconds)
+
+
+def hit(stage):
+    """Record a cache hit of ``stage``."""
+    if not _enabled:
+        return
+    with _lock:
+        _stage(stage).hits += 1
+    for hook in _hooks:
+        hook(stage, 'hit', 1)
+
+
+def miss(stage):
+    """Record a cache miss of ``stage``."""
+    if not _enabled:
+        return
+    with _lock:
+        _stage(stage).misses += 1
+    for hook in _hooks:
+        hook(stage, 'miss', 1)
+
+
+def timed(stage):
+    """Decorator recording the calls of a function as ``stage``.
+
+    Calls made while another call of the same stage is running (eg.
+    recursive ones, or ``Party.match`` calling ``PartySet.match``) are not
+    recorded again, so the total time of a stage is not counted twice.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with timer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+_running = threading.local()
+
+
+@contextlib.contextmanager
+def timer(stage):
+    """Context manager recording the time of a block as ``stage``."""
+    if not _enabled:
+        yield
+        return
+    running = _running.__dict__.setdefault('stages', set())
+    if stage in running:
+        yield
+        return
+    running.add(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        running.discard(stage)
+        record(stage, time.perf_counter() - start)
+
+
+def snapshot():
+    """Counters of all the stages.
+
+    Returns:
+        dict: for each stage, a dict with the number of ``calls``, their
+              ``total``, ``mean`` and ``max`` time and percentiles (``p50``,
+              ``p90``, ``p99``) in seconds, and the cache ``hits``,
+              ``misses`` and ``hit_rate`` (None without lookups)
+    """
+    with _lock:
+        return {name: stage.snapshot() for name, stage in _stages.items()}
+
+
+def report(stats=None):
+    """Table of the counters, as text.
+
+    Args:
+        stats (Optional[dict]): result of ``snapshot()``, the current
+                    counters by default
+    """
+    stats = snapshot() if stats is None else stats
+    lines = ['{0:14} {1:>8} {2:>10} {3:>9} {4:>9} {5:>9} {6:>8}'.format(
+        'stage', 'calls', 'total (s)', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)',
+        'hit rate')]
+    for name, s in sorted(stats.items()):
+        hit_rate = ('' if s['hit_rate'] is None
+                    else '{0:.0%}'.format(s['hit_rate']))
+        lines.append('{0:14} {1:8} {2:10.3f} {3:9.2f} {4:9.2f} {5:9.2f} '
+                     '{6:>8}'.format(name, s['calls'], s['total'],
+                                     s['p50'] * 1e3, s['p90'] * 1e3,
+                                     s['p99'] * 1e3, hit_rate))
+    return '\n'.join(lines)
+
+
+def add_hook(hook):
+    """Call ``hook(stage, kind, value)`` for every measure recorded.
+
+    ``kind`` is 'time' (``value`` in seconds), 'hit' or 'miss' (``value``
+    is 1). Hooks are called from the thread that made the measure, and only
+    while profiling is enabled.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+class profile:
+    """Context manager enabling profiling within a block.
+
+    The counters are reset when entering the block, and the previous state
+    (enabled or not) is restored when leaving it. The counters of the block
+    are available as ``stats.snapshot()`` (or ``stats.report()``), also
+    after the block.
+    """
+
+    def __init__(self, hooks=()):
+        """
+        Args:
+            hooks (Optional[List[callable]]): hooks (see ``add_hook``)
+                        used within the block
+        """
+        self.hooks = list(hooks)
+        self._stats = None
+
+    def __enter__(self):
+        self._was_enabled = _enabled
+        reset()
+        for hook in self.hooks:
+            add_hook(hook)
+        enable()
+        return self
+
+    def __exit__(self, *exc):
+        if not self._was_enabled:
+            disable()
+        for hook in self.hooks:
+            remove_hook(hook)
+        self._stats = snapshot()
+
+    def snapshot(self):
+        """Counters of the block (so far, if still within it)."""
+        return snapshot() if self._stats is None else self._stats
+
+    def report(self):
+        return report(self.snapshot())
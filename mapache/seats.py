@@ -0,0 +1,247 @@
+"""Monte Carlo seat projections from polls."""
+
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from mapache.aggregate import PollAverage
+
+
+# Divisors of the highest averages methods, seat k (0-based) -> divisor
+METHODS = {'dhondt': lambda k: k + 1.,
+           'sainte-lague': lambda k: 2. * k + 1.}
+
+
+class District:
+    """Electoral district electing ``seats`` seats."""
+
+    def __init__(self, name, seats, strength=None):
+        """Create a district.
+
+        Args:
+            name (str): name of the district
+            seats (int): number of seats
+            strength (Optional[dict]): relative strength of some parties in
+                        the district (name of the party: factor applied to
+                        its national vote share, 1 if not indicated)
+        """
+        self.name = name
+        self.seats = int(seats)
+        self.strength = strength or {}
+
+    def multipliers(self, parties, party_set=None):
+        """Factor of each party in the district.
+
+        The names of ``strength`` are resolved with ``party_set.match`` if a
+        mapache.PartySet is given, otherwise they must be party names.
+        """
+        result = np.ones(len(parties))
+        for name, factor in self.strength.items():
+            party = party_set.match(name) if party_set is not None else None
+            for j, p in enumerate(parties):
+                if p is party or p.name == name:
+                    result[j] = factor
+        return result
+
+
+class SeatProjection:
+    """Seats of each party in each simulated scenario."""
+
+    def __init__(self, parties, seats, shares):
+        """
+        Args:
+            parties (List[mapache.Party]): parties, one per column
+            seats (numpy.ndarray): scenarios x parties seats
+            shares (numpy.ndarray): vote share of each party used as the
+                        center of the scenarios
+        """
+        self.parties = parties
+        self.seats = seats
+        self.shares = shares
+
+    def _columns(self, parties):
+        if not isinstance(parties, (list, tuple)):
+            parties = [parties]
+        return [self.parties.index(p) for p in parties]
+
+    def get_party(self, party):
+        """Seats of a party (or the sum of a list of parties) per scenario."""
+        return self.seats[:, self._columns(party)].sum(axis=1)
+
+    def distribution(self, party):
+        """Probability of each number of seats of a party or coalition.
+
+        Args:
+            party (mapache.Party or List[mapache.Party]): party, or parties
+                        of a coalition
+
+        Returns:
+            numpy.ndarray: probability of winning 0, 1, 2... seats
+        """
+        seats = self.get_party(party)
+        return np.bincount(seats) / float(len(seats))
+
+    def mean(self):
+        """Mean seats of each party."""
+        return self.seats.mean(axis=0)
+
+    def interval(self, party, level=0.9):
+        """Central interval of the seats of a party or coalition."""
+        seats = self.get_party(party)
+        return tuple(np.percentile(seats, [50 * (1 - level),
+                                           50 * (1 + level)]))
+
+    def probability(self, party, seats):
+        """Probability of a party or coalition winning at least ``seats``."""
+        return float(np.mean(self.get_party(party) >= seats))
+
+
+def allocate(votes, seats, method='dhondt', threshold=0.):
+    """Highest averages seat allocation of many districts at once.
+
+    Args:
+        votes (numpy.ndarray): ... x parties votes (or shares) of each party,
+                    any number of leading dimensions (eg. scenarios x
+                    districts)
+        seats (int): seats of every district
+        method (Optional[str]): 'dhondt' or 'sainte-lague'
+        threshold (Optional[float]): parties with fewer votes get no seats
+
+    Returns:
+        numpy.ndarray: ... x parties seats of each party
+    """
+    divisors = METHODS[method](np.arange(seats))
+    votes = np.where(votes < threshold, 0., votes)
+    # ... x (parties * seats) quotients, party j owns j * seats ... + seats
+    quotients = (votes[..., np.newaxis] / divisors).reshape(
+        votes.shape[:-1] + (-1,))
+    nparties = votes.shape[-1]
+    if seats >= quotients.shape[-1]:
+        winners = np.broadcast_to(np.arange(quotients.shape[-1]),
+                                  quotients.shape)
+    else:
+        winners = np.argpartition(-quotients, seats - 1, axis=-1)[..., :seats]
+    parties = winners // seats
+    return (parties[..., np.newaxis] == np.arange(nparties)).sum(axis=-2)
+
+
+def _simulate(shares, sd, groups, method, threshold, n, seed):
+    """Seats of ``n`` scenarios (runs in the workers).
+
+    Args:
+        groups (list): (seats, districts x parties multipliers) of the
+                    districts, grouped by number of seats
+        seed (numpy.random.SeedSequence): seed of the scenarios
+    """
+    rng = np.random.default_rng(seed)
+    scenarios = np.maximum(shares + sd * rng.standard_normal((n, len(shares))),
+                           0)
+    total = np.zeros((n, len(shares)), dtype=np.int64)
+    for seats, multipliers in groups:
+        votes = scenarios[:, np.newaxis, :] * multipliers
+        total += allocate(votes, seats, method, threshold).sum(axis=1)
+    return total
+
+
+def vote_shares(source, parties, join_coalitions=True):
+    """Vote share of each party and its uncertainty (margin of error).
+
+    Args:
+        source: mapache.Poll, mapache.aggregate.PollAverage (its last day)
+                or mapache.PollsList (its PollAverage)
+        parties (List[mapache.Party]): parties
+
+    Returns:
+        Tuple: shares (numpy.ndarray) and error (float or None)
+
+    Raises:
+        ValueError: a party is not in the parties of a PollAverage
+    """
+    if not isinstance(source, PollAverage) and hasattr(source, 'polls'):
+        source = PollAverage(source, parties, join_coalitions=join_coalitions)
+    if isinstance(source, PollAverage):
+        last = source.average[-1]
+        shares = []
+        for party in parties:
+            try:
+                shares.append(last[source.parties.index(party)])
+            except ValueError:
+                raise ValueError('{0} is not in the PollAverage'.format(
+                    party.short_name))
+        shares = np.nan_to_num(np.array(shares, dtype=float))
+        return shares, source.default_error
+
+    shares = [source.get_party(p, join_coalitions=join_coalitions) or 0.
+              for p in parties]
+    return np.array(shares, dtype=float), source.error
+
+
+def simulate(source, parties, districts, n=10000, method='dhondt',
+             threshold=3., error=None, seed=None, processes=1,
+             chunk_size=2000, join_coalitions=True):
+    """Simulate the seats of each party.
+
+    The national vote share of each party in each scenario is drawn from a
+    normal distribution centered on ``source``, with standard deviation
+    ``error / 1.96`` (the error of polls is a 95% margin). The shares in
+    each district are the national ones multiplied by the strength of the
+    parties in the district. Seats are allocated in all the scenarios and
+    districts at once, grouping districts by number of seats.
+
+    Args:
+        source: mapache.Poll (its error is the uncertainty),
+                mapache.aggregate.PollAverage or mapache.PollsList
+        parties (mapache.PartySet or List[mapache.Party]): parties
+        districts (List[District] or int): districts, or the seats of a
+                    single national district
+        n (Optional[int]): number of scenarios
+        method (Optional[str]): 'dhondt' or 'sainte-lague'
+        threshold (Optional[float]): minimum share (percent) in a district
+                    to get seats
+        error (Optional[float]): margin of error, by default the error of
+                    the poll (3 if unknown)
+        seed (Optional[int]): seed for reproducible simulations. The result
+                    does not depend on the number of processes.
+        processes (Optional[int]): number of processes, None for the number
+                    of cores
+        chunk_size (Optional[int]): scenarios per chunk of work
+
+    Returns:
+        SeatProjection: seats of each party in each scenario
+    """
+    party_set = None
+    if hasattr(parties, 'parties'):
+        party_set = parties
+        parties = list(parties.parties.values())
+    parties = list(parties)
+    if isinstance(districts, int):
+        districts = [District('', districts)]
+
+    shares, source_error = vote_shares(source, parties, join_coalitions)
+    if error is None:
+        error = source_error if source_error else 3.
+    sd = error / 1.96
+
+    by_seats = {}
+    for district in districts:
+        by_seats.setdefault(district.seats, []).append(
+            district.multipliers(parties, party_set))
+    groups = [(seats, np.array(multipliers))
+              for seats, multipliers in sorted(by_seats.items()) if seats]
+
+    sizes = [min(chunk_size, n - i) for i in range(0, n, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [[shares] * len(sizes), [sd] * len(sizes), [groups] * len(sizes),
+            [method] * len(sizes), [threshold] * len(sizes), sizes, seeds]
+
+    if processes == 1:
+        results = list(map(_simulate, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_simulate, *args))
+
+    seats = (np.concatenate(results) if results
+             else np.zeros((0, len(parties)), dtype=np.int64))
+    return SeatProjection(parties, seats, shares)
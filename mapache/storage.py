@@ -0,0 +1,181 @@
+"""Binary on-disk format for polls.
+
+A file stores a mapache.frame.PollsFrame as columns:
+
+- ``MAGIC`` (8 bytes) and the length of the header (uint64, little endian)
+- the header, JSON with the format version, the number of polls, the names
+  of the columns (parties), the names of the pollsters, the location of each
+  array and any metadata (eg. the name of the PollsList)
+- the arrays, each one starting at a multiple of 64 bytes: ``dates``
+  (datetime64[us]), ``pollsters`` (int32, index in the list of names of the
+  header), ``errors`` (float64, NaN if unknown), ``values`` (float64, polls
+  x columns, NaN if the party is not in the poll) and ``orders`` (int32,
+  index in the list of orders of the parties of the header, see
+  mapache.frame.PollsFrame.orders; files without it use the order of the
+  columns)
+
+The arrays are memory-mapped when loaded, so opening a file is fast whatever
+its size, and only the parts that are used are read from disk. The names of
+the pollsters are only looked up when they are used.
+
+Party sets (see mapache.PartySet.save) are stored as zip files with a JSON
+manifest and the logos and thumbnails of the parties as PNG images.
+"""
+
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import struct
+import threading
+import zipfile
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from mapache.frame import PollsFrame, DATE_DTYPE
+
+
+MAGIC = b'MAPACHE\x00'
+VERSION = 1
+
+_ALIGNMENT = 64
+_HEADER_LENGTH = struct.Struct('<Q')
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def save_frame(path, frame, metadata=None):
+    """Write a PollsFrame to a file.
+
+    Args:
+        path (str): name of the file
+        frame (mapache.frame.PollsFrame): polls to be saved
+        metadata (Optional[dict]): JSON serializable data stored in the
+                    header, returned by ``load_frame``
+    """
+    pollster_names, codes = frame.pollster_codes()
+
+    arrays = [('dates', frame.dates.astype(DATE_DTYPE, copy=False)),
+              ('pollsters', codes.astype('<i4', copy=False)),
+              ('errors', frame.errors.astype('<f8', copy=False)),
+              ('values', frame.values.astype('<f8', copy=False)),
+              ('orders', frame.order_codes.astype('<i4', copy=False))]
+
+    layout = {}
+    offset = 0
+    for name, array in arrays:
+        layout[name] = {'dtype': array.dtype.str, 'shape': array.shape,
+                        'offset': offset}
+        offset = _aligned(offset + array.nbytes)
+
+    header = json.dumps({'version': VERSION, 'n': len(frame),
+                         'columns': list(frame.columns),
+                         'pollster_names': list(pollster_names),
+                         'orders': [list(order) for order in frame.orders],
+                         'arrays': layout,
+                         'metadata': metadata or {}}).encode('utf8')
+
+    # Written to a temporary file and renamed: ``frame`` may be memory-mapped
+    # from ``path`` itself (polls saved where they were loaded from)
+    tmp_path = '{0}.{1}-{2}.tmp'.format(path, os.getpid(),
+                                         threading.get_ident())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(_HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            start = _aligned(f.tell())
+            for name, array in arrays:
+                f.write(b'\0' * (start + layout[name]['offset'] - f.tell()))
+                np.ascontiguousarray(array).tofile(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_header(path):
+    """Header of a file and the position where its arrays start."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{0} is not a mapache polls file'.format(path))
+        length, = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+        header = json.loads(f.read(length).decode('utf8'))
+        start = _aligned(f.tell())
+
+    if header['version'] > VERSION:
+        raise ValueError('{0} was saved with a newer version of mapache '
+                         '(format {1})'.format(path, header['version']))
+    return header, start
+
+
+def load_frame(path, mmap=True):
+    """Read a PollsFrame from a file written by ``save_frame``.
+
+    Args:
+        path (str): name of the file
+        mmap (Optional[bool]): if True the arrays are memory-mapped (read
+                    only) instead of read in memory
+
+    Returns:
+        Tuple[mapache.frame.PollsFrame, dict]: the polls and the metadata
+    """
+    header, start = read_header(path)
+
+    arrays = {}
+    for name, array in header['arrays'].items():
+        dtype = np.dtype(array['dtype'])
+        shape = tuple(array['shape'])
+        count = int(np.prod(shape))
+        if not count:
+            arrays[name] = np.empty(shape, dtype=dtype)
+        elif mmap:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r',
+                                     offset=start + array['offset'],
+                                     shape=shape)
+        else:
+            arrays[name] = np.fromfile(path, dtype=dtype, count=count,
+                                       offset=start + array['offset']
+                                       ).reshape(shape)
+
+    names = np.empty(len(header['pollster_names']), dtype=object)
+    names[:] = header['pollster_names']
+    frame = PollsFrame.from_arrays(header['columns'], arrays['dates'],
+                                   arrays['values'], arrays['pollsters'],
+                                   arrays['errors'], pollster_names=names,
+                                   orders=header.get('orders'),
+                                   order_codes=arrays.get('orders'))
+    return frame, header['metadata']
+
+
+class StoredImage:
+    """Image in a zip file, read only when it is needed."""
+
+    def __init__(self, path, member):
+        """
+        Args:
+            path (str): name of the zip file
+            member (str): name of the image in the zip file
+        """
+        self.path = path
+        self.member = member
+
+    def read(self):
+        """Content (PNG) of the image."""
+        with zipfile.ZipFile(self.path) as f:
+            return f.read(self.member)
+
+    def load(self):
+        """Decode the image.
+
+        Returns:
+            PIL.Image: image
+        """
+        img = Image.open(BytesIO(self.read()))
+        img.load()
+        return img
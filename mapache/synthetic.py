@@ -0,0 +1,350 @@
+"""Synthetic parties and polls, for scale and load testing.
+
+Nothing is downloaded: the logos of the parties are solid color images
+created in memory. The polls are generated with numpy, as a
+mapache.frame.PollsFrame, so that lists of millions of polls can be created
+in seconds. The Poll objects are only created if ``PollsList.polls`` is
+used (see mapache.PollsList.from_frame)::
+
+    parties = synthetic.create_parties(12, n_coalitions=2, seed=0)
+    polls = synthetic.create_polls(parties, 10 ** 6, seed=0)
+
+The polls are realistic enough to exercise the matching, aggregation and
+rendering code:
+
+- the true vote shares drift over time (a random walk of the log-ratios of
+  the shares)
+- each pollster has a house effect (a bias for or against each party) and
+  its own naming of the parties: full names, abbreviations, dotted
+  abbreviations, names without accents or with typos, which must be matched
+  with ``PartySet.match``
+- some pollsters report the coalitions as a whole and others their parties
+  separately
+- the results have sampling noise and are rounded to 0.1, some polls miss
+  some parties and some pollsters do not report their error
+"""
+
+# -*- coding: utf-8 -*-
+
+import datetime
+import itertools
+import unicodedata
+
+import numpy as np
+from PIL import Image
+
+from mapache.core import Party, PartySet, PollsList
+from mapache.frame import PollsFrame, DATE_DTYPE
+
+
+_PREFIXES = ['Partido', 'Unión', 'Alianza', 'Movimiento', 'Frente',
+             'Izquierda', 'Convergencia', 'Bloque', 'Plataforma', 'Centro']
+_ADJECTIVES = ['Popular', 'Socialista', 'Demócrata', 'Liberal', 'Verde',
+               'Republicano', 'Progresista', 'Nacional', 'Federal',
+               'Ciudadano', 'Obrero', 'Regionalista', 'Independiente',
+               'Ecologista', 'Social', 'Foral', 'Valencià', 'Galego']
+_PLACES = ['', 'de España', 'de Cataluña', 'Vasco', 'de Andalucía',
+           'de Canarias', 'de Aragón', 'Europeo', 'del Pueblo']
+_COALITIONS = ['Unidos', 'Juntos', 'En Común', 'Compromís', 'Adelante',
+               'Sumar', 'Cambio', 'Marea']
+
+
+class SyntheticParty(Party):
+    """Party with a solid color logo, created in memory when it is used."""
+
+    def __init__(self, name, rgb, **kwargs):
+        """Create a party.
+
+        Args:
+            name (str): name of the party
+            rgb (tuple): color of the logo (0 to 255)
+            **kwargs: other arguments of mapache.Party (but ``logo_url``)
+        """
+        self.rgb = tuple(int(c) for c in rgb)
+        kwargs.setdefault('lazy', True)
+        super().__init__(name, None, **kwargs)
+        # The color of a solid logo is known, no need to compute it
+        self.color = np.array(self.rgb) / 255.
+
+    def _get_image(self, url):
+        return Image.new('RGB', (240, 120), self.rgb)
+
+
+def _strip_accents(name):
+    return ''.join(c for c in unicodedata.normalize('NFD', name)
+                   if unicodedata.category(c) != 'Mn')
+
+
+def _typo(name, random_state):
+    """``name`` with two adjacent letters swapped."""
+    if len(name) < 4:
+        return name
+    i = random_state.randint(1, len(name) - 2)
+    return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+
+
+def _abbreviation(name):
+    words = [w for w in name.replace('-', ' ').split()
+             if w[0].isupper() or w[0].isdigit()]
+    return ''.join(w[0] for w in words)[:7].upper()
+
+
+def name_variants(party, random_state=None):
+    """Names a pollster could give to a party.
+
+    Returns:
+        List[str]: the name and short name of the party followed by
+                   variants: dotted abbreviation, no accents, upper case and
+                   a typo
+    """
+    random_state = random_state or np.random.RandomState(0)
+    dotted = '.'.join(party.short_name) + '.'
+    variants = [party.name, party.short_name, dotted,
+                _strip_accents(party.name), party.name.upper(),
+                _typo(party.name, random_state)]
+    unique = []
+    for name in variants:
+        if name not in unique:
+            unique.append(name)
+    return unique
+
+
+def _colors(n, random_state):
+    """``n`` different, saturated colors (RGB, 0 to 255)."""
+    hues = (random_state.uniform() + 0.618034 * np.arange(n)) % 1
+    colors = []
+    for hue in hues:
+        h = hue * 6
+        x = 1 - abs(h % 2 - 1)
+        rgb = [(1, x, 0), (x, 1, 0), (0, 1, x),
+               (0, x, 1), (x, 0, 1), (1, 0, x)][int(h) % 6]
+        colors.append(tuple(int(40 + 200 * c) for c in rgb))
+    return colors
+
+
+def _names(n, random_state):
+    """``n`` different party names."""
+    combinations = list(itertools.product(_PREFIXES, _ADJECTIVES, _PLACES))
+    order = random_state.permutation(len(combinations))
+    names = []
+    for i in range(n):
+        prefix, adjective, place = combinations[order[i % len(order)]]
+        name = ' '.join(w for w in [prefix, adjective, place] if w)
+        if i >= len(order):
+            name += ' {0}'.format(i // len(order) + 1)
+        names.append(name)
+    return names
+
+
+def create_parties(n_parties=10, n_coalitions=0, seed=None,
+                   context_name='Synthetic election'):
+    """PartySet of synthetic parties.
+
+    The parties have an abbreviation and, as extra names, the dotted
+    abbreviation. The other variants of ``name_variants`` (eg. typos) are
+    only found through name matching.
+
+    Args:
+        n_parties (Optional[int]): number of parties, without coalitions
+        n_coalitions (Optional[int]): number of coalitions, each of two of
+                    the parties (which are also in the set)
+        seed (Optional[int]): seed for reproducible parties
+        context_name (Optional[str]): name of the PartySet
+
+    Returns:
+        mapache.PartySet: parties, then coalitions, in order of size (see
+                          ``create_polls``)
+    """
+    if 2 * n_coalitions > n_parties:
+        raise ValueError('{0} coalitions need at least {1} parties'.format(
+            n_coalitions, 2 * n_coalitions))
+    random_state = np.random.RandomState(seed)
+    names = _names(n_parties + n_coalitions, random_state)
+    colors = _colors(n_parties + n_coalitions, random_state)
+
+    party_set = PartySet(context_name)
+    short_names = set()
+
+    def add(name, rgb):
+        short_name = _abbreviation(name)
+        for i in itertools.count(2):
+            if short_name.upper() not in short_names:
+                break
+            short_name = _abbreviation(name)[:6] + str(i)
+        short_names.add(short_name.upper())
+        party = SyntheticParty(name, rgb, short_name=short_name,
+                               extra_names=['.'.join(short_name) + '.'])
+        party_set.add(party)
+        return party
+
+    parties = [add(names[i], colors[i]) for i in range(n_parties)]
+    # The coalitions join small and medium parties (pairs from the end)
+    for i in range(n_coalitions):
+        name = '{0} {1}'.format(_COALITIONS[i % len(_COALITIONS)],
+                                names[n_parties + i].split()[1])
+        coalition = add(name, colors[n_parties + i])
+        for member in [parties[n_parties - 2 * i - 2],
+                       parties[n_parties - 2 * i - 1]]:
+            coalition.add_to_coalition(member)
+    return party_set
+
+
+class _Design:
+    """Everything shared by the chunks of polls of ``iter_frames``."""
+
+    def __init__(self, party_set, n_pollsters, days, drift, house_effect,
+                 coalition_ratio, variant_ratio, random_state):
+        parties = list(party_set.parties.values())
+        coalitions = [p for p in parties if p.coalition]
+        self.members = [p for p in parties if not p.coalition]
+        index = {id(p): j for j, p in enumerate(self.members)}
+        self.coalitions = [(c, [index[id(m)] for m in c.coalition])
+                           for c in coalitions]
+        n = len(self.members)
+
+        # True shares: random walk of the log-ratios around decreasing shares
+        base = np.sort(random_state.dirichlet(np.ones(n) * 2))[::-1]
+        steps = random_state.normal(0, drift, (days, n))
+        logits = np.log(base) + np.cumsum(steps, axis=0)
+        shares = np.exp(logits - logits.max(axis=1, keepdims=True))
+        self.shares = shares / shares.sum(axis=1, keepdims=True)
+
+        self.house = random_state.normal(0, house_effect, (n_pollsters, n))
+        self.reports_coalitions = (random_state.uniform(size=n_pollsters) <
+                                   coalition_ratio)
+        self.reports_error = random_state.uniform(size=n_pollsters) < 0.7
+        self.pollsters = np.array(['Pollster {0}'.format(i + 1)
+                                   for i in range(n_pollsters)], dtype=object)
+
+        # Name of each party (members, then coalitions) for each pollster,
+        # the name of the party for most of them
+        self.columns = []
+        column_idx = {}
+        self.column = np.empty((n_pollsters, n + len(coalitions)), dtype=int)
+        for j, party in enumerate(self.members + coalitions):
+            variants = name_variants(party, random_state)
+            for k in range(n_pollsters):
+                name = variants[0]
+                if random_state.uniform() < variant_ratio:
+                    name = variants[random_state.randint(len(variants))]
+                if name not in column_idx:
+                    column_idx[name] = len(self.columns)
+                    self.columns.append(name)
+                self.column[k, j] = column_idx[name]
+
+
+def iter_frames(party_set, n_polls, chunk_size=10 ** 6, n_pollsters=20,
+                start=datetime.datetime(2016, 1, 1), days=4 * 365,
+                drift=0.02, house_effect=0.05, missing=0.05,
+                coalition_ratio=0.5, variant_ratio=0.3, seed=None):
+    """Generate synthetic polls as PollsFrames of up to ``chunk_size`` polls.
+
+    The polls are sorted by date, the chunks following each other, so lists
+    larger than the memory can be generated and processed (or saved) one
+    chunk at a time.
+
+    Args:
+        party_set (mapache.PartySet): parties of the polls, eg. from
+                    ``create_parties``. The coalitions are made of other
+                    parties of the set.
+        n_polls (int): number of polls
+        chunk_size (Optional[int]): maximum polls per frame
+        n_pollsters (Optional[int]): number of pollsters
+        start (Optional[datetime]): date of the first poll
+        days (Optional[int]): days between the first and last polls
+        drift (Optional[float]): daily standard deviation of the change of
+                    the log-ratios of the shares
+        house_effect (Optional[float]): standard deviation of the bias of
+                    the pollsters, in log-ratio
+        missing (Optional[float]): probability of a party not being in a
+                    poll
+        coalition_ratio (Optional[float]): fraction of the pollsters that
+                    report the coalitions as a whole
+        variant_ratio (Optional[float]): probability of a pollster naming a
+                    party with a variant of its name (see ``name_variants``)
+        seed (Optional[int]): seed for reproducible polls. The polls depend
+                    on ``chunk_size``.
+
+    Yields:
+        mapache.frame.PollsFrame: polls, all with the same columns
+    """
+    seeds = np.random.SeedSequence(seed)
+    design_seed, chunks_seed = seeds.spawn(2)
+    design = _Design(party_set, n_pollsters, max(int(days), 1), drift,
+                     house_effect, coalition_ratio, variant_ratio,
+                     np.random.RandomState(design_seed.generate_state(1)))
+    sizes = [min(chunk_size, n_polls - i)
+             for i in range(0, n_polls, chunk_size)]
+    start = np.datetime64(start, 'D')
+    first = 0
+    for size, chunk_seed in zip(sizes, chunks_seed.spawn(len(sizes))):
+        rng = np.random.default_rng(chunk_seed)
+        yield _frame(design, first, size, n_polls, start, missing, rng)
+        first += size
+
+
+def _frame(design, first, size, n_polls, start, missing, rng):
+    """Polls ``first`` to ``first + size - 1`` of ``n_polls``."""
+    days = len(design.shares)
+    # Poll i is made on day (i + u) * days / n_polls, u uniform in [0, 1)
+    times = (np.arange(first, first + size) +
+             rng.uniform(size=size)) * (days / float(n_polls))
+    day = np.minimum(times.astype(int), days - 1)
+    dates = start + day.astype('timedelta64[D]')
+
+    pollster = rng.integers(len(design.pollsters), size=size)
+    sample = np.exp(rng.uniform(np.log(400), np.log(5000), size)).astype(int)
+
+    shares = design.shares[day] * np.exp(design.house[pollster])
+    shares /= shares.sum(axis=1, keepdims=True)
+    sd = np.sqrt(shares * (1 - shares) / sample[:, np.newaxis])
+    votes = np.maximum(shares + sd * rng.standard_normal(shares.shape), 0)
+    votes = np.round(votes * 1000) / 10.
+    votes[rng.uniform(size=votes.shape) < missing] = np.nan
+
+    values = np.full((size, len(design.columns)), np.nan)
+    rows = np.arange(size)
+    n = len(design.members)
+    reports = design.reports_coalitions[pollster]
+    for j in range(n):
+        values[rows, design.column[pollster, j]] = votes[:, j]
+    for k, (coalition, members) in enumerate(design.coalitions):
+        together = np.round(np.sum(votes[:, members], axis=1), 1)
+        values[rows[reports], design.column[pollster[reports], n + k]] = \
+            together[reports]
+        for j in members:
+            values[rows[reports], design.column[pollster[reports], j]] = \
+                np.nan
+
+    errors = np.round(196 * np.sqrt(0.25 / sample), 1)
+    errors[~design.reports_error[pollster]] = np.nan
+
+    return PollsFrame.from_arrays(design.columns,
+                                  dates.astype(DATE_DTYPE), values,
+                                  pollster.astype(np.int32), errors,
+                                  pollster_names=design.pollsters)
+
+
+def create_polls(party_set, n_polls=1000, name='Synthetic polls',
+                 compact=False, **kwargs):
+    """PollsList of synthetic polls.
+
+    The polls are stored as a single PollsFrame (about ``8 * n_polls *
+    columns`` bytes), the Poll objects are only created if
+    ``PollsList.polls`` is used. For more polls than fit in memory use
+    ``iter_frames``.
+
+    Args:
+        party_set (mapache.PartySet): parties of the polls
+        n_polls (Optional[int]): number of polls
+        name (Optional[str]): name of the PollsList
+        compact (Optional[bool]): see mapache.PollsList
+        **kwargs: options of ``iter_frames`` (eg. ``seed``)
+
+    Returns:
+        mapache.PollsList: the polls, sorted by date
+    """
+    kwargs['chunk_size'] = max(n_polls, 1)
+    frames = list(iter_frames(party_set, n_polls, **kwargs))
+    frame = frames[0] if frames else PollsFrame()
+    return PollsList.from_frame(frame, name, compact)
@@ -0,0 +1,581 @@
+"""Smoothing of poll time series into trend lines."""
+
+# -*- coding: utf-8 -*-
+
+import collections
+import copy
+import hashlib
+
+import numpy as np
+from scipy.linalg import solve_triangular
+
+from mapache import profiling
+
+
+def to_days(dates):
+    """Convert dates (datetime64 or datetime) to days since 1970-01-01.
+
+    Args:
+        dates (array-like): dates
+
+    Returns:
+        numpy.ndarray: float days
+    """
+    dates = np.asarray(dates, dtype='datetime64[us]')
+    return dates.astype(np.int64) / (86400 * 1e6)
+
+
+def from_days(days):
+    """Convert days since 1970-01-01 back to datetime64."""
+    days = np.asarray(days, dtype=float)
+    return (np.round(days * 86400 * 1e6)).astype(np.int64).astype(
+        'datetime64[us]')
+
+
+def daily_grid(x, start=None):
+    """Grid with one point per day covering ``x``.
+
+    Args:
+        x (numpy.ndarray): days
+        start (Optional[float]): first day of the grid, by default the first
+                    day of ``x``. Grids with the same start can be extended
+                    when new days are added.
+    """
+    if start is None:
+        start = np.floor(x.min())
+    return np.arange(start, np.floor(x.max()) + 1)
+
+
+class Fit:
+    """Trends of several parties fitted by a Smoother.
+
+    ``grid`` holds the days where the trends are evaluated, ``trend`` the
+    trends (grid x parties). The trend of each party is only given between
+    its first and last poll (NaN elsewhere).
+
+    ``updated`` returns the fit with some new polls added, reusing the
+    current state so that its cost depends on the number of new polls, not
+    on all the polls. The parameters of the fit are not recomputed (see
+    ``update``).
+    """
+
+    def __init__(self, x, Y, grid):
+        self.x = x
+        self.Y = Y
+        self.grid = grid
+        mask = ~np.isnan(Y)
+        self.first = np.full(Y.shape[1], np.nan)
+        self.last = np.full(Y.shape[1], np.nan)
+        self._update_ranges(x, mask)
+
+    def _update_ranges(self, x, mask):
+        for j in range(mask.shape[1]):
+            if mask[:, j].any():
+                self.first[j] = np.fmin(self.first[j], x[mask[:, j]].min())
+                self.last[j] = np.fmax(self.last[j], x[mask[:, j]].max())
+
+    @property
+    def trend(self):
+        """Trends, grid x parties, NaN outside the polls of each party."""
+        trend = self._trend()
+        grid = self.grid[:, np.newaxis]
+        outside = (grid < self.first) | (grid > self.last)
+        trend[outside | np.isnan(self.first)] = np.nan
+        return trend
+
+    def updated(self, x_new, Y_new, grid=None):
+        """Fit with some new polls.
+
+        Args:
+            x_new (numpy.ndarray): days of the new polls
+            Y_new (numpy.ndarray): votes of the new polls, NaN if missing
+            grid (Optional[numpy.ndarray]): new grid, it has to start with
+                        the current grid. The current grid by default.
+
+        Returns:
+            Tuple: the new Fit and the indices of the parties in the new
+                   polls (the only trends that change)
+        """
+        if grid is None:
+            grid = self.grid
+        if not np.array_equal(grid[:len(self.grid)], self.grid):
+            raise ValueError('The new grid must extend the current grid')
+
+        new = copy.copy(self)
+        new.first = self.first.copy()
+        new.last = self.last.copy()
+        mask_new = ~np.isnan(Y_new)
+        new._update_ranges(x_new, mask_new)
+        new._update(x_new, Y_new, grid)
+        new.x = np.concatenate([self.x, x_new])
+        new.Y = np.concatenate([self.Y, Y_new])
+        new.grid = grid
+        return new, np.flatnonzero(mask_new.any(axis=0))
+
+    def _trend(self):
+        raise NotImplementedError
+
+    def _update(self, x_new, Y_new, grid):
+        raise NotImplementedError
+
+
+class Smoother:
+    """Base class of the smoothers.
+
+    A smoother fits all the parties of a column (the columns of ``Y``) at
+    the same time, on a shared time grid. ``Y`` holds NaN where a party is
+    not in a poll.
+    """
+
+    def params(self):
+        """Parameters of the smoother, used to cache its results."""
+        return (type(self).__name__,) + tuple(sorted(self.__dict__.items()))
+
+    def fit(self, x, Y, grid):
+        """Fit the trends.
+
+        Args:
+            x (numpy.ndarray): days of the polls (n)
+            Y (numpy.ndarray): votes, polls x parties (n x p), NaN if missing
+            grid (numpy.ndarray): days where the trend is evaluated (g)
+
+        Returns:
+            Fit: fitted trends
+        """
+        raise NotImplementedError
+
+    def smooth(self, x, Y, grid):
+        """Trend of each column of ``Y`` on ``grid`` (g x p)."""
+        return self.fit(x, Y, grid).trend
+
+
+class KernelFit(Fit):
+    """Fit of a KernelSmoother.
+
+    The weighted sums of the local linear regression at each point of the
+    grid are kept; new polls are just added to them.
+    """
+
+    def __init__(self, x, Y, grid, bandwidth):
+        Fit.__init__(self, x, Y, grid)
+        self.bandwidth = bandwidth
+        self.sums = self._sums(x, Y, grid)
+
+    def _sums(self, x, Y, grid):
+        mask = ~np.isnan(Y)
+        values = np.where(mask, Y, 0.)
+        mask = mask.astype(float)
+
+        d = x[np.newaxis, :] - grid[:, np.newaxis]
+        w = np.exp(-0.5 * (d / self.bandwidth) ** 2)
+        wd = w * d
+        return np.array([w.dot(mask), wd.dot(mask), (wd * d).dot(mask),
+                         w.dot(values), wd.dot(values)])
+
+    def _update(self, x_new, Y_new, grid):
+        n_old = len(self.grid)
+        sums = np.empty((5, len(grid), Y_new.shape[1]))
+        sums[:, :n_old] = self.sums + self._sums(x_new, Y_new, self.grid)
+        if len(grid) > n_old:
+            x = np.concatenate([self.x, x_new])
+            Y = np.concatenate([self.Y, Y_new])
+            sums[:, n_old:] = self._sums(x, Y, grid[n_old:])
+        self.sums = sums
+
+    def _trend(self):
+        s0, s1, s2, t0, t1 = self.sums
+        with np.errstate(divide='ignore', invalid='ignore'):
+            det = s0 * s2 - s1 ** 2
+            local_linear = (s2 * t0 - s1 * t1) / det
+            local_constant = t0 / s0
+        # Where there are too few polls nearby the local constant is used
+        ill_conditioned = ~(det > 1e-8 * s0 ** 2 * self.bandwidth ** 2)
+        local_linear[ill_conditioned] = local_constant[ill_conditioned]
+        return local_linear
+
+
+class KernelSmoother(Smoother):
+    """Local linear regression with a gaussian kernel.
+
+    Cheap and fully vectorized: the trends of all the parties are obtained
+    from a few matrix products between the kernel weights (grid x polls)
+    and the votes.
+    """
+
+    def __init__(self, bandwidth=None):
+        """Create a KernelSmoother.
+
+        Args:
+            bandwidth (Optional[float]): standard deviation of the kernel in
+                        days. By default 1/20 of the length of the series
+                        when it is fitted, and at least 3 days.
+        """
+        self.bandwidth = bandwidth
+
+    def fit(self, x, Y, grid):
+        bandwidth = self.bandwidth
+        if bandwidth is None:
+            bandwidth = max((x.max() - x.min()) / 20., 3.)
+        return KernelFit(x, Y, grid, bandwidth)
+
+
+def _kernel(a, b, length_scale):
+    d = a[:, np.newaxis] - b[np.newaxis, :]
+    return np.exp(-0.5 * (d / length_scale) ** 2)
+
+
+class _Cholesky:
+    """Cholesky factor that can grow by appending rows.
+
+    The factor is kept as a large contiguous block ``head`` and the rows
+    appended since then (``tail_left``, ``tail_right``)::
+
+        L = [[head,      0         ],
+             [tail_left, tail_right]]
+
+    Triangular solves work block by block, so appending a row costs
+    O(n^2) without copying ``head``. The tail is merged into the head when
+    it grows, which keeps the cost amortized.
+    """
+
+    def __init__(self, head):
+        self.head = np.ascontiguousarray(head)
+        n = len(head)
+        self.tail_left = np.empty((0, n))
+        self.tail_right = np.empty((0, 0))
+
+    def __len__(self):
+        return len(self.head) + len(self.tail_right)
+
+    def solve(self, rhs):
+        """Solve L x = rhs."""
+        n = len(self.head)
+        top = rhs[:n]
+        if n:
+            top = solve_triangular(self.head, top, lower=True,
+                                   check_finite=False)
+        if not len(self.tail_right):
+            return top
+        bottom = solve_triangular(self.tail_right,
+                                  rhs[n:] - self.tail_left.dot(top),
+                                  lower=True, check_finite=False)
+        return np.concatenate([top, bottom])
+
+    def solve_transposed(self, rhs):
+        """Solve L^T x = rhs."""
+        n = len(self.head)
+        top, bottom = rhs[:n], rhs[n:]
+        if len(self.tail_right):
+            bottom = solve_triangular(self.tail_right, bottom, lower=True,
+                                      trans='T', check_finite=False)
+            top = top - self.tail_left.T.dot(bottom)
+        if n:
+            top = solve_triangular(self.head, top, lower=True, trans='T',
+                                   check_finite=False)
+        return np.concatenate([top, bottom])
+
+    def appended(self, k12, k22):
+        """Factor of the matrix with new rows and columns.
+
+        Args:
+            k12 (numpy.ndarray): covariance between the old and new points
+            k22 (numpy.ndarray): covariance of the new points
+
+        Returns:
+            _Cholesky: the new factor (this one is not modified)
+        """
+        n_head = len(self.head)
+        b = self.solve(k12).T
+        c = np.linalg.cholesky(k22 - b.dot(b.T))
+
+        new = _Cholesky.__new__(_Cholesky)
+        new.head = self.head
+        new.tail_left = np.concatenate([self.tail_left, b[:, :n_head]])
+        k_old, k_new = len(self.tail_right), len(c)
+        tail_right = np.zeros((k_old + k_new, k_old + k_new))
+        tail_right[:k_old, :k_old] = self.tail_right
+        tail_right[k_old:, :k_old] = b[:, n_head:]
+        tail_right[k_old:, k_old:] = c
+        new.tail_right = tail_right
+
+        if len(tail_right) > max(n_head // 4, 32):
+            new._merge()
+        return new
+
+    def _merge(self):
+        n_head, n = len(self.head), len(self)
+        head = np.zeros((n, n))
+        head[:n_head, :n_head] = self.head
+        head[n_head:, :n_head] = self.tail_left
+        head[n_head:, n_head:] = self.tail_right
+        self.__init__(head)
+
+
+class GPFit(Fit):
+    """Fit of a GPSmoother.
+
+    Parties present in the same polls form a group sharing the Cholesky
+    factor of their covariance matrix. New polls append rows to the factors
+    of the groups in them (splitting the groups whose parties are not all
+    in the new polls), which costs O(n^2) per poll instead of the O(n^3) of
+    a new factorization.
+    """
+
+    def __init__(self, x, Y, grid, length_scale, noise):
+        Fit.__init__(self, x, Y, grid)
+        self.length_scale = length_scale
+        self.noise = noise
+        self.groups = []
+        self._trend_values = np.full((len(grid), Y.shape[1]), np.nan)
+
+        mask = ~np.isnan(Y)
+        patterns = collections.OrderedDict()
+        for j in range(Y.shape[1]):
+            if mask[:, j].any():
+                patterns.setdefault(mask[:, j].tobytes(), []).append(j)
+        for columns in patterns.values():
+            rows = mask[:, columns[0]]
+            self.groups.append(self._new_group(columns, x[rows],
+                                               Y[rows][:, columns]))
+
+    def _new_group(self, columns, xs, ys):
+        """Group of parties present in the same polls."""
+        k = _kernel(xs, xs, self.length_scale)
+        k[np.diag_indices_from(k)] += self.noise
+        group = {'columns': columns, 'mean': ys.mean(axis=0), 'x': xs,
+                 'y': ys, 'cholesky': _Cholesky(np.linalg.cholesky(k))}
+        self._solve(group)
+        self._predict(group, slice(None))
+        return group
+
+    def _append(self, group, x_new, y_new):
+        """Group with new polls appended to its Cholesky factor."""
+        k12 = _kernel(group['x'], x_new, self.length_scale)
+        k22 = _kernel(x_new, x_new, self.length_scale)
+        k22[np.diag_indices_from(k22)] += self.noise
+
+        group = dict(group)
+        group['cholesky'] = group['cholesky'].appended(k12, k22)
+        group['x'] = np.concatenate([group['x'], x_new])
+        group['y'] = np.concatenate([group['y'], y_new])
+        self._solve(group)
+        return group
+
+    def _solve(self, group):
+        cholesky = group['cholesky']
+        group['alpha'] = cholesky.solve_transposed(
+            cholesky.solve(group['y'] - group['mean']))
+
+    def _predict(self, group, points):
+        """Trends of a group at some points of the grid."""
+        k = _kernel(self.grid[points], group['x'], self.length_scale)
+        self._trend_values[points, group['columns']] = (
+            group['mean'] + k.dot(group['alpha']))
+
+    def _update(self, x_new, Y_new, grid):
+        n_old = len(self.grid)
+        self.grid = grid
+        trend = np.full((len(grid), Y_new.shape[1]), np.nan)
+        trend[:n_old] = self._trend_values
+        self._trend_values = trend
+
+        mask = ~np.isnan(Y_new)
+        groups = []
+        grouped = set()
+        for group in self.groups:
+            grouped.update(group['columns'])
+            # The group is split by the new polls each party appears in
+            patterns = collections.OrderedDict()
+            for i, j in enumerate(group['columns']):
+                patterns.setdefault(mask[:, j].tobytes(), []).append(i)
+            for members in patterns.values():
+                sub = self._subgroup(group, members)
+                rows = mask[:, sub['columns'][0]]
+                if rows.any():
+                    sub = self._append(sub, x_new[rows],
+                                       Y_new[rows][:, sub['columns']])
+                    self._predict(sub, slice(None))
+                elif len(grid) > n_old:
+                    self._predict(sub, slice(n_old, None))
+                groups.append(sub)
+
+        # Parties without polls until now
+        new_columns = [j for j in range(Y_new.shape[1])
+                       if j not in grouped and mask[:, j].any()]
+        patterns = collections.OrderedDict()
+        for j in new_columns:
+            patterns.setdefault(mask[:, j].tobytes(), []).append(j)
+        for columns in patterns.values():
+            rows = mask[:, columns[0]]
+            groups.append(self._new_group(columns, x_new[rows],
+                                          Y_new[rows][:, columns]))
+
+        self.groups = groups
+
+    def _subgroup(self, group, members):
+        if len(members) == len(group['columns']):
+            return group
+        sub = dict(group)
+        sub['columns'] = [group['columns'][i] for i in members]
+        sub['mean'] = group['mean'][members]
+        sub['y'] = group['y'][:, members]
+        sub['alpha'] = group['alpha'][:, members]
+        return sub
+
+    def _trend(self):
+        return self._trend_values.copy()
+
+
+class GPSmoother(Smoother):
+    """Gaussian process with fixed hyperparameters.
+
+    Squared exponential kernel with length scale ``length_scale`` (days) and
+    a noise variance of ``noise`` times the signal variance. As the
+    hyperparameters are fixed, parties present in the same polls share the
+    same covariance matrix, which is factorized only once.
+    """
+
+    def __init__(self, length_scale=None, noise=0.5):
+        """Create a GPSmoother.
+
+        Args:
+            length_scale (Optional[float]): length scale in days. By default
+                        1/10 of the length of the series when it is fitted,
+                        and at least 7 days.
+            noise (Optional[float]): ratio between the noise and the signal
+                        variances
+        """
+        self.length_scale = length_scale
+        self.noise = noise
+
+    def fit(self, x, Y, grid):
+        length_scale = self.length_scale
+        if length_scale is None:
+            length_scale = max((x.max() - x.min()) / 10., 7.)
+        return GPFit(x, Y, grid, length_scale, self.noise)
+
+
+smoothers = {'gp': GPSmoother, 'kernel': KernelSmoother}
+
+
+def get_smoother(smoother):
+    """Smoother from its name ('gp', 'kernel') or a Smoother instance."""
+    if isinstance(smoother, Smoother):
+        return smoother
+    return smoothers[smoother]()
+
+
+_cache = collections.OrderedDict()
+cache_size = 64
+
+
+def _key(*args):
+    """Cache key of some arrays and parameters."""
+    key = hashlib.sha1()
+    for arg in args:
+        if isinstance(arg, np.ndarray):
+            key.update(repr(arg.shape).encode('utf8'))
+            key.update(np.ascontiguousarray(arg).tobytes())
+        else:
+            key.update(repr(arg).encode('utf8'))
+    return key.hexdigest()
+
+
+def _cached(key, value=None):
+    """Get (or set if ``value`` is given) an entry of the cache."""
+    if value is not None:
+        _cache[key] = value
+        if len(_cache) > cache_size:
+            _cache.popitem(last=False)
+    elif key in _cache:
+        profiling.hit('trend')
+        _cache.move_to_end(key)
+    else:
+        profiling.miss('trend')
+    return _cache.get(key)
+
+
+@profiling.timed('trend')
+def smooth(dates, Y, smoother='gp', n_points=1000):
+    """Trends of several parties on a shared time grid.
+
+    Results are cached, keyed on the poll data and the smoother parameters,
+    so smoothing again the same polls does not refit anything.
+
+    Args:
+        dates (array-like): dates of the polls
+        Y (numpy.ndarray): votes, polls x parties, NaN if missing
+        smoother (Optional[str or Smoother]): 'gp', 'kernel' or a Smoother
+        n_points (Optional[int]): number of points of the grid
+
+    Returns:
+        Tuple[numpy.ndarray]: grid (datetime64) and trends (grid x parties)
+    """
+    smoother = get_smoother(smoother)
+    x = to_days(dates)
+    Y = np.asarray(Y, dtype=float)
+
+    key = _key('smooth', x, Y, smoother.params(), n_points)
+    result = _cached(key)
+    if result is None:
+        grid = np.linspace(x.min(), x.max(), n_points)
+        result = _cached(key, (from_days(grid), smoother.smooth(x, Y, grid)))
+    return result
+
+
+@profiling.timed('trend')
+def fit(dates, Y, smoother='gp'):
+    """Fit the trends of several parties on a daily grid.
+
+    Like ``smooth`` results are cached, and they can be updated with
+    ``update`` when new polls arrive.
+
+    Returns:
+        Fit: fitted trends (``grid`` in days, see ``from_days``)
+    """
+    smoother = get_smoother(smoother)
+    x = to_days(dates)
+    Y = np.asarray(Y, dtype=float)
+
+    key = _key('fit', x, Y, smoother.params())
+    result = _cached(key)
+    if result is None:
+        result = _cached(key, smoother.fit(x, Y, daily_grid(x)))
+    return result
+
+
+@profiling.timed('trend')
+def update(fitted, dates, Y, smoother='gp'):
+    """Update a fit with new polls.
+
+    The parameters of ``fitted`` are kept: the bandwidth or length scale the
+    smoother derived from the first polls when it was not given and, for the
+    GP, the mean of each party. A KernelFit is then the same as a full fit
+    with ``KernelSmoother(fitted.bandwidth)``, and a GPFit close to one with
+    ``GPSmoother(fitted.length_scale, fitted.noise)``, but neither is the
+    same as ``fit(dates, Y)`` with the default parameters. Updated fits are
+    not cached.
+
+    Args:
+        fitted (Fit): fit of the first polls of ``dates`` and ``Y``
+        dates (array-like): dates of all the polls, the new ones at the end
+        Y (numpy.ndarray): votes of all the polls, polls x parties
+
+    Returns:
+        Tuple: the new Fit and the indices of the parties whose trends have
+               changed
+    """
+    smoother = get_smoother(smoother)
+    x = to_days(dates)
+    Y = np.asarray(Y, dtype=float)
+    n_old = len(fitted.x)
+
+    if len(x) == n_old:
+        return fitted, np.arange(0)
+    if x[n_old:].min() < fitted.grid[0]:
+        # The grid can not be extended backwards
+        return fit(dates, Y, smoother), np.arange(Y.shape[1])
+
+    grid = daily_grid(np.concatenate([fitted.grid, x]),
+                      start=fitted.grid[0])
+    return fitted.updated(x[n_old:], Y[n_old:], grid)
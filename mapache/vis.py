@@ -2,69 +2,200 @@
 
 import matplotlib.pylab as plt
 import matplotlib
+import matplotlib.dates
+import matplotlib.figure
+import matplotlib.backends.backend_agg
 import numpy as np
-from sklearn import gaussian_process
-import time
 import datetime
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import mapache.trends
+from mapache import profiling
+
+_BARS_STYLE = {'figure.figsize': (12, 6),
+               'xtick.labelsize': 16,
+               'axes.labelweight': 'bold',
+               'font.weight': 'normal',
+               'xtick.major.pad': 16,
+               'axes.titlesize': 20,
+               'axes.titleweight': 'bold'}
+
 
 class SingleBars:
     
+    @profiling.timed('render')
     def __init__(self, poll, parties, elections=None, join_coalitions=True):
-        plt.rcParams['figure.figsize'] = (12, 6)
+        with matplotlib.rc_context(_BARS_STYLE):
+            self._fig = plt.figure()
+            template = _BarsTemplate(self._fig, len(parties.parties),
+                                     elections is not None)
+            template.update(_bars_chart(poll, parties, elections,
+                                        join_coalitions))
+            
+    @profiling.timed('render')
+    def export(self, filename):
+        """Save the chart to a file.
 
-        self._fig, ax = plt.subplots()
+        :param filename: name of the file (or a file object). The format
+                         (png, svg, pdf...) is given by the extension.
+        """
+        self._fig.savefig(filename)
 
-        plt.rcParams['xtick.labelsize'] = 16
-        plt.rcParams['axes.labelweight'] = 'bold'
-        plt.rcParams['font.weight'] = 'normal'
-        plt.rcParams['xtick.major.pad']='16'
-        plt.rcParams['axes.titlesize'] = 20
-        plt.rcParams['axes.titleweight'] = 'bold'
 
-        parties_votes = []
+def _bars_chart(poll, parties, elections=None, join_coalitions=True):
+    """Everything needed to draw the bars of a poll, without mapache objects.
 
-        for i, p in enumerate(parties.parties.values()):    
-                parties_votes.append((p, poll.get_party(p,join_coalitions)))
-                
-        parties_votes.sort(key=lambda x: x[1], reverse=True)
-        parties_votes = []
-        for i, p in enumerate(parties.parties.values()):    
-            parties_votes.append((p, poll.get_party(p,join_coalitions)))
-            
-        parties_votes.sort(key=lambda x: x[1], reverse=True)
-        width = 0.6
-        left_lim = 0.1
-        plt.title(poll.pollster + poll.date.strftime(' - %-d %b'), loc='left', x=0, y=1.1, fontdict={'ha':'left'})
-        names = []
-        for i, (p, votes) in enumerate(parties_votes):    
-            a = ax.bar(left_lim+i, votes, width=width, color=p.color, edgecolor='none')
-            ax.text(left_lim+i+width/2, votes-4, '{0}%'.format(votes), 
-                   fontdict={'weight':'bold', 'color':'w', 'fontsize':'20', 'ha':'center', 'va':'center'})
-            names.append(p.short_name)
-            if elections:
-                vot =elections.get_party(p,join_coalitions)
-                if a:
-                    plt.plot([left_lim+i-0.1*width, left_lim+i+width+0.1*width], [vot, vot], color=[0.2,0.2,0.2], linewidth=3)
-
-        idx = np.arange(len(parties.parties))+width/2 + left_lim
+    :return: dict with the title, error and the (short name, color, votes,
+             election votes) of each party, sorted by votes
+    """
+    bars = []
+    for p in parties.parties.values():
+        votes = poll.get_party(p, join_coalitions=join_coalitions)
+        election = None
+        if elections:
+            election = elections.get_party(p, join_coalitions=join_coalitions)
+        bars.append((p.short_name, p.color, votes or 0, election))
+    bars.sort(key=lambda x: x[2], reverse=True)
+
+    return {'title': (poll.pollster or '') + poll.date.strftime(' - %-d %b'),
+            'error': poll.error, 'bars': bars}
+
+
+class _BarsTemplate:
+    """Figure of SingleBars whose bars and labels can be updated.
+
+    All the artists are created once, drawing another poll only changes
+    their heights, colors and texts.
+    """
+
+    width = 0.6
+    left_lim = 0.1
+
+    def __init__(self, fig, n_parties, elections=False):
+        """Create the bars, texts and axes of the chart, with no poll drawn.
+
+        :param fig: matplotlib figure to draw in
+        :param n_parties: number of bars
+        :param elections: if True, the result of the elections of each party
+                          is drawn as a line over its bar
+        """
+        width = self.width
+        left = self.left_lim + np.arange(n_parties)
+        ax = fig.add_subplot(1, 1, 1)
+
+        self.fig = fig
+        self.ax = ax
+        self.bars = ax.bar(left, np.zeros(n_parties), width=width,
+                           align='edge', edgecolor='none')
+        self.texts = [ax.text(l + width / 2, 0, '',
+                              fontdict={'weight': 'bold', 'color': 'w',
+                                        'fontsize': '20', 'ha': 'center',
+                                        'va': 'center'})
+                      for l in left]
+        self.election_lines = []
+        if elections:
+            for l in left:
+                line, = ax.plot([l - 0.1 * width, l + width + 0.1 * width],
+                                [np.nan, np.nan], color=[0.2, 0.2, 0.2],
+                                linewidth=3)
+                self.election_lines.append(line)
+        self.title = ax.set_title('', loc='left', x=0, y=1.1,
+                                  fontdict={'ha': 'left'})
+        self.error = fig.text(0.125, .94, '', fontdict={'fontsize': 12})
+
+        idx = left + width / 2
         ax.set_xticks(idx)
-        ax.set_xlim([0, idx[-1]+width/2 + left_lim])
-        ax.set_xticklabels(names);
+        ax.set_xlim([0, idx[-1] + width / 2 + self.left_lim])
         ax.spines['top'].set_visible(False)
         ax.spines['right'].set_visible(False)
         ax.spines['left'].set_visible(False)
-        ax.xaxis.set_ticks_position('none') 
-        ax.yaxis.set_ticks_position('none') 
-        if poll.error:
-            plt.figtext(0.125,.94,'({}% error)'.format(poll.error), fontdict={'fontsize': 12})
-            
-    def export(self, filename):
-        """ TODO
-        :param filename:
-        :return:
-        """        
-        self._fig.savefig(filename)
+        ax.xaxis.set_ticks_position('none')
+        ax.yaxis.set_ticks_position('none')
 
+    def update(self, chart):
+        """Draw a chart as returned by _bars_chart."""
+        names = []
+        for i, (name, color, votes, election) in enumerate(chart['bars']):
+            self.bars[i].set_height(votes)
+            self.bars[i].set_facecolor(color)
+            self.texts[i].set_text('{0}%'.format(votes) if votes else '')
+            self.texts[i].set_y(votes - 4)
+            if self.election_lines:
+                if election is None:
+                    election = np.nan
+                self.election_lines[i].set_ydata([election, election])
+            names.append(name)
+
+        self.ax.set_xticklabels(names)
+        self.title.set_text(chart['title'])
+        error = chart['error']
+        self.error.set_text('({}% error)'.format(error) if error else '')
+        self.ax.relim()
+        self.ax.autoscale_view()
+
+
+def _render_bars(charts, filenames, elections):
+    """Render charts to files reusing a single figure (runs in the workers).
+
+    :return: number of charts rendered
+    """
+    with matplotlib.rc_context(_BARS_STYLE):
+        fig = matplotlib.figure.Figure()
+        matplotlib.backends.backend_agg.FigureCanvasAgg(fig)
+        template = _BarsTemplate(fig, len(charts[0]['bars']), elections)
+        for chart, filename in zip(charts, filenames):
+            template.update(chart)
+            fig.savefig(filename)
+    return len(charts)
+
+
+@profiling.timed('render')
+def render_bars(polls, parties, directory='.', filename='poll-{index:04d}.png',
+                elections=None, join_coalitions=True, processes=None,
+                chunk_size=None):
+    """Save a SingleBars chart of each poll of a PollsList.
+
+    Charts are rendered without pyplot in a pool of processes, and each
+    process reuses one figure for all its charts.
+
+    :param polls: mapache.PollsList
+    :param parties: mapache.PartySet
+    :param directory: directory of the files
+    :param filename: name of the files, formatted with the index and date of
+                     each poll (eg. 'poll-{date:%Y%m%d}-{index}.svg'). The
+                     format (png, svg, pdf...) is given by the extension.
+    :param elections: mapache.Poll with the results of the elections
+    :param join_coalitions:
+    :param processes: number of processes, by default the number of cores.
+                      With 1 the charts are rendered in this process.
+    :param chunk_size: number of charts sent to each process at a time
+    :return: list with the names of the files
+    """
+    charts = [_bars_chart(poll, parties, elections, join_coalitions)
+              for poll in polls.polls]
+    filenames = [os.path.join(directory,
+                              filename.format(index=i, date=poll.date))
+                 for i, poll in enumerate(polls.polls)]
+    if not charts:
+        return []
+
+    if processes == 1:
+        _render_bars(charts, filenames, elections is not None)
+        return filenames
+
+    if chunk_size is None:
+        workers = processes or os.cpu_count() or 1
+        chunk_size = max(1, -(-len(charts) // (4 * workers)))
+    chunks = [slice(i, i + chunk_size)
+              for i in range(0, len(charts), chunk_size)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        list(executor.map(_render_bars,
+                          [charts[c] for c in chunks],
+                          [filenames[c] for c in chunks],
+                          [elections is not None] * len(chunks)))
+    return filenames
 
 
 def _percentage_formatter(y, _):
@@ -87,19 +218,24 @@ class TimeSeries:
     """ TODO
     """
 
-    def __init__(self, parties):
+    def __init__(self, parties, smoother='gp'):
         """ TODO
 
         :param parties:
+        :param smoother: smoother of the trend lines, 'gp' (gaussian process
+                         with fixed hyperparameters), 'kernel' (local
+                         linear regression) or a mapache.trends.Smoother
         :return:
         """
         #TODO sure?
         plt.rcParams['figure.figsize'] = (18,12)
         
         self.parties = parties
+        self.smoother = smoother
         self.columns = []
         self.__up_to_date = False
         self.__fig = None
+        self.__states = []
 
     def add_column(self, polls, main=False):
         """ TODO
@@ -121,58 +257,153 @@ class TimeSeries:
             self.__create_fig()
         plt.show()
 
-    def export(self, filename):
-        """ TODO
-        :param filename:
+    @profiling.timed('render')
+    def export(self, filename=None, format=None, dpi=None):
+        """Save the figure (png, svg, pdf...).
+
+        The figure is rendered with the Agg backend, without pyplot, so it
+        can be used in processes without a display, and it is freed once it
+        has been written.
+
+        :param filename: name of the file or file object to write to. If not
+                         indicated the figure is returned as bytes.
+        :param format: format of the figure, by default given by the
+                       extension of filename or 'png'
+        :param dpi: resolution of the figure
+        :return: bytes of the figure if filename is None
+        """
+        fig = matplotlib.figure.Figure()
+        matplotlib.backends.backend_agg.FigureCanvasAgg(fig)
+        try:
+            self.__draw(fig)
+            if filename is None:
+                buffer = io.BytesIO()
+                fig.savefig(buffer, format=format or 'png', dpi=dpi)
+                return buffer.getvalue()
+            fig.savefig(filename, format=format, dpi=dpi)
+        finally:
+            fig.clear()
+
+    def add_polls(self, polls, column=-1):
+        """Add polls to a column, updating the figure incrementally.
+
+        If the figure has already been drawn, only the trends of the parties
+        in the new polls are updated (reusing the previous fit, see
+        mapache.trends.update) and only their artists are changed.
+
+        :param polls: mapache.Poll or mapache.PollsList with the new polls
+        :param column: index of the column, the last one by default
         :return:
         """
-        # TODO
-        if self.__fig is None:
-            self.__create_fig()
+        c = self.columns[column]
+        c['polls'].add(polls)
 
-        pass
+        if self.__fig is None:
+            return
+        state = self.__states[column]
+        if state['single'] or state['fit'] is None:
+            # The layout of the column changes, everything is redrawn
+            self.__fig = None
+            return
 
+        ax = state['ax']
+        frame = c['polls'].frame()
+        parties = list(self.parties.parties.values())
+        votes = self.__votes(c['polls'], parties)
+        n_old = state['n']
+
+        fit, changed = mapache.trends.update(state['fit'], frame.dates, votes,
+                                             self.smoother)
+        grid = mapache.trends.from_days(fit.grid).astype(datetime.datetime)
+        trend = fit.trend
+        for j in changed:
+            party = parties[j]
+            if j in state['lines']:
+                state['lines'][j].set_data(grid, trend[:, j])
+            else:
+                state['lines'][j], = ax.plot(grid, trend[:, j], '-',
+                                             c=party.color, linewidth=3)
+
+        x, y, colors = self.__points(state, frame.dates[n_old:],
+                                     votes[n_old:], parties)
+        # No points if no party of the new polls is in the PartySet
+        if len(x):
+            x = matplotlib.dates.date2num(x)
+            scatter = state['scatter']
+            if scatter is None:
+                state['scatter'] = ax.scatter(x, y, c=colors,
+                                              edgecolors='none', s=40,
+                                              label=u'Observations')
+            else:
+                scatter.set_offsets(np.concatenate([scatter.get_offsets(),
+                                                    np.column_stack([x, y])]))
+                scatter.set_facecolor(np.concatenate(
+                    [scatter.get_facecolor(), colors]))
+            ax.update_datalim(np.column_stack([x, y]))
+
+        state['fit'] = fit
+        state['n'] = len(frame)
+        if state['last']:
+            self.__labels(state, c['polls'], parties, votes)
+        ax.autoscale_view()
+        self.__set_ylim(self.__states)
+        self.__fig.canvas.draw_idle()
+
+    @profiling.timed('render')
     def __create_fig(self):
         """ TODO
         :return:
         """
         self.__fig = plt.figure()
+        self.__states = self.__draw(self.__fig)
+
+    def __draw(self, fig):
+        """Draw all the columns in a figure.
 
+        :param fig: matplotlib figure
+        :return: list with the state of each column
+        """
+        states = []
         if not self.columns:
             print('No columns have been added')
-            return
+            return states
             
         range_lengths = []
         for c in self.columns:
-            # TODO add get_dates() to ListPolls!!
-            dates = [p.date for p in c['polls'].polls]
-            range_lengths.append((max(dates) - min(dates)).days)
+            dates = c['polls'].dates()
+            range_lengths.append(int((dates[-1] - dates[0]) /
+                                     np.timedelta64(1, 'D')))
         # range_lengths = [c['polls']['dates'][-1] - c['polls']['dates'][0] for c in self.columns]
         
         range_lengths_nonzero = [r for r in range_lengths if r != 0]
         total_length = (sum(range_lengths) / (1 - (len(self.columns) - len(range_lengths_nonzero)) * 0.1))
         range_lengths = [r / total_length if r != 0 else 0.1 for r in range_lengths]
-        gs = matplotlib.gridspec.GridSpec(1, len(self.columns), width_ratios=range_lengths)
+        gs = matplotlib.gridspec.GridSpec(1, len(self.columns), width_ratios=range_lengths, figure=fig)
 
         for i, c in enumerate(self.columns):
-            ax = plt.subplot(gs[i])
+            ax = fig.add_subplot(gs[i])
             first = False
             last = False
             if i == 0:
                 first = True
             if i == len(self.columns) - 1:
                 last = True
-            self.__draw_column(c['polls'], ax, first, last)
+            states.append(self.__draw_column(c['polls'], ax, first, last))
+
+        self.__set_ylim(states)
+        return states
 
+    def __set_ylim(self, states):
+        """Set the same y limits and ticks to all the columns."""
         max_percentage = 0
         for i, c in enumerate(self.columns):
-            for poll in c['polls'].polls:
-                for name, percentages in poll.parties.items():
-                    max_percentage = max(max_percentage, np.max(percentages))
+            values = c['polls'].frame().values
+            if np.isfinite(values).any():
+                max_percentage = max(max_percentage, np.nanmax(values))
                 
         yticks = [tick for tick in [10, 20, 30, 40, 50, 60, 70, 80, 90] if tick < max_percentage]
-        for g in gs:
-            ax = plt.subplot(g)
+        for state in states:
+            ax = state['ax']
             ax.set_yticks(yticks, minor=False)
             ax.set_ylim(0, min(max_percentage + 5, 100))
 
@@ -182,25 +413,30 @@ class TimeSeries:
         :param polls:
         :param first:
         :param last:
-        :return:
+        :return: state of the column (axes, fit and artists of each party)
         """
 
-        self.__fig = None
-
         #From type!!
-        dates = [p.date for p in polls.polls]
+        dates = polls.frame().dates
 
         single = len(dates) == 1
 
+        state = {'ax': ax, 'single': single, 'last': last, 'fit': None,
+                 'n': len(dates), 'lines': {}, 'scatter': None, 'labels': {}}
+
         title_loc = 'left'
         if single:
             title_loc = 'center'
 
         ax.set_title(polls._name, loc=title_loc)
         
-        self.__scatter(polls, self.parties, ax, single, last)
+        parties = list(self.parties.parties.values())
+        votes = self.__votes(polls, parties)
+        self.__scatter(state, polls, parties, votes)
         if not single:
-            self.__gp(polls, self.parties, ax)        
+            self.__trend(state, polls, parties, votes)
+        if last:
+            self.__labels(state, polls, parties, votes)
 
         ax.set_yticks([10, 20, 30, 40, 50, 60, 70, 80, 90], minor=False)
         ax.yaxis.grid(True, which='major')
@@ -225,79 +461,99 @@ class TimeSeries:
             ax.set_xticks([polls.polls[0].date], minor=False)
             pass
 
-    def __scatter(self, polls, parties, ax, single=False, last=False):
-        """ TODO
-        :param single:
+        return state
+
+    def __votes(self, polls, parties):
+        """Votes of each party in each poll (polls x parties, NaN if none).
+
+        :param polls:
+        :param parties: list of mapache.Party
         :return:
         """
-        
-        last_date = datetime.datetime.min
-        
-        for party in parties.parties.values():
-            polls_party = polls.get_party(party)
-            
-            dates = [x[0] for x in polls_party]
-            votes = [x[1] for x in polls_party]           
+        votes = polls.frame().party_matrix(parties, polls._resolver())
+        # As in PollsList.get_party, 0 is not a valid poll result
+        votes[votes == 0] = np.nan
+        return votes
+
+    def __points(self, state, dates, votes, parties):
+        """Points of all the parties, with the color of each point.
 
-            if single:
-                ax.scatter(dates, votes, 70, c=party.color, edgecolors='none', label=u'Observations')
+        :param dates: dates of the polls (datetime64)
+        :param votes: votes of each party in each poll (polls x parties)
+        :return: dates, votes and RGBA colors of the points
+        """
+        alpha = 1 if state['single'] else 0.6
+        party_colors = np.array([np.append(party.color[:3], [alpha])
+                                 for party in parties]).reshape(-1, 4)
+        polls, columns = np.nonzero(~np.isnan(votes))
+        return (dates[polls].astype(datetime.datetime),
+                votes[polls, columns], party_colors[columns])
+
+    def __scatter(self, state, polls, parties, votes):
+        """Draw the polls of all the parties as a single collection.
+
+        :return:
+        """
+        x, y, colors = self.__points(state, polls.frame().dates, votes,
+                                     parties)
+        if not len(x):
+            return
+
+        size = 70 if state['single'] else 40
+        state['scatter'] = state['ax'].scatter(x, y, size, c=colors,
+                                               edgecolors='none',
+                                               label=u'Observations')
+
+    def __labels(self, state, polls, parties, votes):
+        """Names of the parties at the end of the last column.
+
+        Each name is placed at the last value of the trend of its party (or
+        its last poll if there is no trend).
+
+        :return:
+        """
+        ax = state['ax']
+        frame = polls.frame()
+        last_date = polls.dates()[-1].astype(datetime.datetime)
+        if state['fit'] is not None:
+            values = state['fit'].trend
+        else:
+            values = votes[np.argsort(frame.dates, kind='stable')]
+
+        found = ~np.isnan(values)
+        # Index of the last value of each party
+        last = len(values) - 1 - np.argmax(found[::-1], axis=0)
+
+        for j, party in enumerate(parties):
+            if not found[:, j].any():
+                continue
+            position = (last_date, values[last[j], j])
+            if j in state['labels']:
+                state['labels'][j].set_position(position)
             else:
-                ax.scatter(dates, votes, c=np.append(party.color, [0.6]), edgecolors='none', s=40,
-                       label=u'Observations')
-            
-            last_date = max(last_date, max(dates))
-        
-        
-        if last:
-            # TODO move to last point of regression, not poll
-            #TODO add name label at the end!
-            for party in parties.parties.values():
-                 polls_party = polls.get_party(party)
-                 
-                 last_date_arg = np.argmin([x[0] for x in polls_party])
-                 votes = polls_party[last_date_arg][1]
-                 polls_party = polls.get_party(party)           
-                 plt.text(last_date, votes, '  ' + party.short_name,
-                          color=party.color, weight='bold', 
-                          verticalalignment='center', fontsize=20)
+                state['labels'][j] = ax.text(
+                    position[0], position[1], '  ' + party.short_name,
+                    color=party.color, weight='bold',
+                    verticalalignment='center', fontsize=20)
 
-            
-    def __gp(self,polls, parties, ax):
-        """ TODO
+    def __trend(self, state, polls, parties, votes):
+        """Draw the trend line of each party.
 
-        :param x:
+        The trends of all the parties of the column are fitted together by
+        mapache.trends.fit (and cached).
+
+        :param polls:
+        :param parties:
         :param ax:
-        :param partyname:
         :return:
         """
-        for party in parties.parties.values():
-            polls_party = polls.get_party(party)
-            
-            dates = [x[0] for x in polls_party]
-            votes = [x[1] for x in polls_party]           
-        
-            x = dates
-            y = votes
-
-            # + 0.5 - 0.5?
-            
-            x_dense = np.atleast_2d(np.linspace(time.mktime(x[0].timetuple()),
-                                                time.mktime(x[-1].timetuple()), 1000)).T
-            #x_dense = np.atleast_2d(np.linspace(x[0], x[-1], 1000)).T
-
-            np.random.seed(1)            
-            gp = gaussian_process.GaussianProcess(corr='squared_exponential', theta0=1e-1,
-                                                  thetaL=1e-3, thetaU=1,
-                                                  random_start=100, nugget=10 - 8)
-            x = [time.mktime(xi.timetuple()) for xi in x]
-            gp.fit(np.reshape(x, (-1, 1)) + np.random.randn(len(x),1)*0.01, np.reshape(y,(-1, 1)))
-            y_pred, mse = gp.predict(x_dense, eval_MSE=True)
-            sigma = np.sqrt(mse)
-            x_dense = [datetime.datetime.fromtimestamp(xi) for xi in x_dense]
-            ax.plot(x_dense, y_pred, 'b-', label=u'Prediction', c=party.color, linewidth=3)
-            # TODO Check and (maybe) fix?
-            #  ax.fill(np.concatenate([x_dense, x_dense[::-1]]),
-            #        np.concatenate([y_pred - 1.9600 * sigma,
-            #                        (y_pred + 1.9600 * sigma)[::-1]]),
-            #       color=np.append(party.color, [0.1]), fc='b', ec='None',
-            #     label='95% confidence interval')
+        fit = mapache.trends.fit(polls.frame().dates, votes, self.smoother)
+        state['fit'] = fit
+
+        grid = mapache.trends.from_days(fit.grid).astype(datetime.datetime)
+        for j, (party, trend) in enumerate(zip(parties, fit.trend.T)):
+            if np.isnan(trend).all():
+                continue
+            state['lines'][j], = state['ax'].plot(
+                grid, trend, '-', label=u'Prediction', c=party.color,
+                linewidth=3)
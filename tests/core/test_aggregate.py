@@ -0,0 +1,118 @@
+"""mapache.aggregate tests."""
+
+import unittest
+import datetime
+
+import numpy as np
+
+import sys
+sys.path.append('../')
+import mapache
+from mapache.synthetic import SyntheticParty
+from mapache.aggregate import PollAverage
+
+
+
+def create_polls(n=300, seed=0):
+    random_state = np.random.RandomState(seed)
+    polls = mapache.PollsList('test')
+    start = datetime.datetime(2016, 1, 1)
+    for i in range(n):
+        day = int(random_state.randint(365))
+        votes = {'Partido Popular': 30 + random_state.randn(),
+                 'PSOE': 20 + random_state.randn()}
+        if random_state.rand() < 0.2:
+            del votes['PSOE']
+        polls.add(mapache.Poll(votes, start + datetime.timedelta(day),
+                               'P{0}'.format(i % 3),
+                               [None, 2., 4.][i % 3]))
+    return polls
+
+
+class TestPollAverage(unittest.TestCase):
+
+    def setUp(self):
+        self.parties = [SyntheticParty('PP', (200, 0, 0),
+                                       full_name='Partido Popular'),
+                        SyntheticParty('PSOE', (200, 0, 0))]
+        self.kwargs = {'half_life': 10., 'window': 30,
+                       'pollster_weights': {'P1': 0.5}}
+
+    def reference(self, polls, day):
+        """Average of a day, one poll at a time."""
+        votes, weights = np.zeros(2), np.zeros(2)
+        for poll in polls.polls:
+            lag = (day - poll.date).days
+            if not 0 <= lag < 30:
+                continue
+            weight = 0.5 ** (lag / 10.) * (3. / (poll.error or 3.)) ** 2
+            weight *= 0.5 if poll.pollster == 'P1' else 1.
+            for j, party in enumerate(self.parties):
+                v = poll.get_party(party)
+                if v:
+                    votes[j] += weight * v
+                    weights[j] += weight
+        return votes / weights
+
+    def test_same_as_loop(self):
+        polls = create_polls()
+        average = PollAverage(polls, self.parties, **self.kwargs)
+        dates = average.dates.astype(datetime.datetime)
+        for i in [0, 50, 200, len(dates) - 1]:
+            np.testing.assert_allclose(average.average[i],
+                                       self.reference(polls, dates[i]))
+
+    def test_incremental(self):
+        polls = create_polls()
+        average = PollAverage(create_polls(200), self.parties, **self.kwargs)
+        for poll in polls.polls[200:]:
+            average.add(poll)
+        full = PollAverage(polls, self.parties, **self.kwargs)
+        np.testing.assert_array_equal(average.dates, full.dates)
+        np.testing.assert_allclose(average.average, full.average)
+
+    def test_zero_error(self):
+        polls = create_polls(50)
+        for poll in polls.polls[4::5]:
+            poll.error = 0.
+        average = PollAverage(polls, self.parties, **self.kwargs)
+        self.assertFalse(np.isnan(average.average).all(axis=1).any())
+        dates = average.dates.astype(datetime.datetime)
+        for i in [0, len(dates) - 1]:
+            np.testing.assert_allclose(average.average[i],
+                                       self.reference(polls, dates[i]))
+
+        # Also when added
+        first = mapache.PollsList()
+        for poll in polls.polls[:-1]:
+            first.add(poll)
+        average = PollAverage(first, self.parties, **self.kwargs)
+        average.add(polls.polls[-1])
+        full = PollAverage(polls, self.parties, **self.kwargs)
+        np.testing.assert_allclose(average.average, full.average)
+
+    def test_blank_error(self):
+        polls = create_polls(50)
+        first = mapache.PollsList()
+        for poll in polls.polls[:-1]:
+            first.add(poll)
+        polls.polls[-1].error = ''
+        average = PollAverage(first, self.parties, **self.kwargs)
+        average.add(polls.polls[-1])
+        full = PollAverage(polls, self.parties, **self.kwargs)
+        np.testing.assert_allclose(average.average, full.average)
+        polls.polls[-1].error = None
+        unknown = PollAverage(polls, self.parties, **self.kwargs)
+        np.testing.assert_allclose(average.average, unknown.average)
+
+    def test_no_recent_polls(self):
+        polls = mapache.PollsList()
+        for day in [1, 100]:
+            polls.add(mapache.Poll({'PSOE': 20.},
+                                   datetime.datetime(2016, 1, 1) +
+                                   datetime.timedelta(day)))
+        _, psoe = PollAverage(polls, self.parties,
+                              **self.kwargs).get_party(self.parties[1])
+        self.assertTrue(np.isnan(psoe[40:99]).all())
+        self.assertEqual(psoe[0], 20.)
+        self.assertEqual(psoe[-1], 20.)
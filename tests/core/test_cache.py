@@ -0,0 +1,63 @@
+"""mapache.cache tests."""
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from PIL import Image
+
+import sys
+sys.path.append('../')
+import mapache
+from mapache.cache import ImageCache, set_image_cache
+
+img_url = 'https://github.com/cesans/mapache/raw/master/doc/source/mapache.png'
+local_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'doc',
+                         'source')
+
+
+class TestImageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = ImageCache(self.path, local_dir=local_dir)
+        set_image_cache(self.cache)
+
+    def tearDown(self):
+        set_image_cache(None)
+        shutil.rmtree(self.path)
+
+    def test_party_from_cache(self):
+        party = mapache.Party('name', logo_url=img_url)
+        self.assertEqual(self.cache.get_color(img_url), list(party.color))
+
+        cached = mapache.Party('name', logo_url=img_url)
+        self.assertEqual(list(cached.color), list(party.color))
+        self.assertEqual(cached._logo.size, party._logo.size)
+        self.assertEqual(cached._thumbnail.size, party._thumbnail.size)
+
+    def test_miss(self):
+        with self.assertRaises(KeyError):
+            self.cache.get_image(img_url)
+        with self.assertRaises(KeyError):
+            self.cache.get_color(img_url)
+
+    def test_eviction(self):
+        images_dir = os.path.join(self.path, 'images')
+        os.makedirs(images_dir)
+        urls = []
+        for i, color in enumerate(['red', 'blue']):
+            Image.new('RGB', (300, 100), color).save(
+                os.path.join(images_dir, '{0}.png'.format(i)))
+            urls.append('http://example.com/{0}.png'.format(i))
+        self.cache.local_dir = images_dir
+
+        first = mapache.Party('first', logo_url=urls[0])
+        self.assertEqual(self.cache.get_color(urls[0]), list(first.color))
+        self.cache.max_size = self.cache.size()
+
+        mapache.Party('second', logo_url=urls[1])
+        self.assertIsNotNone(self.cache.get_color(urls[1]))
+        with self.assertRaises(KeyError):
+            self.cache.get_color(urls[0])
@@ -0,0 +1,231 @@
+"""mapache.fetch tests, with a local http server."""
+
+import unittest
+import os
+import tempfile
+import threading
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import sys
+sys.path.append('../')
+import mapache
+from mapache import profiling
+from mapache.fetch import (Fetcher, HTTPCache, DirectoryFetcher,
+                           set_fetcher, get_fetcher)
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    # Path: [status of each request...], then 200
+    failures = {}
+    requests = []
+
+    def do_GET(self):
+        Handler.requests.append((self.path, dict(self.headers)))
+        failures = Handler.failures.get(self.path)
+        if failures:
+            self.send_response(failures.pop(0))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.path == '/etag':
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+        elif self.path == '/modified':
+            if self.headers.get('If-Modified-Since'):
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Last-Modified', 'Sat, 18 Jun 2016 10:00:00 GMT')
+        elif self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/etag')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        elif self.path == '/missing':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        else:
+            self.send_response(200)
+        body = ('content of ' + self.path).encode('utf8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ServerTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever,
+                                      daemon=True)
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:{0}'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        Handler.failures = {}
+        Handler.requests = []
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = HTTPCache(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+class TestFetcher(ServerTestCase):
+
+    def test_fetch(self):
+        fetcher = Fetcher()
+        self.assertEqual(fetcher.fetch(self.url + '/page'),
+                         b'content of /page')
+        self.assertEqual(fetcher.fetch(self.url + '/redirect'),
+                         b'content of /etag')
+        with self.assertRaises(urllib.error.HTTPError):
+            fetcher.fetch(self.url + '/missing')
+
+    def test_retries(self):
+        Handler.failures['/flaky'] = [503, 500]
+        fetcher = Fetcher(retries=2, backoff=0)
+        self.assertEqual(fetcher.fetch(self.url + '/flaky'),
+                         b'content of /flaky')
+        self.assertEqual(len(Handler.requests), 3)
+
+    def test_too_many_failures(self):
+        Handler.failures['/flaky'] = [503, 503, 503]
+        fetcher = Fetcher(retries=2, backoff=0)
+        with self.assertRaises(urllib.error.HTTPError):
+            fetcher.fetch(self.url + '/flaky')
+        self.assertEqual(len(Handler.requests), 3)
+
+    def test_no_retry_client_errors(self):
+        fetcher = Fetcher(retries=2, backoff=0)
+        with self.assertRaises(urllib.error.HTTPError):
+            fetcher.fetch(self.url + '/missing')
+        self.assertEqual(len(Handler.requests), 1)
+
+    def test_connection_error(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        url = 'http://127.0.0.1:{0}/page'.format(server.server_port)
+        server.server_close()
+        with self.assertRaises(OSError):
+            Fetcher(retries=1, backoff=0).fetch(url)
+
+    def test_close(self):
+        fetcher = Fetcher()
+        fetcher.fetch(self.url + '/page')
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(fetcher.fetch,
+                              [self.url + '/page'] * 8))
+        connections = list(fetcher._connections.values())
+        self.assertGreater(len(connections), 1)
+
+        # Only the connection of this thread is left
+        fetcher.close(finished_only=True)
+        self.assertEqual(list(fetcher._connections),
+                         [(threading.get_ident(), 'http',
+                           self.url.split('//')[1])])
+        fetcher.close()
+        self.assertEqual(fetcher._connections, {})
+        for connection in connections:
+            self.assertIsNone(connection.sock)
+        self.assertEqual(fetcher.fetch(self.url + '/page'),
+                         b'content of /page')
+
+    def test_etag(self):
+        fetcher = Fetcher(cache=self.cache)
+        with profiling.profile() as stats:
+            for _ in range(3):
+                self.assertEqual(fetcher.fetch(self.url + '/etag'),
+                                 b'content of /etag')
+        headers = [h for _, h in Handler.requests]
+        self.assertNotIn('If-None-Match', headers[0])
+        self.assertEqual(headers[1]['If-None-Match'], '"v1"')
+        cache = stats.snapshot()['cache.http']
+        self.assertEqual((cache['hits'], cache['misses']), (2, 1))
+
+    def test_last_modified(self):
+        fetcher = Fetcher(cache=self.cache)
+        fetcher.fetch(self.url + '/modified')
+        self.assertEqual(fetcher.fetch(self.url + '/modified'),
+                         b'content of /modified')
+        self.assertEqual(Handler.requests[1][1]['If-Modified-Since'],
+                         'Sat, 18 Jun 2016 10:00:00 GMT')
+
+    def test_not_cached_without_validators(self):
+        fetcher = Fetcher(cache=self.cache)
+        fetcher.fetch(self.url + '/page')
+        fetcher.fetch(self.url + '/page')
+        self.assertNotIn('If-Modified-Since', Handler.requests[1][1])
+        with self.assertRaises(KeyError):
+            self.cache.get(self.url + '/page')
+
+    def test_cache_shared(self):
+        Fetcher(cache=self.cache).fetch(self.url + '/etag')
+        other = Fetcher(cache=HTTPCache(self.directory.name))
+        self.assertEqual(other.fetch(self.url + '/etag'),
+                         b'content of /etag')
+        self.assertEqual(Handler.requests[1][1]['If-None-Match'], '"v1"')
+
+
+class TestDirectoryFetcher(ServerTestCase):
+
+    def test_files(self):
+        with open(os.path.join(self.directory.name, 'Podemos'), 'wb') as f:
+            f.write(b'page')
+        fetcher = DirectoryFetcher(self.directory.name)
+        self.assertEqual(fetcher.fetch('https://en.wikipedia.org/wiki/'
+                                       'Podemos'), b'page')
+        with self.assertRaises(urllib.error.URLError):
+            fetcher.fetch('https://en.wikipedia.org/wiki/Ciudadanos')
+
+    def test_record(self):
+        recorder = DirectoryFetcher(self.directory.name, fallback=Fetcher(),
+                                    record=True)
+        url = self.url + '/wiki/Page'
+        self.assertEqual(recorder.fetch(url), b'content of /wiki/Page')
+        self.assertTrue(os.path.isfile(recorder.path(url)))
+
+        offline = DirectoryFetcher(self.directory.name)
+        self.assertEqual(offline.fetch(url), b'content of /wiki/Page')
+        self.assertEqual(len(Handler.requests), 1)
+
+    def test_set_fetcher(self):
+        with open(os.path.join(self.directory.name, 'Elections'), 'wb') as f:
+            f.write(b'<table class="wikitable"><tr><td>1</td></tr></table>')
+        previous = get_fetcher()
+        set_fetcher(DirectoryFetcher(self.directory.name))
+        try:
+            tables = mapache.parseutils.tables_from_wiki(
+                'https://en.wikipedia.org/wiki/Elections')
+        finally:
+            set_fetcher(previous)
+        self.assertEqual(len(tables), 1)
+        self.assertIs(get_fetcher(), previous)
+
+        set_fetcher(None)
+        self.assertIsInstance(get_fetcher(), Fetcher)
+        set_fetcher(previous)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""mapache.matching tests."""
+
+import unittest
+
+import sys
+sys.path.append('../')
+import mapache
+from mapache.matching import NameIndex, ratio
+
+
+def _reference_ratio(str1, str2):
+    return mapache.Party._levenshtein_distance(None, str1, str2)['ratio']
+
+
+class TestNameIndex(unittest.TestCase):
+
+    names = ['Partido Popular', 'PP', 'Podemos', 'Unidos Podemos',
+             'Ciudadanos', "C's", 'PSOE', '']
+    queries = ['PP', 'Partido popular', 'Unidos-Podemos', 'Cs', 'psoe',
+               'Esquerra Republicana', '', 'P']
+
+    def test_same_ratio_as_levenshtein(self):
+        for name in self.names:
+            for query in self.queries:
+                self.assertEqual(ratio(name, query),
+                                 _reference_ratio(name, query))
+
+    def test_scores_by_owner(self):
+        owners = ['PP', 'PP', 'UP', 'UP', 'CS', 'CS', 'PSOE', 'PSOE']
+        index = NameIndex(self.names, owners)
+        self.assertEqual(index.owners, ['PP', 'UP', 'CS', 'PSOE'])
+        for query in self.queries:
+            expected = [max(_reference_ratio(n, query)
+                            for n, o in zip(self.names, owners) if o == owner)
+                        for owner in index.owners]
+            self.assertEqual(list(index.scores(query)), expected)
+
+    def test_best(self):
+        index = NameIndex(['Podemos', 'Partido Popular'], ['UP', 'PP'])
+        self.assertEqual(index.best('Partido Popular'), ('PP', 1.0))
+        self.assertEqual(index.best('xyz'), (None, 0))
+
+    def test_memo(self):
+        index = NameIndex(['Podemos'])
+        self.assertIs(index.scores('podemos'), index.scores('PODEMOS'))
+        # The memoized scores can not be changed
+        self.assertIsInstance(index.scores('podemos'), tuple)
+
+
+class TestPartySetMatch(unittest.TestCase):
+
+    def setUp(self):
+        self.parties = mapache.PartySet()
+        for name, short_name in [('Partido Popular', 'PP'),
+                                 ('Podemos', 'Podemos')]:
+            self.parties.add(mapache.Party(name, None, short_name=short_name,
+                                           lazy=True))
+
+    def test_extract(self):
+        self.assertIsNotNone(self.parties.match('Podemos'))
+        empty = self.parties.extract([])
+        self.assertIsNone(empty.match('Podemos'))
+        pp = self.parties.extract(['Partido Popular'])
+        self.assertIsNone(pp.match('Podemos'))
+        self.assertIs(pp.match('Partido Popular'), self.parties['PP'])
+
+    def test_names_changed(self):
+        podemos = self.parties['PODEMOS']
+        self.assertIsNone(self.parties.match('Unidas Podemos', 0.9))
+        podemos.extra_names.append('Unidas Podemos')
+        self.parties.add(podemos)
+        self.assertIs(self.parties.match('Unidas Podemos', 0.9), podemos)
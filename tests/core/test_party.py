@@ -1,11 +1,17 @@
 """mapache.Party tests."""
 
 import unittest
+import threading
+import os
+import tempfile
 from nose.tools import *
 
+from PIL import Image
+
 import sys
 sys.path.append('../')
 import mapache
+from mapache.synthetic import SyntheticParty
 
 img_url = 'https://github.com/cesans/mapache/raw/master/doc/source/mapache.png'
 class TestPartyNames(unittest.TestCase):
@@ -53,3 +59,150 @@ class TestMatch(unittest.TestCase):
 
 class TestCoallition(unittest.TestCase):
     pass
+
+
+class CountingParty(SyntheticParty):
+    """SyntheticParty with a solid blue logo that counts the downloads.
+
+    Unlike SyntheticParty, the color of a lazy party is computed from its
+    logo, as for a downloaded one.
+    """
+
+    def __init__(self, name, **kwargs):
+        kwargs.setdefault('lazy', False)
+        super().__init__(name, (0, 0, 200), **kwargs)
+        if self.lazy:
+            self.set_logo(None)
+
+    def _get_image(self, url):
+        self.downloads = getattr(self, 'downloads', 0) + 1
+        return super()._get_image(url)
+
+
+class TestLazy(unittest.TestCase):
+
+    def test_nothing_loaded(self):
+        party = CountingParty('name', lazy=True)
+        self.assertEqual(getattr(party, 'downloads', 0), 0)
+        self.assertEqual(party.match('name'), 1)
+
+    def test_loaded_once(self):
+        party = CountingParty('name', lazy=True)
+        threads = [threading.Thread(target=lambda: party.color)
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(party.downloads, 1)
+        self.assertEqual(party._thumbnail.size, (80, 40))
+        self.assertEqual(party.downloads, 1)
+
+    def test_same_as_eager(self):
+        lazy = CountingParty('name', lazy=True)
+        eager = CountingParty('name')
+        self.assertEqual(list(lazy.color), list(eager.color))
+        self.assertEqual(lazy._thumbnail.size, eager._thumbnail.size)
+
+    def test_no_logo(self):
+        party = CountingParty('name', lazy=True)
+        party._logo = None
+        self.assertIsNone(party._thumbnail)
+        self.assertEqual(getattr(party, 'downloads', 0), 0)
+
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'parties.zip')
+        self.parties = mapache.PartySet('test')
+        pp = CountingParty('Partido Popular', short_name='PP',
+                           extra_names=['Populares'])
+        psoe = CountingParty('PSOE')
+        coalition = CountingParty('Unidos Podemos')
+        coalition.add_to_coalition(CountingParty('Podemos'))
+        coalition.add_to_coalition(psoe)
+        for party in [pp, psoe, coalition]:
+            self.parties.add(party)
+        self.parties.save(self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        loaded = mapache.PartySet.load(self.path)
+        self.assertEqual(loaded.context_name, 'test')
+        self.assertEqual(list(loaded.keys()), list(self.parties.keys()))
+        for key in self.parties.keys():
+            party, other = loaded.parties[key], self.parties.parties[key]
+            self.assertEqual(party.get_all_names(), other.get_all_names())
+            self.assertEqual(list(party.color), list(other.color))
+            self.assertEqual(party._logo.size, other._logo.size)
+            self.assertEqual(party._thumbnail.size, other._thumbnail.size)
+
+        coalition = loaded.parties['UNI'].coalition
+        self.assertEqual([p.name for p in coalition], ['Podemos', 'PSOE'])
+        self.assertIs(coalition[1], loaded.parties['PSOE'])
+
+    def test_lazy_images(self):
+        loaded = mapache.PartySet.load(self.path)
+        party = loaded.parties['PP']
+        self.assertIsInstance(party._logo_value, mapache.storage.StoredImage)
+        self.assertEqual(party._logo.getpixel((0, 0)), (0, 0, 200))
+        self.assertIsInstance(party._thumbnail_value,
+                              mapache.storage.StoredImage)
+        loaded.save(self.path + '.copy')
+        self.assertIsInstance(party._thumbnail_value,
+                              mapache.storage.StoredImage)
+
+    def test_save_where_loaded(self):
+        loaded = mapache.PartySet.load(self.path)
+        loaded.save(self.path)
+        self.assertEqual(mapache.PartySet.load(self.path).keys(),
+                         loaded.keys())
+        loaded.extract(['PSOE', 'PP']).save(self.path)
+        party = loaded.parties['PSOE']
+        self.assertIsInstance(party._logo_value, mapache.storage.StoredImage)
+        self.assertEqual(party._logo.getpixel((0, 0)), (0, 0, 200))
+
+        again = mapache.PartySet.load(self.path)
+        self.assertEqual(sorted(again.keys()), ['PP', 'PSOE'])
+        self.assertEqual(again.parties['PP']._thumbnail.size,
+                         self.parties.parties['PP']._thumbnail.size)
+        self.assertEqual(os.listdir(self.directory.name), ['parties.zip'])
+
+    def test_match(self):
+        loaded = mapache.PartySet.load(self.path)
+        self.assertIsNotNone(loaded._index)
+        for name in ['populares', 'PSOE', 'Podemos unidos', 'nothing']:
+            self.assertEqual(getattr(loaded.match(name), 'name', None),
+                             getattr(self.parties.match(name), 'name', None))
+
+
+class TestColor(unittest.TestCase):
+
+    def setUp(self):
+        self.party = CountingParty('name', lazy=True)
+
+    def test_histogram_white_discarded(self):
+        img = Image.new('RGB', (240, 120), (255, 255, 255))
+        img.paste((0, 0, 200), (0, 0, 60, 60))
+        color = self.party._get_color(img, method='histogram')
+        self.assertEqual(list(color), [0, 0, 200 / 255.])
+
+    def test_histogram_transparent_discarded(self):
+        img = Image.new('RGBA', (240, 120), (200, 0, 0, 0))
+        img.paste((0, 200, 0, 255), (0, 0, 60, 60))
+        color = self.party._get_color(img, method='histogram')
+        self.assertEqual(list(color), [0, 200 / 255., 0])
+
+    def test_histogram_close_to_kmeans(self):
+        img = Image.new('RGB', (240, 120), (250, 250, 250))
+        img.paste((30, 90, 160), (0, 0, 200, 100))
+        img.paste((200, 20, 20), (200, 100, 240, 120))
+        kmeans = self.party._get_color(img, method='kmeans')
+        histogram = self.party._get_color(img, method='histogram')
+        for k, h in zip(kmeans, histogram):
+            self.assertAlmostEqual(k, h, places=2)
@@ -0,0 +1,315 @@
+"""mapache.Poll and mapache.PollsList tests."""
+
+import unittest
+import datetime
+import gc
+import os
+import pickle
+import tempfile
+import weakref
+
+import numpy as np
+
+import sys
+sys.path.append('../')
+import mapache
+from mapache.synthetic import SyntheticParty
+
+
+def create_polls():
+    polls = mapache.PollsList('test')
+    for day, pp, psoe in [(1, 30., 20.), (2, 31., 21.), (3, 29., 22.)]:
+        date = datetime.datetime(2016, 6, day)
+        polls.add(mapache.Poll({'Partido Popular': pp, 'PSOE': psoe}, date))
+    return polls
+
+
+class TestPollsListGetParty(unittest.TestCase):
+
+    def setUp(self):
+        self.pp = SyntheticParty('PP', (200, 0, 0),
+                                 full_name='Partido Popular')
+        self.psoe = SyntheticParty('PSOE', (200, 0, 0))
+        self.polls = create_polls()
+
+    def test_same_as_poll(self):
+        for party in [self.pp, self.psoe]:
+            expected = [(p.date, p.get_party(party))
+                        for p in self.polls.polls]
+            self.assertEqual(self.polls.get_party(party), expected)
+
+    def test_coalition(self):
+        coalition = SyntheticParty('Grand coalition', (200, 0, 0))
+        coalition.add_to_coalition(self.pp)
+        coalition.add_to_coalition(self.psoe)
+        votes = [v for _, v in self.polls.get_party(coalition)]
+        self.assertEqual(votes, [50., 52., 51.])
+
+    def test_new_columns(self):
+        up = SyntheticParty('Podemos', (200, 0, 0))
+        self.assertEqual(self.polls.get_party(up), [])
+        date = datetime.datetime(2016, 6, 4)
+        self.polls.add(mapache.Poll({'Unidos Podemos': 20.}, date,
+                                    'pollster'))
+        self.assertEqual(self.polls.get_party(up), [])
+        self.polls.add(mapache.Poll({'Podemos': 21.}, date, 'pollster'))
+        self.assertEqual(self.polls.get_party(up), [(date, 21.)])
+        self.assertEqual(self.polls.columns(),
+                         ['Partido Popular', 'PSOE', 'Unidos Podemos',
+                          'Podemos'])
+
+    def test_names_changed(self):
+        up = SyntheticParty('Podemos', (200, 0, 0))
+        date = datetime.datetime(2016, 6, 4)
+        self.polls.add(mapache.Poll({'Unidos Podemos': 20.}, date))
+        self.assertEqual(self.polls.get_party(up), [])
+        up.extra_names.append('Unidos Podemos')
+        self.assertEqual(self.polls.get_party(up), [(date, 20.)])
+
+    def test_parties_not_kept(self):
+        party = SyntheticParty('Podemos', (200, 0, 0))
+        self.polls.get_party(party)
+        ref = weakref.ref(party)
+        del party
+        # The party is in a reference cycle with its own name index
+        gc.collect()
+        self.assertIsNone(ref())
+
+
+class TestPollsFrame(unittest.TestCase):
+
+    def setUp(self):
+        self.pp = SyntheticParty('PP', (200, 0, 0),
+                                 full_name='Partido Popular')
+        self.psoe = SyntheticParty('PSOE', (200, 0, 0))
+        self.polls = create_polls()
+
+    def assertSameAsGetParty(self, party):
+        dates, votes = self.polls.get_party_array(party)
+        expected = self.polls.get_party(party)
+        self.assertEqual([d.astype(datetime.datetime) for d in dates],
+                         [d for d, _ in expected])
+        self.assertEqual(list(votes), [v for _, v in expected])
+
+    def test_get_party(self):
+        self.assertSameAsGetParty(self.pp)
+        self.assertSameAsGetParty(self.psoe)
+
+    def test_coalition(self):
+        coalition = SyntheticParty('Grand coalition', (200, 0, 0))
+        coalition.add_to_coalition(self.psoe)
+        coalition.add_to_coalition(self.pp)
+        self.polls.add(mapache.Poll({'Partido Popular': 30.},
+                                    datetime.datetime(2016, 6, 5)))
+        self.assertSameAsGetParty(coalition)
+
+    def test_poll_order(self):
+        up = SyntheticParty('UP', (200, 0, 0), full_name='Unidos Podemos',
+                            short_name='Podemos')
+        self.polls.add(mapache.Poll({'Podemos': 20., 'Unidos Podemos': 21.},
+                                    datetime.datetime(2016, 6, 4)))
+        self.polls.add(mapache.Poll({'Unidos Podemos': 22., 'Podemos': 23.},
+                                    datetime.datetime(2016, 6, 5)))
+        self.assertSameAsGetParty(up)
+        self.assertEqual(list(self.polls.get_party_array(up)[1]), [20., 22.])
+
+    def test_kept_in_sync(self):
+        frame = self.polls.frame()
+        self.assertEqual(frame.values.shape, (3, 2))
+        self.polls.add(mapache.Poll({'Podemos': 20., 'PSOE': 19.},
+                                    datetime.datetime(2016, 6, 4), 'X'))
+        self.assertIs(self.polls.frame(), frame)
+        self.assertEqual(frame.values.shape, (4, 3))
+        self.assertEqual(list(frame.column('Podemos')[-1:]), [20.])
+        self.assertEqual(frame.pollster_mask('X').sum(), 1)
+        self.assertSameAsGetParty(self.psoe)
+
+    def test_between(self):
+        frame = self.polls.frame().between(datetime.datetime(2016, 6, 2),
+                                           datetime.datetime(2016, 6, 3))
+        self.assertEqual(list(frame.column('PSOE')), [21., 22.])
+
+
+class TestCompactPoll(unittest.TestCase):
+
+    def setUp(self):
+        self.pp = SyntheticParty('PP', (200, 0, 0),
+                                 full_name='Partido Popular')
+        self.psoe = SyntheticParty('PSOE', (200, 0, 0))
+        self.polls = create_polls()
+        self.compact = mapache.PollsList('test', compact=True)
+        self.compact.add(self.polls)
+
+    def test_parties(self):
+        for poll, compact in zip(self.polls.polls, self.compact.polls):
+            self.assertIsInstance(compact, mapache.CompactPoll)
+            self.assertEqual(dict(compact.parties), poll.parties)
+            self.assertEqual(len(compact.parties), 2)
+            self.assertNotIn('Podemos', compact.parties)
+            self.assertFalse(hasattr(compact, '__dict__'))
+
+    def test_get_party(self):
+        coalition = SyntheticParty('Grand coalition', (200, 0, 0))
+        coalition.add_to_coalition(self.pp)
+        coalition.add_to_coalition(self.psoe)
+        for party in [self.pp, self.psoe, coalition]:
+            self.assertEqual(self.compact.get_party(party),
+                             self.polls.get_party(party))
+            for poll, compact in zip(self.polls.polls, self.compact.polls):
+                self.assertEqual(compact.get_party(party),
+                                 poll.get_party(party))
+
+    def test_shared_schema(self):
+        date = datetime.datetime(2016, 6, 4)
+        self.compact.add(mapache.Poll({'Podemos': 21.}, date))
+        first, last = self.compact.polls[0], self.compact.polls[-1]
+        self.assertIs(first._schema, last._schema)
+        self.assertEqual(dict(last.parties), {'Podemos': 21.})
+        self.assertEqual(self.compact.columns(),
+                         ['Partido Popular', 'PSOE', 'Podemos'])
+        np.testing.assert_array_equal(self.compact.frame().values[:3, :2],
+                                      self.polls.frame().values)
+
+    def test_pickle(self):
+        polls = pickle.loads(pickle.dumps(self.compact))
+        self.assertEqual([dict(p.parties) for p in polls.polls],
+                         [p.parties for p in self.polls.polls])
+        self.assertIs(polls.polls[0]._schema, polls.polls[1]._schema)
+
+
+class TestSaveLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'polls.mapache')
+        self.polls = create_polls()
+        self.polls.polls[0].pollster = 'A'
+        self.polls.polls[1].error = 3.
+        self.polls.add(mapache.Poll({'Podemos': 20.5}, datetime.datetime(
+            2016, 6, 4, 12, 30, 15, 250), 'B'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assertSamePolls(self, polls, expected):
+        self.assertEqual(len(polls.polls), len(expected.polls))
+        for poll, other in zip(polls.polls, expected.polls):
+            self.assertEqual(type(poll.date), type(other.date))
+            self.assertEqual((poll.date, poll.pollster, poll.error),
+                             (other.date, other.pollster, other.error))
+            self.assertEqual(list(poll.parties.items()),
+                             list(other.parties.items()))
+
+    def test_round_trip(self):
+        self.polls.save(self.path)
+        for mmap in [True, False]:
+            polls = mapache.PollsList.load(self.path, mmap=mmap)
+            self.assertEqual(polls._name, 'test')
+            self.assertEqual(polls.columns(), self.polls.columns())
+            self.assertSamePolls(polls, self.polls)
+
+    def test_dates(self):
+        polls = mapache.PollsList('dates', compact=True)
+        polls.add(mapache.Poll({'PP': 30.}, datetime.date(2016, 6, 1)))
+        polls.save(self.path)
+        loaded = mapache.PollsList.load(self.path)
+        self.assertTrue(loaded.compact)
+        self.assertSamePolls(loaded, polls)
+
+    def test_lazy(self):
+        self.polls.save(self.path)
+        polls = mapache.PollsList.load(self.path)
+        pp = SyntheticParty('PP', (200, 0, 0), full_name='Partido Popular')
+        dates, votes = polls.get_party_array(pp)
+        self.assertIsNone(polls._polls)
+        np.testing.assert_array_equal(votes, [30., 31., 29.])
+
+        # Polls can be added to a memory-mapped list
+        polls.add(mapache.Poll({'PSOE': 10.}, datetime.datetime(2016, 7, 1)))
+        self.assertEqual(len(polls.polls), 5)
+        self.assertEqual(polls.frame().values.shape, (5, 3))
+
+    def test_parties_order(self):
+        polls = mapache.PollsList()
+        polls.add(mapache.Poll({'PP': 30., 'PSOE': 20.},
+                               datetime.datetime(2016, 6, 1)))
+        polls.add(mapache.Poll({'PSOE': 21., 'Podemos': 15., 'PP': 31.},
+                               datetime.datetime(2016, 6, 2)))
+        polls.save(self.path)
+        loaded = mapache.PollsList.load(self.path)
+        self.assertEqual([list(p.parties) for p in loaded.polls],
+                         [['PP', 'PSOE'], ['PSOE', 'Podemos', 'PP']])
+
+    def test_errors(self):
+        # Unknown errors are None, known ones floats
+        for error, expected in [('', None), (None, None), (2, 2.)]:
+            polls = mapache.PollsList()
+            polls.add(mapache.Poll({'PP': 30.}, datetime.datetime(2016, 6, 1),
+                                   error=error))
+            polls.save(self.path)
+            error = mapache.PollsList.load(self.path).polls[0].error
+            self.assertEqual(error, expected)
+            self.assertEqual(type(error), type(expected))
+
+    def test_lazy_pollsters(self):
+        self.polls.save(self.path)
+        frame = mapache.PollsList.load(self.path).frame()
+        self.assertIsNone(frame._pollsters)
+        self.assertEqual(list(frame.pollster_mask('B')),
+                         [False, False, False, True])
+        self.assertEqual(list(frame.select([0, 3]).pollsters), ['A', 'B'])
+        self.assertIsNone(frame._pollsters)
+        self.assertEqual(list(frame.pollsters), ['A', '', '', 'B'])
+
+    def test_save_where_loaded(self):
+        self.polls.save(self.path)
+        polls = mapache.PollsList.load(self.path)
+        polls.add(mapache.Poll({'PSOE': 10.}, datetime.datetime(2016, 7, 1)))
+        polls.save(self.path)
+        self.assertSamePolls(mapache.PollsList.load(self.path), polls)
+
+        # Memory-mapped, without copying the arrays
+        loaded = mapache.PollsList.load(self.path)
+        loaded.save(self.path)
+        self.assertSamePolls(loaded, polls)
+        self.assertEqual(os.listdir(self.directory.name), ['polls.mapache'])
+
+    def test_not_a_polls_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not polls')
+        self.assertRaises(ValueError, mapache.PollsList.load, self.path)
+
+
+class TestDateIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.polls = mapache.PollsList('test')
+        for day in [5, 1, 3, 3, 8]:
+            self.polls.add(mapache.Poll({'PP': float(day)},
+                                        datetime.datetime(2016, 6, day)))
+
+    def days(self, polls):
+        return [p.date.day for p in polls]
+
+    def test_first_last(self):
+        self.assertEqual(self.polls.first().date.day, 1)
+        self.assertEqual(self.polls.last().date.day, 8)
+        self.assertIsNone(mapache.PollsList().first())
+
+    def test_between(self):
+        between = self.polls.between(datetime.datetime(2016, 6, 3),
+                                     datetime.datetime(2016, 6, 5))
+        self.assertEqual(self.days(between.polls), [3, 3, 5])
+        self.assertEqual(list(self.polls.date_slice(end='2016-06-02')), [1])
+        self.assertEqual(len(self.polls.date_slice('2016-06-06',
+                                                   '2016-06-07')), 0)
+
+    def test_incremental(self):
+        self.polls.dates()
+        for day in [9, 2, 10, 3]:
+            self.polls.add(mapache.Poll({'PP': float(day)},
+                                        datetime.datetime(2016, 6, day)))
+        days = self.days(self.polls.polls)
+        expected = sorted(range(len(days)), key=lambda i: days[i])
+        self.assertEqual(list(self.polls.date_slice()), expected)
+        self.assertEqual(self.polls.last().date.day, 10)
@@ -0,0 +1,109 @@
+"""mapache.profiling tests."""
+
+import unittest
+
+import sys
+sys.path.append('../')
+import mapache
+from mapache import profiling
+
+
+@profiling.timed('test')
+def work(n=1000):
+    return sum(range(n))
+
+
+@profiling.timed('test')
+def nested():
+    return work() + work()
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        profiling.reset()
+
+    def tearDown(self):
+        profiling.disable()
+        profiling.reset()
+
+    def test_disabled(self):
+        self.assertFalse(profiling.is_enabled())
+        self.assertEqual(work(10), 45)
+        profiling.hit('test')
+        self.assertEqual(profiling.snapshot(), {})
+
+    def test_profile(self):
+        with profiling.profile() as stats:
+            for _ in range(20):
+                work()
+            profiling.hit('test')
+            profiling.miss('test')
+            profiling.miss('test')
+        self.assertFalse(profiling.is_enabled())
+
+        work()
+        stage = stats.snapshot()['test']
+        self.assertEqual(stage['calls'], 20)
+        self.assertEqual(stage['hits'], 1)
+        self.assertEqual(stage['misses'], 2)
+        self.assertAlmostEqual(stage['hit_rate'], 1 / 3.)
+        self.assertGreater(stage['total'], 0)
+        self.assertLessEqual(stage['p50'], stage['p90'])
+        self.assertLessEqual(stage['p99'], stage['max'])
+        self.assertIn('test', stats.report())
+
+    def test_reset(self):
+        profiling.enable()
+        work()
+        with profiling.profile() as stats:
+            work()
+        # The previous state is restored
+        self.assertTrue(profiling.is_enabled())
+        self.assertEqual(stats.snapshot()['test']['calls'], 1)
+
+    def test_nested_calls(self):
+        with profiling.profile() as stats:
+            nested()
+        self.assertEqual(stats.snapshot()['test']['calls'], 1)
+
+    def test_hooks(self):
+        events = []
+
+        def hook(stage, kind, value):
+            events.append((stage, kind))
+
+        with profiling.profile(hooks=[hook]):
+            work()
+            profiling.hit('cache')
+        work()
+        self.assertEqual(events, [('test', 'time'), ('cache', 'hit')])
+
+    def test_sampling(self):
+        max_samples = profiling.max_samples
+        profiling.max_samples = 10
+        try:
+            with profiling.profile() as stats:
+                for i in range(100):
+                    profiling.record('test', i)
+        finally:
+            profiling.max_samples = max_samples
+        stage = stats.snapshot()['test']
+        self.assertEqual(stage['calls'], 100)
+        self.assertEqual(stage['max'], 99)
+        self.assertEqual(stage['total'], sum(range(100)))
+
+    def test_match(self):
+        parties = mapache.PartySet()
+        parties.add(mapache.Party('Partido Popular', None, short_name='PP',
+                                  lazy=True))
+        with profiling.profile() as stats:
+            parties.match('Partido Popular')
+            parties.match('partido popular')
+        match = stats.snapshot()['match']
+        self.assertEqual(match['calls'], 2)
+        self.assertEqual((match['hits'], match['misses']), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""mapache.seats tests."""
+
+import unittest
+import datetime
+
+import numpy as np
+
+import sys
+sys.path.append('../')
+import mapache
+from mapache.synthetic import SyntheticParty
+from mapache.aggregate import PollAverage
+from mapache.seats import allocate, simulate, District
+
+
+
+def allocate_loop(votes, seats, divisor):
+    """One seat at a time, for reference."""
+    result = np.zeros(len(votes), dtype=int)
+    for _ in range(seats):
+        result[np.argmax(votes / divisor(result))] += 1
+    return result
+
+
+class TestAllocate(unittest.TestCase):
+
+    def test_example(self):
+        votes = np.array([100000., 80000., 30000., 20000.])
+        np.testing.assert_array_equal(allocate(votes, 8), [4, 3, 1, 0])
+        np.testing.assert_array_equal(allocate(votes, 8, 'sainte-lague'),
+                                      [3, 3, 1, 1])
+
+    def test_same_as_loop(self):
+        votes = np.random.RandomState(0).rand(50, 4, 5) * 100
+        for method, divisor in [('dhondt', lambda s: s + 1.),
+                                ('sainte-lague', lambda s: 2. * s + 1.)]:
+            for seats in [1, 4, 12]:
+                expected = [[allocate_loop(v, seats, divisor) for v in row]
+                            for row in votes]
+                np.testing.assert_array_equal(
+                    allocate(votes, seats, method), expected)
+
+    def test_threshold(self):
+        votes = np.array([50., 45., 4.])
+        self.assertEqual(allocate(votes, 20, threshold=5.)[2], 0)
+
+
+class TestSimulate(unittest.TestCase):
+
+    def setUp(self):
+        self.parties = mapache.PartySet()
+        for name in ['PP', 'PSOE', 'Podemos']:
+            self.parties.add(SyntheticParty(name, (200, 0, 0)))
+        self.poll = mapache.Poll({'PP': 35., 'PSOE': 25., 'Podemos': 20.},
+                                 datetime.datetime(2016, 6, 1), 'pollster',
+                                 2.)
+        self.districts = [District('A', 10), District('B', 5),
+                          District('C', 5, {'Podemos': 2.})]
+
+    def test_seats(self):
+        projection = simulate(self.poll, self.parties, self.districts,
+                              n=2000, seed=0)
+        self.assertEqual(projection.seats.shape, (2000, 3))
+        self.assertTrue((projection.seats.sum(axis=1) == 20).all())
+        pp, podemos = self.parties['PP'], self.parties['PODEMOS']
+        self.assertGreater(projection.mean()[0], projection.mean()[2])
+        distribution = projection.distribution([pp, podemos])
+        self.assertAlmostEqual(distribution.sum(), 1.)
+        self.assertEqual(projection.probability([pp, podemos], 0), 1.)
+
+    def test_reproducible(self):
+        kwargs = {'n': 3000, 'seed': 42, 'chunk_size': 1000}
+        serial = simulate(self.poll, self.parties, self.districts,
+                          processes=1, **kwargs)
+        parallel = simulate(self.poll, self.parties, self.districts,
+                            processes=2, **kwargs)
+        np.testing.assert_array_equal(serial.seats, parallel.seats)
+
+    def test_no_error(self):
+        projection = simulate(self.poll, self.parties, 10, n=10, error=1e-9,
+                              seed=0)
+        np.testing.assert_array_equal(projection.seats,
+                                      [allocate(projection.shares, 10)] * 10)
+
+    def test_poll_average(self):
+        polls = mapache.PollsList()
+        polls.add(self.poll)
+        average = PollAverage(polls, self.parties)
+        projection = simulate(average, self.parties, self.districts, n=100,
+                              seed=0)
+        np.testing.assert_allclose(projection.shares, [35., 25., 20.])
+        from_list = simulate(polls, self.parties, self.districts, n=100,
+                             seed=0)
+        np.testing.assert_array_equal(projection.seats, from_list.seats)
+
+    def test_poll_average_parties(self):
+        polls = mapache.PollsList()
+        polls.add(self.poll)
+        pp, psoe, podemos = [self.parties[name]
+                             for name in ['PP', 'PSOE', 'PODEMOS']]
+        average = PollAverage(polls, [psoe, pp])
+        projection = simulate(average, [pp, psoe], 10, n=10, seed=0)
+        np.testing.assert_allclose(projection.shares, [35., 25.])
+        projection = simulate(average, [pp], 10, n=10, seed=0)
+        np.testing.assert_allclose(projection.shares, [35.])
+        with self.assertRaises(ValueError):
+            simulate(average, [pp, podemos], 10, n=10)
+
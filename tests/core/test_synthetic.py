@@ -0,0 +1,106 @@
+"""mapache.synthetic tests."""
+
+import unittest
+
+import numpy as np
+
+import sys
+sys.path.append('../')
+import mapache
+from mapache import synthetic
+
+
+class TestParties(unittest.TestCase):
+
+    def setUp(self):
+        self.parties = synthetic.create_parties(8, n_coalitions=2, seed=0)
+
+    def test_parties(self):
+        parties = list(self.parties.parties.values())
+        self.assertEqual(len(parties), 10)
+        self.assertEqual(len(set(p.short_name for p in parties)), 10)
+        coalitions = [p for p in parties if p.coalition]
+        self.assertEqual(len(coalitions), 2)
+        for coalition in coalitions:
+            for member in coalition.coalition:
+                self.assertIn(member, parties)
+
+    def test_logo(self):
+        party = list(self.parties.parties.values())[0]
+        self.assertEqual(party._logo.getpixel((0, 0)), party.rgb)
+        np.testing.assert_allclose(party.color, np.array(party.rgb) / 255.)
+
+    def test_name_variants(self):
+        for party in self.parties.parties.values():
+            for name in synthetic.name_variants(party):
+                self.assertIs(self.parties.match(name), party)
+
+    def test_seed(self):
+        other = synthetic.create_parties(8, n_coalitions=2, seed=0)
+        self.assertEqual(list(self.parties.keys()), list(other.keys()))
+
+    def test_too_many_coalitions(self):
+        with self.assertRaises(ValueError):
+            synthetic.create_parties(3, n_coalitions=2)
+
+
+class TestPolls(unittest.TestCase):
+
+    def setUp(self):
+        self.parties = synthetic.create_parties(8, n_coalitions=2, seed=0)
+
+    def test_polls(self):
+        polls = synthetic.create_polls(self.parties, 500, seed=0)
+        self.assertEqual(len(polls.polls), 500)
+        dates = polls.frame().dates
+        self.assertTrue((dates[1:] >= dates[:-1]).all())
+        for poll in polls.polls[:20]:
+            self.assertIsInstance(poll, mapache.Poll)
+            total = sum(poll.parties.values())
+            self.assertLess(total, 110)
+
+    def test_every_party_found(self):
+        polls = synthetic.create_polls(self.parties, 500, seed=0)
+        members = [m for p in self.parties.parties.values()
+                   for m in p.coalition or []]
+        for party in self.parties.parties.values():
+            dates, votes = polls.get_party_array(party)
+            # Members are not in the polls that report their coalition
+            self.assertGreater(len(votes), 0 if party in members else 400)
+            self.assertEqual(len(polls.get_party(party)), len(votes))
+
+    def test_coalitions(self):
+        polls = synthetic.create_polls(self.parties, 500, seed=0,
+                                       coalition_ratio=0.5)
+        coalition = [p for p in self.parties.parties.values()
+                     if p.coalition][0]
+        alone = polls.get_party_array(coalition, join_coalitions=False)[1]
+        joined = polls.get_party_array(coalition)[1]
+        self.assertGreater(len(alone), 0)
+        self.assertGreater(len(joined), len(alone))
+
+    def test_seed(self):
+        first = synthetic.create_polls(self.parties, 100, seed=1).frame()
+        second = synthetic.create_polls(self.parties, 100, seed=1).frame()
+        np.testing.assert_array_equal(first.values, second.values)
+        np.testing.assert_array_equal(first.errors, second.errors)
+
+    def test_chunks(self):
+        frames = list(synthetic.iter_frames(self.parties, 2500,
+                                            chunk_size=1000, seed=0))
+        self.assertEqual([len(f) for f in frames], [1000, 1000, 500])
+        self.assertEqual(frames[0].columns, frames[-1].columns)
+        self.assertLessEqual(frames[0].dates[-1], frames[1].dates[0])
+
+    def test_compact(self):
+        polls = synthetic.create_polls(self.parties, 50, seed=0,
+                                       compact=True)
+        self.assertIsInstance(polls.polls[0], mapache.CompactPoll)
+
+    def test_empty(self):
+        polls = synthetic.create_polls(self.parties, 0)
+        self.assertEqual(polls.polls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
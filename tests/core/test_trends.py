@@ -0,0 +1,88 @@
+"""mapache.trends tests."""
+
+import unittest
+
+import numpy as np
+
+import sys
+sys.path.append('../')
+from mapache import trends
+
+
+def create_series(n=120, seed=0):
+    random_state = np.random.RandomState(seed)
+    days = np.arange(n) * 3.
+    truth = np.column_stack([30 + 3 * np.sin(days / 60.), 20 + 0 * days])
+    votes = truth + random_state.randn(n, 2)
+    votes[random_state.rand(n) < 0.2, 1] = np.nan
+    dates = trends.from_days(days + 16000)
+    return dates, votes, truth
+
+
+class TestSmoothers(unittest.TestCase):
+
+    def test_days(self):
+        dates, _, _ = create_series()
+        np.testing.assert_array_equal(trends.from_days(trends.to_days(dates)),
+                                      dates)
+
+    def test_close_to_truth(self):
+        dates, votes, truth = create_series()
+        for smoother in ['gp', 'kernel']:
+            grid, trend = trends.smooth(dates, votes, smoother,
+                                        n_points=len(dates))
+            np.testing.assert_array_equal(grid, dates)
+            self.assertLess(np.nanmax(np.abs(trend - truth)), 1.5)
+
+    def test_range_of_each_party(self):
+        dates, votes, _ = create_series()
+        votes[:30, 1] = np.nan
+        grid, trend = trends.smooth(dates, votes, 'kernel',
+                                    n_points=len(dates))
+        self.assertTrue(np.isnan(trend[:30, 1]).all())
+        self.assertFalse(np.isnan(trend[30:, 1]).any())
+        self.assertFalse(np.isnan(trend[:, 0]).any())
+
+    def test_cached(self):
+        dates, votes, _ = create_series()
+        first = trends.smooth(dates, votes, trends.GPSmoother(30.))
+        self.assertIs(trends.smooth(dates, votes, trends.GPSmoother(30.)),
+                      first)
+        self.assertIsNot(trends.smooth(dates, votes, trends.GPSmoother(20.)),
+                         first)
+
+
+class TestUpdate(unittest.TestCase):
+
+    def test_kernel_same_as_full_fit(self):
+        dates, votes, _ = create_series()
+        fitted = trends.fit(dates[:100], votes[:100], 'kernel')
+        updated, changed = trends.update(fitted, dates, votes, 'kernel')
+        full = trends.KernelSmoother(fitted.bandwidth).fit(
+            trends.to_days(dates), votes,
+            trends.daily_grid(trends.to_days(dates)))
+        np.testing.assert_array_equal(updated.grid, full.grid)
+        np.testing.assert_allclose(updated.trend, full.trend, atol=1e-9)
+        np.testing.assert_array_equal(changed, [0, 1])
+
+    def test_fit_not_updated(self):
+        dates, votes, _ = create_series()
+        fitted = trends.fit(dates[:100], votes[:100], 'kernel')
+        updated, _ = trends.update(fitted, dates, votes, 'kernel')
+        full = trends.fit(dates, votes, 'kernel')
+        self.assertIsNot(full, updated)
+        # The default bandwidth depends on all the polls
+        self.assertGreater(full.bandwidth, updated.bandwidth)
+
+    def test_gp_only_changed_parties(self):
+        dates, votes, _ = create_series()
+        votes[100:, 1] = np.nan
+        fitted = trends.fit(dates[:100], votes[:100], 'gp')
+        updated, changed = trends.update(fitted, dates, votes, 'gp')
+        np.testing.assert_array_equal(changed, [0])
+        full = trends.fit(dates, votes, trends.GPSmoother(
+            fitted.length_scale, fitted.noise))
+        self.assertLess(np.nanmax(np.abs(updated.trend - full.trend)), 0.1)
+        # The trend of the second party ends at its last poll
+        last = int(trends.to_days(dates[99]) - updated.grid[0])
+        self.assertTrue(np.isnan(updated.trend[last + 1:, 1]).all())
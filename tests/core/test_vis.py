@@ -0,0 +1,133 @@
+"""mapache.vis tests."""
+
+import unittest
+import datetime
+import os
+import tempfile
+import warnings
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pylab as plt
+import numpy as np
+
+import sys
+sys.path.append('../')
+import mapache
+from mapache.synthetic import SyntheticParty
+
+from tests.core.test_polls import create_polls
+
+
+class TestRenderBars(unittest.TestCase):
+
+    def setUp(self):
+        self.parties = mapache.PartySet()
+        self.parties.add(SyntheticParty('PP', (200, 0, 0),
+                                        full_name='Partido Popular'))
+        self.parties.add(SyntheticParty('PSOE', (200, 0, 0)))
+        self.polls = create_polls()
+
+    def test_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filenames = mapache.vis.render_bars(
+                self.polls, self.parties, directory,
+                'poll-{date:%Y%m%d}.svg', processes=1)
+            self.assertEqual([os.path.basename(f) for f in filenames],
+                             ['poll-20160601.svg', 'poll-20160602.svg',
+                              'poll-20160603.svg'])
+            for filename in filenames:
+                self.assertTrue(os.path.getsize(filename) > 0)
+
+    def test_rcparams_unchanged(self):
+        rcparams = dict(matplotlib.rcParams)
+        mapache.vis.SingleBars(self.polls.polls[0], self.parties)
+        self.assertEqual(dict(matplotlib.rcParams), rcparams)
+
+
+class TestTimeSeriesExport(unittest.TestCase):
+
+    def setUp(self):
+        parties = mapache.PartySet()
+        parties.add(SyntheticParty('PP', (200, 0, 0),
+                                   full_name='Partido Popular'))
+        parties.add(SyntheticParty('PSOE', (200, 0, 0)))
+        self.ts = mapache.vis.TimeSeries(parties, smoother='kernel')
+        self.ts.add_column(create_polls())
+
+    def test_formats(self):
+        figures = plt.get_fignums()
+        with tempfile.TemporaryDirectory() as directory:
+            for extension in ['png', 'svg', 'pdf']:
+                filename = os.path.join(directory, 'polls.' + extension)
+                self.ts.export(filename)
+                self.assertTrue(os.path.getsize(filename) > 0)
+        self.assertEqual(plt.get_fignums(), figures)
+
+    def test_buffer(self):
+        self.assertTrue(self.ts.export().startswith(b'\x89PNG'))
+        self.assertTrue(self.ts.export(format='svg').startswith(b'<?xml'))
+
+    def test_single_poll_column(self):
+        elections = mapache.PollsList('elections')
+        elections.add(create_polls().polls[-1])
+        self.ts.add_column(elections)
+        self.assertTrue(self.ts.export().startswith(b'\x89PNG'))
+
+
+class TestTimeSeriesAddPolls(unittest.TestCase):
+
+    def setUp(self):
+        parties = mapache.PartySet()
+        parties.add(SyntheticParty('PP', (200, 0, 0),
+                                   full_name='Partido Popular'))
+        parties.add(SyntheticParty('PSOE', (200, 0, 0)))
+        self.ts = mapache.vis.TimeSeries(parties, smoother='kernel')
+        self.ts.add_column(create_polls())
+        with warnings.catch_warnings():
+            # Agg can not show figures
+            warnings.simplefilter('ignore')
+            self.ts.show()
+        self.state = self.ts._TimeSeries__states[-1]
+
+    def tearDown(self):
+        plt.close('all')
+
+    def points(self):
+        offsets = self.state['scatter'].get_offsets()
+        return [(matplotlib.dates.num2date(x).date(), y) for x, y in offsets]
+
+    def days(self, line):
+        days = line.get_xdata()
+        return days[0].date(), days[-1].date()
+
+    def test_in_range(self):
+        self.ts.add_polls(mapache.Poll({'PP': 32., 'PSOE': 19.},
+                                       datetime.datetime(2016, 6, 5)))
+        self.assertEqual(self.state['n'], 4)
+        self.assertEqual(len(self.points()), 8)
+        self.assertIn((datetime.date(2016, 6, 5), 32.), self.points())
+        self.assertEqual(self.days(self.state['lines'][0]),
+                         (datetime.date(2016, 6, 1),
+                          datetime.date(2016, 6, 5)))
+
+    def test_backdated(self):
+        self.ts.add_polls(mapache.Poll({'PP': 28.},
+                                       datetime.datetime(2016, 5, 20)))
+        self.assertEqual(self.state['n'], 4)
+        self.assertIn((datetime.date(2016, 5, 20), 28.), self.points())
+        self.assertEqual(self.days(self.state['lines'][0])[0],
+                         datetime.date(2016, 5, 20))
+        # The trend of the other party starts at its first poll
+        line = self.state['lines'][1]
+        first = np.flatnonzero(~np.isnan(line.get_ydata()))[0]
+        self.assertEqual(line.get_xdata()[first].date(),
+                         datetime.date(2016, 6, 1))
+
+    def test_no_party(self):
+        points = self.points()
+        self.ts.add_polls(mapache.Poll({'Podemos': 15.},
+                                       datetime.datetime(2016, 6, 5)))
+        self.assertEqual(self.state['n'], 4)
+        self.assertEqual(self.points(), points)
+        self.assertTrue(self.ts.export().startswith(b'\x89PNG'))
@@ -0,0 +1,85 @@
+"""mapache.parseutils.DateParser tests."""
+
+import unittest
+import datetime
+
+from dateutil.parser import parse
+
+import sys
+sys.path.append('../')
+from mapache.parseutils import DateParser
+
+
+def day(month, d, year=2016):
+    return datetime.datetime(year, month, d)
+
+
+class TestDateParser(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = DateParser(default=day(1, 1))
+
+    def test_same_as_dateutil(self):
+        for text in ['12 Jun 2016', '3 June 2016', '2016-06-12', 'Jun 5',
+                     'June 5, 2016']:
+            self.assertEqual(self.parser.parse(text),
+                             parse(text, default=day(1, 1)))
+
+    def test_format_learnt(self):
+        self.parser.parse('12 Jun 2016')
+        self.assertEqual(self.parser.format, '%d %b %Y')
+        # Other formats still work
+        self.assertEqual(self.parser.parse('2016-06-13'), day(6, 13))
+
+    def test_ranges(self):
+        self.assertEqual(self.parser.parse_range('12–15 Jun 2016'),
+                         (day(6, 12), day(6, 15)))
+        self.assertEqual(self.parser.parse_range('12-15 Jun 2016'),
+                         (day(6, 12), day(6, 15)))
+        self.assertEqual(self.parser.parse_range('28 May – 3 Jun 2016'),
+                         (day(5, 28), day(6, 3)))
+        self.assertEqual(self.parser.parse_range('Jun 3–5, 2016'),
+                         (day(6, 3), day(6, 5)))
+        self.assertEqual(self.parser.parse_range('28 Dec – 3 Jan 2017'),
+                         (day(12, 28), day(1, 3, 2017)))
+        self.assertEqual(self.parser.parse('12–15 Jun 2016'),
+                         day(6, 15))
+
+    def test_day_ranges_across_months(self):
+        self.assertEqual(self.parser.parse_range('30–2 Jul 2016'),
+                         (day(6, 30), day(7, 2)))
+        # June has no 31st
+        self.assertEqual(self.parser.parse_range('31–2 Jun 2016'),
+                         (day(5, 31), day(6, 2)))
+        self.assertEqual(self.parser.parse_range('31–2 Jul 2016'),
+                         (day(6, 30), day(7, 2)))
+        self.assertEqual(self.parser.parse_range('30–2 Jan 2017'),
+                         (day(12, 30), day(1, 2, 2017)))
+        # Month first
+        self.assertEqual(self.parser.parse_range('Jun 30-2, 2016'),
+                         (day(6, 30), day(7, 2)))
+        self.assertEqual(self.parser.parse_range('Dec 30–2, 2016'),
+                         (day(12, 30), day(1, 2, 2017)))
+        self.assertEqual(self.parser.parse_range('Jun 3–5, 2016'),
+                         (day(6, 3), day(6, 5)))
+
+    def test_numeric_dates(self):
+        # Not ranges
+        self.assertEqual(self.parser.parse_range('12-06-2016'),
+                         (parse('12-06-2016'),) * 2)
+        for text in ['5/6/2016', '13/6/2016', '5.6.2016']:
+            parser = DateParser(default=day(1, 1))
+            parser.parse('12 Jun 2016')
+            self.assertEqual(parser.parse(text), parse(text))
+            # Also when the format is learnt from them
+            parser = DateParser(default=day(1, 1))
+            self.assertEqual(parser.parse(text), parse(text))
+
+    def test_notes_removed(self):
+        self.assertEqual(self.parser.parse('12 Jun 2016[a]'), day(6, 12))
+
+    def test_memo_bounded(self):
+        parser = DateParser(maxsize=2)
+        for d in range(1, 6):
+            parser.parse('{0} Jun 2016'.format(d))
+        self.assertEqual(len(parser._memo), 2)
@@ -0,0 +1,145 @@
+"""mapache.parseutils table parsing tests."""
+
+import unittest
+import datetime
+import io
+import os
+import tempfile
+
+import numpy as np
+
+from bs4 import BeautifulSoup
+
+import sys
+sys.path.append('../')
+import mapache
+from mapache.parseutils import poll_from_table, iter_polls_from_html
+
+header = """<tr><th>Pollster</th><th>Date</th>
+<th><a href="/wiki/PP" title="Partido Popular">PP</a></th>
+<th><a href="/wiki/PSOE" title="PSOE">PSOE</a></th>
+<th><a href="/wiki/UP" title="Unidos Podemos">UP</a></th>
+<th>Lead</th><th>Error</th><th>Sample</th></tr>
+<tr><td colspan="8">Subheader</td></tr>"""
+
+row = """<tr><td>{pollster}</td><td>{day} Jun 2016</td><td>{pp}</td>
+<td>{psoe}</td><td>{up}</td><td>{lead}</td><td>&#177;{error} %</td>
+<td>1000</td></tr>"""
+
+
+def create_page(rows=50):
+    body = [header]
+    for i in range(rows):
+        body.append(row.format(pollster='Pollster {0}'.format(i % 3),
+                               day=i % 28 + 1, pp=30 + i % 5,
+                               psoe=20 + i % 4, up='' if i % 7 else 21.5,
+                               lead=10, error=2.5 + i % 2))
+    return ('<html><body><table class="infobox"><tr><td>x</td></tr></table>'
+            '<table class="wikitable">' + ''.join(body) + '</table>'
+            '<table class="wikitable"><tr><td>other</td></tr></table>'
+            '</body></html>')
+
+
+def as_tuples(polls):
+    return [(p.date, p.pollster, p.error, p.parties) for p in polls]
+
+
+class TestStreamingParser(unittest.TestCase):
+
+    kwargs = {'date_column': 1, 'party_columns': (2, 5), 'error_column': 6,
+              'pollster_column': 0}
+
+    def setUp(self):
+        self.page = create_page()
+        table = BeautifulSoup(self.page, 'html.parser').findAll(
+            'table', class_='wikitable')[0]
+        self.expected = as_tuples(poll_from_table(table, **self.kwargs).polls)
+
+    def test_same_as_poll_from_table(self):
+        self.assertEqual(len(self.expected), 50)
+        polls = iter_polls_from_html(self.page, html=True, **self.kwargs)
+        self.assertEqual(as_tuples(polls), self.expected)
+
+    def test_small_chunks(self):
+        source = io.BytesIO(self.page.encode('utf8'))
+        polls = iter_polls_from_html(source, chunk_size=7, **self.kwargs)
+        self.assertEqual(as_tuples(polls), self.expected)
+
+    def test_file_name(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'polls.html')
+            with open(path, 'w', encoding='utf8') as f:
+                f.write(self.page)
+            polls = iter_polls_from_html(path, **self.kwargs)
+            self.assertEqual(as_tuples(polls), self.expected)
+        # Without html=True the html is taken as a file name
+        with self.assertRaises(OSError):
+            list(iter_polls_from_html(self.page, **self.kwargs))
+
+    def test_nested_table(self):
+        nested = ('<td><table><tr><td>500</td><td>500</td></tr></table>'
+                  '</td>')
+        page = self.page.replace('<td>1000</td>', nested, 1)
+        polls = iter_polls_from_html(page, html=True, **self.kwargs)
+        # The nested rows are not rows of the table
+        self.assertEqual(as_tuples(polls), self.expected)
+
+    def test_poll_rows(self):
+        polls = iter_polls_from_html(self.page, poll_rows=(4, -3), html=True,
+                                     **self.kwargs)
+        self.assertEqual(as_tuples(polls), self.expected[2:-3])
+        polls = iter_polls_from_html(self.page, poll_rows=(2, 10), html=True,
+                                     **self.kwargs)
+        self.assertEqual(as_tuples(polls), self.expected[:8])
+
+    def test_party_names(self):
+        poll = next(iter_polls_from_html(self.page, html=True,
+                                         **self.kwargs))
+        self.assertEqual(list(poll.parties),
+                         ['Partido Popular', 'PSOE', 'Unidos Podemos'])
+
+
+class TestBlankError(unittest.TestCase):
+
+    def test_frame(self):
+        # The error is read from the third cell from the end
+        page = create_page(5).replace('<td>10</td>', '<td></td>')
+        table = BeautifulSoup(page, 'html.parser').findAll(
+            'table', class_='wikitable')[0]
+        polls = poll_from_table(table, **TestStreamingParser.kwargs)
+        self.assertEqual([p.error for p in polls.polls], [None] * 5)
+
+        errors = polls.frame().errors
+        np.testing.assert_array_equal(errors, [np.nan] * 5)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'polls.bin')
+            polls.save(path)
+            np.testing.assert_array_equal(
+                mapache.PollsList.load(path).frame().errors, errors)
+
+    def test_error_not_a_number(self):
+        poll = mapache.Poll({'PP': 30.}, datetime.datetime(2016, 6, 1),
+                            error='')
+        polls = mapache.PollsList()
+        polls.add(poll)
+        self.assertTrue(np.isnan(polls.frame().errors[0]))
+
+
+class TestPollsFromTables(unittest.TestCase):
+
+    def test_merged_by_date(self):
+        kwargs = TestStreamingParser.kwargs
+        pages = [create_page(30), create_page(40)]
+        tables = [BeautifulSoup(p, 'html.parser').findAll(
+            'table', class_='wikitable')[0] for p in pages]
+        polls = mapache.parseutils.polls_from_tables(tables, kwargs,
+                                                     processes=2)
+        expected = []
+        for t in tables:
+            expected.extend(poll_from_table(t, **kwargs).polls)
+        expected.sort(key=lambda p: p.date)
+        self.assertEqual(as_tuples(polls.polls), as_tuples(expected))
+
+        serial = mapache.parseutils.polls_from_tables(pages, [kwargs] * 2,
+                                                      processes=1, html=True)
+        self.assertEqual(as_tuples(serial.polls), as_tuples(expected))
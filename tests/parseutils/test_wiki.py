@@ -0,0 +1,95 @@
+"""mapache.parseutils tests with a local stand-in for wikipedia."""
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import functools
+import http.server
+
+from PIL import Image
+
+import sys
+sys.path.append('../')
+import mapache
+from mapache.parseutils import parties_from_wiki
+
+party_page = """<html><body>
+<table class="infobox vcard">
+<tr><td class="logo"><img src="//{host}/{logo}"></td></tr>
+<tr><td><span class="fn org">{full_name}</span></td></tr>
+<tr><td class="nickname">{short_name}</td></tr>
+</table>
+</body></html>"""
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalWiki:
+    """Serve the files of a temporary directory over HTTP."""
+
+    def __init__(self):
+        self.path = tempfile.mkdtemp()
+        handler = functools.partial(_QuietHandler, directory=self.path)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      handler)
+        self.host = '127.0.0.1:{0}'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self, name):
+        return 'http://{0}/{1}'.format(self.host, name)
+
+    def write(self, name, content):
+        with open(os.path.join(self.path, name), 'w') as f:
+            f.write(content)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.path)
+
+
+class TestPartiesFromWiki(unittest.TestCase):
+
+    parties = [('Partido Popular', 'PP', (0, 100, 200)),
+               ('Partido Socialista Obrero Espanol', 'PSOE', (220, 0, 0)),
+               ('Ciudadanos', "C's", (250, 120, 0))]
+
+    def setUp(self):
+        self.wiki = LocalWiki()
+        self.urls = []
+        for i, (full_name, short_name, color) in enumerate(self.parties):
+            logo = 'logo{0}.png'.format(i)
+            Image.new('RGB', (300, 150), color).save(
+                os.path.join(self.wiki.path, logo))
+            page = 'party{0}.html'.format(i)
+            self.wiki.write(page, party_page.format(
+                host=self.wiki.host, logo=logo, full_name=full_name,
+                short_name=short_name))
+            self.urls.append(self.wiki.url(page))
+
+    def tearDown(self):
+        self.wiki.close()
+
+    def test_parties_from_wiki(self):
+        party_set = parties_from_wiki(self.urls, context_name='test',
+                                      max_workers=2)
+        self.assertEqual(list(party_set.keys()), ['PP', 'PSOE', "C'S"])
+        for (full_name, short_name, color), party in zip(
+                self.parties, party_set.parties.values()):
+            self.assertEqual(party.full_name, full_name)
+            self.assertEqual(party.short_name, short_name)
+            for c, expected in zip(party.color, color):
+                self.assertAlmostEqual(c, expected / 255.)
+
+    def test_names(self):
+        party_set = parties_from_wiki(self.urls[:1], names=['Populares'])
+        self.assertEqual(party_set['PP'].name, 'Populares')